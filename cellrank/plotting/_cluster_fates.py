@@ -17,7 +17,7 @@ import scvelo as scv
 from anndata import AnnData
 from scanpy import logging as logg
 
-from cellrank.tools._exact_mc_test import _cramers_v, _counts
+from cellrank.tools._exact_mc_test import _cramers_v_matrix, _counts
 from cellrank.tools._constants import LinKey
 from cellrank.plotting._utils import _position_legend
 from cellrank.tools._utils import save_fig
@@ -356,18 +356,18 @@ def cluster_fates(
         adata = adata[np.isin(adata.obs[cluster_key], clusters)].copy()
         adata.obsm[lk] = Lineage(adata.obsm[lk], names=names, colors=colors)
 
+    labels = (
+        np.full((adata.n_obs,), "All")
+        if cluster_key is None
+        else adata.obs[cluster_key]
+    )
+    groups = adata.obsm[lk][:, lin_names].groupby(labels)
+    means, stds = groups.mean(), groups.std()
+    stds = stds.div(np.sqrt(groups.counts()), axis=0)
+
     d = odict()
     for name in clusters:
-        mask = (
-            np.ones((adata.n_obs,), dtype=np.bool)
-            if name == "All"
-            else (adata.obs[cluster_key] == name).values
-        )
-        mask = list(np.array(mask, dtype=np.bool))
-        data = adata.obsm[lk][mask, lin_names].X
-        mean = np.nanmean(data, axis=0)
-        std = np.nanstd(data, axis=0) / np.sqrt(data.shape[0])
-        d[name] = [mean, std]
+        d[name] = [means.loc[name].values, stds.loc[name].values]
 
     logg.debug(f"DEBUG: Using mode: `{mode!r}`")
     if mode == "bar":
@@ -404,6 +404,7 @@ def similarity_plot(
     figsize: Tuple[float, float] = (12, 10),
     dpi: Optional[int] = None,
     final: bool = True,
+    seed: Optional[int] = None,
     save: Optional[Union[str, Path]] = None,
 ) -> None:
     """
@@ -440,6 +441,8 @@ def similarity_plot(
         Dots per inch.
     final
         Whether to consider cells going to final states or vice versa.
+    seed
+        Random seed for sampling the cells. If `None`, use the global random state of :mod:`numpy`.
     save
         Filename where to save the plot.
         If `None`, just shows the plot.
@@ -458,14 +461,12 @@ def similarity_plot(
         clusters=clusters,
         n_samples=n_samples,
         final=final,
+        seed=seed,
     )
 
     cluster_names = list(data.keys())
     logg.debug("DEBUG: Calculating Cramer`s V statistic")
-    sim = [
-        [1 - _cramers_v(data[name2], data[name]) for name in cluster_names]
-        for name2 in cluster_names
-    ]
+    sim = 1 - _cramers_v_matrix(np.array([data[name] for name in cluster_names]))
 
     # Plotting function
     fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
@@ -11,60 +11,12 @@ import scanpy as sc
 from anndata import AnnData
 from scanpy import logging as logg
 
-from cellrank.plotting._utils import _is_any_gam_mgcv, _create_models, _model_type
+from cellrank.plotting._utils import _model_type
 from cellrank.tools._constants import LinKey
+from cellrank.tools._trends import iter_trends
 from cellrank.tools._utils import save_fig
-from cellrank.utils._parallelize import parallelize
+from cellrank.utils._executors import Executor
 from cellrank.utils._utils import check_collection, _get_n_cores
-from cellrank.utils.models._models import Model
-
-
-def _cl_process(
-    genes: Sequence[str],
-    models: Dict[str, Dict[str, Model]],
-    lineage_name: str,
-    norm: str,
-    queue,
-    **kwargs,
-):
-    """
-    Fit models to genes in a given lineages. Used by :func:`cellrank.pl.cluster_lineage`.
-
-    Params
-    ------
-    genes
-        Genes or observations for which to fit the models.
-    models
-        Gene and lineage specific models.
-    lineage_name
-        Name of the lineage for which to fit the models.
-    norm
-        Whether to z-normalize the fitted values.
-    queue
-        Signalling queue in the parent process/thread used to update the progress bar.
-    kwargs
-        Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
-
-    Returns
-    -------
-    """
-
-    res = []
-    for gene in genes:
-        model = models[gene][lineage_name].prepare(gene, lineage_name, **kwargs).fit()
-        res.append(model.predict())
-        queue.put(1)
-    queue.put(None)
-
-    res = np.squeeze(np.array(res))
-
-    if not norm:
-        return res
-
-    mean = np.expand_dims(np.mean(res, 1), -1)
-    sd = np.expand_dims(np.sqrt(np.var(res, 1)), -1)
-
-    return (res - mean) / sd
 
 
 def cluster_lineage(
@@ -82,7 +34,7 @@ def cluster_lineage(
     ncols: int = 3,
     sharey: bool = False,
     n_jobs: Optional[int] = 1,
-    backend: str = "multiprocessing",
+    backend: Union[str, Executor] = "multiprocessing",
     pca_kwargs: Dict = MappingProxyType({"svd_solver": "arpack"}),
     neighbors_kwargs: Dict = MappingProxyType({"use_rep": "X"}),
     louvain_kwargs: Dict = MappingProxyType({}),
@@ -132,6 +84,7 @@ def cluster_lineage(
         Whether to z-normalize each trend to have `0` mean, `1` variance.
     recompute
         If `True`, recompute the clustering, otherwise try to find already existing one.
+        The trends themselves are taken from :func:`cellrank.ul.get_trend_cache`, if possible.
     ncols
         Number of columns for the plot.
     sharey
@@ -140,7 +93,8 @@ def cluster_lineage(
         Number of parallel jobs. If `-1`, use all available cores. If `None` or `1`, the execution is sequential.
     backend
         Which backend to use for multiprocessing.
-        See :class:`joblib.Parallel` for valid options.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`.
     pca_kwargs
         Keyword arguments for :func:`scanpy.pp.pca`.
     neighbors_kwargs
@@ -190,25 +144,31 @@ def cluster_lineage(
         kwargs["n_test_points"] = n_points
         kwargs["final"] = final
 
-        models = _create_models(model, genes, [lineage])
-        if _is_any_gam_mgcv(models):
-            backend = "multiprocessing"
-
         n_jobs = _get_n_cores(n_jobs, len(genes))
 
         start = logg.info(f"Computing trends using `{n_jobs}` core(s)")
-        trends = parallelize(
-            _cl_process,
-            genes,
-            as_array=True,
-            unit="gene",
-            n_jobs=n_jobs,
-            backend=backend,
-            show_progress_bar=show_progress_bar,
-        )(models, lineage, norm, **kwargs)
+        res = {
+            trend.gene: trend.y_test
+            for trend in iter_trends(
+                adata,
+                model,
+                genes,
+                lineages=[lineage],
+                n_jobs=n_jobs,
+                backend=backend,
+                show_progress_bar=show_progress_bar,
+                **kwargs,
+            )
+        }
         logg.info("    Finish", time=start)
 
-        trends = AnnData(np.vstack(trends))
+        trends = np.vstack([res[gene] for gene in genes])
+        if norm:
+            mean = np.mean(trends, axis=1, keepdims=True)
+            sd = np.std(trends, axis=1, keepdims=True)
+            trends = (trends - mean) / sd
+
+        trends = AnnData(trends)
         trends.obs_names = genes
 
         # sanity check
@@ -18,13 +18,25 @@ from cellrank.plotting._utils import (
     _trends_helper,
     _is_any_gam_mgcv,
     _fit,
+    _merge_trends,
+    _lookup_trends,
+    _to_fitted_trends,
     _create_models,
     _model_type,
 )
 from cellrank.tools._constants import LinKey
 from cellrank.tools._utils import save_fig
+from cellrank.utils._cache import get_trend_cache
+from cellrank.utils._executors import Executor, _is_thread_backend
 from cellrank.utils._parallelize import parallelize
-from cellrank.utils._utils import check_collection, _make_unique, _get_n_cores
+from cellrank.utils._shared import shared_models
+from cellrank.utils.models._models import _Preparer, _put_trends
+from cellrank.utils._utils import (
+    check_collection,
+    _make_unique,
+    _get_n_cores,
+    _get_gene_costs,
+)
 
 
 def gene_trends(
@@ -55,7 +67,7 @@ def gene_trends(
     dpi: Optional[int] = None,
     ncols: int = 2,
     n_jobs: Optional[int] = 1,
-    backend: str = "multiprocessing",
+    backend: Union[str, Executor] = "multiprocessing",
     ext: str = "png",
     suptitle: Optional[str] = None,
     save: Optional[Union[str, Path]] = None,
@@ -70,6 +82,7 @@ def gene_trends(
     Each lineage is defined via it's lineage weights which we compute using :func:`cellrank.tl.lineages`. This
     function accepts any `scikit-learn` model wrapped in :class:`cellrank.ul.models.SKLearnModel`
     to fit gene expression, where we take the lineage weights into account in the loss function.
+    Trends found in :func:`cellrank.ul.get_trend_cache` are not fitted again.
 
     .. image:: https://raw.githubusercontent.com/theislab/cellrank/master/resources/images/gene_trends.png
        :width: 400px
@@ -150,7 +163,8 @@ def gene_trends(
         Number of parallel jobs. If `-1`, use all available cores. If `None` or `1`, the execution is sequential.
     backend
         Which backend to use for multiprocessing.
-        See :class:`joblib.Parallel` for valid options.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`.
     ext
         Extension to use when saving files, such as `'pdf'`.
         Only used when :paramref:`same_plot` `=False`.
@@ -248,33 +262,75 @@ def gene_trends(
     kwargs["data_key"] = data_key
     kwargs["final"] = final
     kwargs["conf_int"] = conf_int
+    kwargs["cache"] = get_trend_cache()
 
     plot_kwargs = dict(plot_kwargs)
     if plot_kwargs.get("xlabel", None) is None:
         plot_kwargs["xlabel"] = kwargs.get("time_key", None)
 
-    if _is_any_gam_mgcv(kwargs["models"]):
+    strict_backend = False
+    if _is_any_gam_mgcv(kwargs["models"]) and _is_thread_backend(backend):
         logg.debug(
             "DEBUG: Setting backend to multiprocessing because model is `GamMGCV`"
         )
         backend = "multiprocessing"
+        strict_backend = True
 
     n_jobs = _get_n_cores(n_jobs, len(genes))
 
     start = logg.info(f"Computing trends using `{n_jobs}` core(s)")
-    models = parallelize(
-        _fit,
-        genes,
-        unit="gene" if data_key != "obs" else "obs",
-        backend=backend,
-        n_jobs=n_jobs,
-        extractor=lambda modelss: {k: v for m in modelss for k, v in m.items()},
-        show_progress_bar=show_progres_bar,
-    )(lineages, start_lineage, end_lineage, **kwargs)
+    hits, keys, fit_kwargs = _lookup_trends(
+        genes, lineages, start_lineage, end_lineage, n_jobs, backend, **kwargs
+    )
+    missing = [gene for gene in genes if gene not in hits]
+    trends = {}
+    if missing:
+        with shared_models(
+            adata,
+            kwargs["models"],
+            missing,
+            backend=backend if n_jobs > 1 else "sequential",
+            data_key=data_key,
+            time_key=kwargs.get("time_key", "latent_time"),
+        ):
+            trends = parallelize(
+                _fit,
+                missing,
+                unit="gene" if data_key != "obs" else "obs",
+                backend=backend,
+                strict_backend=strict_backend,
+                n_jobs=n_jobs,
+                extractor=_merge_trends,
+                show_progress_bar=show_progres_bar,
+                scheduler="dynamic",
+                costs=_get_gene_costs(adata, missing, data_key),
+            )(lineages, start_lineage, end_lineage, **fit_kwargs)
+        _put_trends(
+            kwargs["cache"], keys, [t for ts in trends.values() for t in ts.values()]
+        )
+    trends = _merge_trends([trends, _to_fitted_trends(hits, conf_int)])
     logg.info("    Finish", time=start)
 
+    # only the predictions were kept, the models are reconstructed one gene at a time
+    prepare = _Preparer(genes)
+    prepare_kwargs = {
+        k: v for k, v in kwargs.items() if k not in ("models", "conf_int", "cache")
+    }
+
     logg.debug("DEBUG: Plotting trends")
     for i, (gene, ax) in enumerate(zip(genes, axes)):
+        models = {
+            gene: {
+                ln: trends[gene][ln].to_model(
+                    prepare,
+                    kwargs["models"][gene][ln],
+                    start_lineage=sc,
+                    end_lineage=ec,
+                    **prepare_kwargs,
+                )
+                for ln, sc, ec in zip(lineages, start_lineage, end_lineage)
+            }
+        }
         f = (
             None
             if (same_plot or dirname is None)
@@ -15,11 +15,23 @@ import seaborn as sns
 from anndata import AnnData
 from matplotlib.ticker import FormatStrFormatter
 
-from cellrank.plotting._utils import _create_models, _fit, _is_any_gam_mgcv, _model_type
+from cellrank.plotting._utils import (
+    _create_models,
+    _fit,
+    _merge_trends,
+    _lookup_trends,
+    _to_fitted_trends,
+    _is_any_gam_mgcv,
+    _model_type,
+)
 from cellrank.tools._constants import LinKey
 from cellrank.tools._utils import save_fig
+from cellrank.utils._cache import get_trend_cache
+from cellrank.utils._executors import Executor, _is_thread_backend
 from cellrank.utils._parallelize import parallelize
-from cellrank.utils._utils import _get_n_cores, check_collection
+from cellrank.utils._shared import shared_models
+from cellrank.utils._utils import _get_n_cores, check_collection, _get_gene_costs
+from cellrank.utils.models._models import _put_trends
 
 
 def heatmap(
@@ -36,7 +48,7 @@ def heatmap(
     xlabel: Optional[str] = None,
     cmap: colors.ListedColormap = cm.Spectral_r,
     n_jobs: Optional[int] = 1,
-    backend: str = "multiprocessing",
+    backend: Union[str, Executor] = "multiprocessing",
     hspace: float = 0.25,
     figsize: Optional[Tuple[float, float]] = None,
     dpi: Optional[int] = None,
@@ -47,6 +59,8 @@ def heatmap(
     """
     Plot a heatmap of smoothed gene expression along specified lineages.
 
+    Trends found in :func:`cellrank.ul.get_trend_cache` are not fitted again.
+
     .. image:: https://raw.githubusercontent.com/theislab/cellrank/master/resources/images/heatmap.png
        :width: 400px
        :align: center
@@ -91,7 +105,8 @@ def heatmap(
         Number of parallel jobs. If `-1`, use all available cores. If `None` or `1`, the execution is sequential.
     backend
         Which backend to use for multiprocessing.
-        See :class:`joblib.Parallel` for valid options.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`.
     figsize
         Size of the figure.
         If `None`, it will be set to (15, len(:paramref:`genes`) + len(:paramref:`lineage_names`)).
@@ -273,23 +288,48 @@ def heatmap(
                 raise ValueError(f"{typp} lineage `{cl!r}` not found in lineage names.")
 
     kwargs["models"] = _create_models(model, genes, lineages)
-    if _is_any_gam_mgcv(kwargs["models"]):
+    kwargs["cache"] = get_trend_cache()
+    strict_backend = False
+    if _is_any_gam_mgcv(kwargs["models"]) and _is_thread_backend(backend):
         logg.debug(
             "DEBUG: Setting backend to multiprocessing because model is `GamMGCV`"
         )
         backend = "multiprocessing"
+        strict_backend = True
 
     n_jobs = _get_n_cores(n_jobs, len(genes))
     start = logg.info(f"Computing trends using `{n_jobs}` core(s)")
-    data = parallelize(
-        _fit,
-        genes,
-        unit="gene",
-        backend=backend,
-        n_jobs=n_jobs,
-        extractor=lambda data: {k: v for d in data for k, v in d.items()},
-        show_progress_bar=show_progress_bar,
-    )(lineages, start_lineage, end_lineage, **kwargs)
+    hits, keys, fit_kwargs = _lookup_trends(
+        genes, lineages, start_lineage, end_lineage, n_jobs, backend, **kwargs
+    )
+    missing = [gene for gene in genes if gene not in hits]
+    data = {}
+    if missing:
+        with shared_models(
+            adata,
+            kwargs["models"],
+            missing,
+            backend=backend if n_jobs > 1 else "sequential",
+            data_key=kwargs.get("data_key", "X"),
+            time_key=kwargs.get("time_key", "latent_time"),
+        ):
+            data = parallelize(
+                _fit,
+                missing,
+                unit="gene",
+                backend=backend,
+                strict_backend=strict_backend,
+                n_jobs=n_jobs,
+                extractor=_merge_trends,
+                show_progress_bar=show_progress_bar,
+                scheduler="dynamic",
+                costs=_get_gene_costs(adata, missing, kwargs.get("data_key", "X")),
+            )(lineages, start_lineage, end_lineage, **fit_kwargs)
+        _put_trends(
+            kwargs["cache"], keys, [t for ts in data.values() for t in ts.values()]
+        )
+    data = _merge_trends([data, _to_fitted_trends(hits)])
+    data = {gene: data[gene] for gene in genes}
     logg.info("    Finish", time=start)
     logg.debug(f"DEBUG: Plotting {kind} heatmap")
 
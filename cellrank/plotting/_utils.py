@@ -15,6 +15,8 @@ from anndata import AnnData
 from pandas.core.dtypes.common import is_categorical_dtype
 
 from cellrank.utils.models import Model, GamMGCVModel
+from cellrank.utils.models._models import _Preparer
+from cellrank.utils._executors import Executor, _is_thread_backend
 from cellrank.tools._utils import save_fig
 from cellrank.tools.kernels import VelocityKernel
 from cellrank.tools._constants import _colors
@@ -323,7 +325,8 @@ def _create_models(
 
     Returns
     -------
-        The created models.
+        The created models. The models are not copied, the same instance is referenced by all genes and lineages
+        it was specified for. They are only copied when being fitted.
     """
 
     def process_lineages(obs_name: str, lin_names: Union[Model, Dict[str, Any]]):
@@ -336,16 +339,16 @@ def _create_models(
         for lin_name, mod in lin_names.items():
             if lin_name == "*":
                 continue
-            models[obs_name][lin_name] = copy(mod)
+            models[obs_name][lin_name] = mod
 
         if lin_rest_model is not None:
             for lin_name in lineages - set(models[obs_name].keys()):
-                models[obs_name][lin_name] = copy(lin_rest_model)
+                models[obs_name][lin_name] = lin_rest_model
         elif set(models[obs_name].keys()) != lineages:
             raise RuntimeError(_ERROR_INCOMPLETE_SPEC.format(" lineage ", obs_name))
 
     if isinstance(model, Model):
-        return {o: {l: copy(model) for l in lineages} for o in obs}
+        return {o: {l: model for l in lineages} for o in obs}
 
     lineages, obs = set(lineages), set(obs)
     models = defaultdict(dict)
@@ -371,6 +374,192 @@ def _create_models(
     return models
 
 
+class _FittedTrend:
+    """
+    Predictions of a model fitted for one gene in one lineage, without the data it was fitted on.
+
+    Params
+    ------
+    gene
+        Name of the gene.
+    lineage
+        Name of the lineage.
+    x_test
+        Test points of shape `(n_test_points,)`, shared by all trends of the same lineage.
+    y_test
+        Predictions of shape `(n_test_points,)`.
+    conf_int
+        Confidence interval of shape `(n_test_points, 2)` or `None`.
+    """
+
+    __slots__ = ("gene", "lineage", "x_test", "y_test", "conf_int")
+
+    def __init__(
+        self,
+        gene: str,
+        lineage: Optional[str],
+        x_test: np.ndarray,
+        y_test: np.ndarray,
+        conf_int: Optional[np.ndarray] = None,
+    ):
+        self.gene = gene
+        self.lineage = lineage
+        self.x_test = x_test
+        self.y_test = y_test
+        self.conf_int = conf_int
+
+    def to_model(self, prepare: _Preparer, model: Model, **kwargs) -> Model:
+        """
+        Reconstruct a prepared model with the predictions of this trend, e.g. for plotting.
+
+        Params
+        ------
+        prepare
+            Preparer sharing the plans between the reconstructed models.
+        model
+            Model which was fitted. It is copied, not modified.
+        kwargs
+            Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+        Returns
+        -------
+        :class:`cellrank.ul.models.Model`
+            The prepared, but not fitted, model.
+        """
+
+        model = prepare(copy(model), self.gene, self.lineage, **kwargs)
+        model._y_test = self.y_test
+        model._conf_int = self.conf_int
+
+        return model
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}[gene={self.gene!r}, lineage={self.lineage!r}]"
+        )
+
+
+def _merge_trends(
+    chunks: Iterable[Dict[str, Dict[str, _FittedTrend]]]
+) -> Dict[str, Dict[str, _FittedTrend]]:
+    """
+    Merge the trends fitted in chunks of genes, sharing the equal test points of each lineage.
+
+    Params
+    ------
+    chunks
+        Trends of each chunk.
+
+    Returns
+    -------
+        The trends of all genes.
+    """
+
+    res, x_tests = {}, {}
+    for chunk in chunks:
+        for gene, trends in chunk.items():
+            for ln, trend in trends.items():
+                shared = x_tests.get(ln, None)
+                if shared is not None and np.array_equal(shared, trend.x_test):
+                    trend.x_test = shared
+                else:
+                    x_tests[ln] = trend.x_test
+            res[gene] = trends
+
+    return res
+
+
+def _lookup_trends(
+    genes: Sequence[str],
+    lineage_names: Sequence[Optional[str]],
+    start_lineages: Sequence[Optional[str]],
+    end_lineages: Sequence[Optional[str]],
+    n_jobs: int,
+    backend: Union[str, Executor],
+    **kwargs,
+) -> Tuple[
+    Dict[str, Dict[str, Tuple[np.ndarray, ...]]],
+    Dict[Tuple[str, Optional[str]], str],
+    Dict[str, Any],
+]:
+    """
+    Look up the trends in the cache before dispatching the genes to other processes, which don't share it.
+
+    Params
+    ------
+    genes
+        Genes for which to look up the trends.
+    lineage_names
+        Lineages for which to look up the trends.
+    start_lineages
+        Start clusters for given :paramref:`lineage_names`.
+    end_lineages
+        End clusters for given :paramref:`lineage_names`.
+    n_jobs
+        Number of parallel jobs.
+    backend
+        Backend which will fit the trends.
+    kwargs
+        Keyword arguments for :func:`cellrank.utils.models.Model.prepare`, the `models`,
+        whether to compute the `conf_int` and the trend `cache`.
+
+    Returns
+    -------
+        The test points, predictions and confidence intervals of the genes found in the cache, the keys under which
+        to store the trends of the remaining genes, see :func:`cellrank.utils.models._models._put_trends`,
+        and the keyword arguments for the workers. If the trends are fitted in this process, nothing is looked up.
+    """
+
+    if n_jobs == 1 or _is_thread_backend(backend) or kwargs.get("cache", None) is None:
+        return {}, {}, kwargs
+
+    kwargs = dict(kwargs)
+    models = kwargs.pop("models")
+    hits, keys = _Preparer(genes).lookup(
+        models, lineage_names, start_lineages, end_lineages, **kwargs
+    )
+    # the workers only fit the missing trends, they're stored by the caller
+    kwargs["models"], kwargs["cache"] = models, None
+
+    return hits, keys, kwargs
+
+
+def _to_fitted_trends(
+    hits: Dict[str, Dict[str, Tuple[np.ndarray, ...]]], conf_int: bool = False
+) -> Dict[str, Dict[str, _FittedTrend]]:
+    """
+    Convert the trends found by :func:`_lookup_trends` to the format returned by :func:`_fit`.
+
+    Params
+    ------
+    hits
+        Test points, predictions and confidence intervals for each gene and lineage.
+    conf_int
+        Whether to keep the confidence intervals.
+
+    Returns
+    -------
+        The trends.
+    """
+
+    return {
+        gene: {
+            ln: _FittedTrend(
+                gene, ln, np.ravel(x_test), np.ravel(y_test), ci if conf_int else None
+            )
+            for ln, (x_test, y_test, ci) in trends.items()
+        }
+        for gene, trends in hits.items()
+    }
+
+
 def _fit(
     genes: Sequence[str],
     lineage_names: Sequence[Optional[str]],
@@ -378,7 +567,7 @@ def _fit(
     end_lineages: Sequence[Optional[str]],
     queue,
     **kwargs,
-) -> Dict[str, Dict[str, Any]]:
+) -> Dict[str, Dict[str, _FittedTrend]]:
     """
     Fit model for given genes and lineages.
 
@@ -393,36 +582,41 @@ def _fit(
     end_lineages
         End clusters for given :paramref:`lineage_names`.
     queue
-        Signalling queue in the parent process/thread used to update the progress bar.
+        Progress channel used to update the progress bar, see :class:`cellrank.utils._progress.ProgressChannel`.
     kwargs
-        Keyword arguments for :func:`cellrank.utils.models.Model.prepare`.
+        Keyword arguments for :func:`cellrank.utils.models.Model.prepare`, the `models`,
+        whether to compute the `conf_int` and the trend `cache`.
 
     Returns
     -------
-        The fitted models, optionally containing the confidence interval.
+        The fitted trends, optionally containing the confidence interval. The fitted models are discarded.
     """
 
     res = {}
+    prepare = _Preparer(genes)
     models = kwargs.pop("models")
-    conf_int = kwargs.pop("conf_int", False)
-
-    for gene in genes:
-        res[gene] = {}
-        for ln, sc, ec in zip(lineage_names, start_lineages, end_lineages):
-            model = (
-                models[gene][ln]
-                .prepare(gene, ln, start_lineage=sc, end_lineage=ec, **kwargs)
-                .fit()
-            )
-            model.predict()
-            if conf_int:
-                model.confidence_interval()
-
-            res[gene][ln] = model
-        queue.put(1)
+    conf_int = kwargs.get("conf_int", False)
+
+    for block in prepare.fit_blocks(
+        models, lineage_names, start_lineages, end_lineages, **kwargs
+    ):
+        for gene, fitted in block:
+            res[gene] = {
+                ln: _FittedTrend(
+                    gene,
+                    ln,
+                    np.ravel(model.x_test),
+                    np.ravel(model.y_test),
+                    model.conf_int if conf_int else None,
+                )
+                for ln, model in fitted.items()
+            }
+        # the genes of a block are fitted together
+        queue.put(len(block))
     queue.put(None)
 
-    return res
+    # the test points are the same for all genes, store them once per lineage
+    return _merge_trends([res])
 
 
 def _trends_helper(
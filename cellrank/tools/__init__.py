@@ -4,8 +4,9 @@ from cellrank.tools._utils import partition, cyto_trace
 from cellrank.tools._transition_matrix import transition_matrix
 from cellrank.tools._exact_mc_test import exact_mc_perm_test
 from cellrank.tools._markov_chain import MarkovChain
-from cellrank.tools._root_final import find_root, find_final
+from cellrank.tools._root_final import find_root, find_final, root_final
 from cellrank.tools._lineages import lineages
 from cellrank.tools._lineage import Lineage
+from cellrank.tools._trends import iter_trends
 
 import cellrank.tools.kernels
@@ -2,39 +2,250 @@
 from typing import List, Callable, Dict, Optional, Sequence, Union, Tuple
 from anndata import AnnData
 from scanpy import logging as logg
-from scipy.spatial.distance import euclidean
+from scipy.spatial.distance import (
+    euclidean,
+    sqeuclidean,
+    cityblock,
+    chebyshev,
+    cosine,
+    correlation,
+    jensenshannon,
+)
+from scipy.special import rel_entr
 
 from cellrank.tools._constants import LinKey
+from cellrank.utils._executors import Executor
+from cellrank.utils._parallelize import parallelize
 
 import numpy as np
 import scipy.stats as ss
 import matplotlib.pyplot as plt
 
 
-def _get_counts(pd: Union[np.ndarray, List[float]], n: int) -> List[float]:
+_PERMS_PER_BLOCK = 256
+
+
+def _get_state(
+    seed: Union[int, np.random.Generator, None] = None
+) -> Union[np.random.Generator, np.random.RandomState]:
+    """
+    Return the random number generator for :paramref:`seed`.
+
+    Params
+    ------
+    seed
+        Seed, generator or `None`, in which case the global random state of :mod:`numpy` is used.
+
+    Returns
+    -------
+    :class:`numpy.random.Generator`
+        The generator or the :mod:`numpy.random` module.
+    """
+
+    if seed is None:
+        return np.random
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def _integers(
+    state: Union[np.random.Generator, np.random.RandomState], high: int, size: int
+) -> np.ndarray:
+    if isinstance(state, np.random.Generator):
+        return state.integers(high, size=size)
+    return state.randint(high, size=size)
+
+
+def _sample_categories(
+    cdf: np.ndarray, rows: np.ndarray, samples: np.ndarray
+) -> np.ndarray:
     """
-    Generate a list of counts that follows a given probability distribution.
+    Sample the categories using the inverse of the cumulative distribution functions.
+
+    The rows of :paramref:`cdf` are shifted by their index, so that the categories of all samples are found
+    with a single :func:`numpy.searchsorted`.
+
+    Params
+    ------
+    cdf
+        Cumulative distribution functions of shape `(n_distributions, n_categories)`, normalized to end at `1`.
+    rows
+        Index of the distribution of each sample.
+    samples
+        Uniformly distributed samples from `[0, 1)` of the same shape as :paramref:`rows`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The sampled categories.
+    """
+
+    n_categories = cdf.shape[1]
+    shifted = (cdf + np.arange(len(cdf))[:, np.newaxis]).ravel()
+    ixs = np.searchsorted(shifted, rows + samples, side="right")
+
+    return np.minimum(ixs - rows * n_categories, n_categories - 1)
+
+
+def _get_counts(
+    pd: Union[np.ndarray, List[float]],
+    n: int,
+    state: Union[np.random.Generator, np.random.RandomState, None] = None,
+) -> np.ndarray:
+    """
+    Generate counts that follow a given probability distribution.
 
     Parameters
     -----------
     pd
-        Probability distribution used to generate the samples.
+        Probability distribution used to generate the samples. If 2-dimensional, generate counts for each row.
     n
         Total number of samples.
+    state
+        Random number generator. If `None`, use the global one.
 
     returns
     --------
-    :class:`list`
-        The counts.
+    :class:`numpy.ndarray`
+        The counts of the same shape as :paramref:`pd`.
     """
 
-    l = list(np.random.choice(np.arange(len(pd)), n, p=pd))
-    freq = [l.count(i) for i in np.arange(len(pd))]  # list of counts
-    freq = [
-        i if i > 0 else i + 1e-5 for i in freq
-    ]  # replace end points with zero counts by a small number
+    state = np.random if state is None else state
+    pd = np.asarray(pd, dtype=np.float64)
+    cdf = np.cumsum(np.atleast_2d(pd), axis=1)
+    cdf /= cdf[:, -1:]
+
+    rows = np.repeat(np.arange(len(cdf)), n)
+    cats = _sample_categories(cdf, rows, state.random(len(rows)))
+    freq = np.bincount(rows * cdf.shape[1] + cats, minlength=cdf.size).reshape(
+        cdf.shape
+    )
+    # replace end points with zero counts by a small number
+    freq = np.where(freq > 0, freq, 1e-5)
+
+    return freq.reshape(pd.shape)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.sum(x, axis=1, keepdims=True)
+
+
+def _jensenshannon(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    x, y = _normalize(x), _normalize(y)
+    m = (x + y) / 2
+
+    return np.sqrt(
+        np.sum(rel_entr(x, m), axis=1) / 2 + np.sum(rel_entr(y, m), axis=1) / 2
+    )
+
+
+def _cosine(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return 1 - np.sum(x * y, axis=1) / (
+        np.linalg.norm(x, axis=1) * np.linalg.norm(y, axis=1)
+    )
+
 
-    return freq
+def _correlation(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return _cosine(
+        x - np.mean(x, axis=1, keepdims=True), y - np.mean(y, axis=1, keepdims=True)
+    )
+
+
+# row-wise versions of the common distance measures, only used without any keyword arguments
+_VECTORISED_DISTS = {
+    euclidean: lambda x, y: np.linalg.norm(x - y, axis=1),
+    sqeuclidean: lambda x, y: np.sum((x - y) ** 2, axis=1),
+    cityblock: lambda x, y: np.sum(np.abs(x - y), axis=1),
+    chebyshev: lambda x, y: np.max(np.abs(x - y), axis=1),
+    cosine: _cosine,
+    correlation: _correlation,
+    jensenshannon: _jensenshannon,
+}
+
+
+def _perm_dists(
+    blocks: Sequence[int],
+    data: np.ndarray,
+    n: int,
+    n_perms: int,
+    seeds: Sequence[np.random.SeedSequence],
+    dist_measure: Callable[[Sequence[float], Sequence[float]], float],
+    use_counts: bool,
+    n_counts: int,
+    queue,
+    **kwargs,
+) -> np.ndarray:
+    """
+    Compute the distances between the average distributions of the permuted clusters for blocks of permutations.
+
+    The cells in the first cluster of each permutation are encoded in a `(n_permutations, n_cells)` indicator matrix,
+    so the averages of all permutations in a block are computed using matrix products.
+
+    Params
+    ------
+    blocks
+        Indices of the blocks of :data:`_PERMS_PER_BLOCK` permutations.
+    data
+        Distributions of the cells from both clusters.
+    n
+        Number of cells in the first cluster.
+    n_perms
+        Total number of permutations.
+    seeds
+        Seeds of all blocks.
+    dist_measure
+        Distance measure to use.
+    use_counts
+        Whether to use counts distribution or probability distribution.
+    n_counts
+        Number of total counts used to calculate the counts distributions.
+    queue
+        Progress channel used to update the progress bar, see :class:`cellrank.utils._progress.ProgressChannel`.
+    kwargs
+        Keyword arguments for :paramref:`dist_measure`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The distances of all permutations in :paramref:`blocks`.
+    """
+
+    vectorised = None if kwargs else _VECTORISED_DISTS.get(dist_measure, None)
+
+    mask = ~np.isnan(data)
+    values = np.where(mask, data, 0)
+    mask = mask.astype(np.float64)
+    total_values, total_counts = values.sum(0), mask.sum(0)
+
+    res = []
+    for block in blocks:
+        rng = np.random.default_rng(seeds[block])
+        size = min(_PERMS_PER_BLOCK, n_perms - block * _PERMS_PER_BLOCK)
+
+        perms = np.argsort(rng.random((size, len(data))), axis=1)[:, :n]
+        indicator = np.zeros((size, len(data)))
+        np.put_along_axis(indicator, perms, 1, axis=1)
+
+        # average of both clusters ignoring nan values
+        xs_values, xs_counts = indicator @ values, indicator @ mask
+        with np.errstate(invalid="ignore", divide="ignore"):
+            xs = xs_values / xs_counts
+            ys = (total_values - xs_values) / (total_counts - xs_counts)
+
+        if use_counts:
+            xs = _get_counts(xs, n_counts, rng)
+            ys = _get_counts(ys, n_counts, rng)
+
+        if vectorised is not None:
+            res.append(vectorised(xs, ys))
+        else:
+            res.append(np.array([dist_measure(x, y, **kwargs) for x, y in zip(xs, ys)]))
+
+        queue.put(1)
+    queue.put(None)
+
+    return np.concatenate(res)
 
 
 def exact_mc_perm_test(
@@ -49,6 +260,10 @@ def exact_mc_perm_test(
     n_bins: int = 200,
     seed: Optional[int] = None,
     final: bool = True,
+    plot: bool = False,
+    n_jobs: Optional[int] = 1,
+    backend: Union[str, Executor] = "threading",
+    show_progress_bar: bool = False,
     **kwargs,
 ) -> Tuple[List[float], float, float]:
     """
@@ -56,6 +271,12 @@ def exact_mc_perm_test(
     Get as input two clusters, then calculate its average probability distribution and calculate the distance
     between both averages. Then permute the elements on the clusters and repeat the process.
 
+    The permutations are evaluated in blocks, computing the averages of all permutations in a block at once.
+    Distance measures :func:`scipy.spatial.distance.euclidean`, :func:`scipy.spatial.distance.sqeuclidean`,
+    :func:`scipy.spatial.distance.cityblock`, :func:`scipy.spatial.distance.chebyshev`,
+    :func:`scipy.spatial.distance.cosine`, :func:`scipy.spatial.distance.correlation` and
+    :func:`scipy.spatial.distance.jensenshannon` are vectorised when no :paramref:`kwargs` are specified.
+
     Params
     ------
     adata : :class:`anndata.AnnData`
@@ -75,11 +296,21 @@ def exact_mc_perm_test(
     n_counts
         Number of total counts used to calculate the counts distributions.
     n_bins
-        Number of bins for the histogram.
+        Number of bins for the histogram. Only used when :paramref:`plot` `=True`.
     seed
-        Random seed.
+        Random seed. The results don't depend on :paramref:`n_jobs`.
     final
         If `True`, computes final cells, i.e. end points. Otherwise, computes root cells, i.e. starting points.
+    plot
+        Whether to plot the histogram and the cumulative distribution of the distances.
+    n_jobs
+        Number of parallel jobs. If `-1`, use all available cores. If `None` or `1`, the execution is sequential.
+    backend
+        Which backend to use for parallelization.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`.
+    show_progress_bar
+        Whether to show a progress bar tracking the blocks of permutations.
     kwargs
         Keyword arguments for :paramref:`dist_measure`.
 
@@ -87,11 +318,12 @@ def exact_mc_perm_test(
     -------
     :class:`list`, :class:`float`, :class:`float`
         List containing the distance value between average of the probability distributions of both clusters,
-        the observed distance and the corresponding p-value.
+        the observed distance and the corresponding p-value, i.e. the fraction of the permutations, including
+        the observed one, with distance at least as large as the observed distance.
     """
 
     if cluster_key not in adata.obs:
-        raise ValueError(f"Cluster key `{cluster_key!r}` not found in `adata.obs`.")
+        raise KeyError(f"Cluster key `{cluster_key!r}` not found in `adata.obs`.")
 
     if cluster1 not in adata.obs[cluster_key].cat.categories:
         raise ValueError(f"Cluster `{cluster1!r}` is not a valid cluster.")
@@ -106,64 +338,66 @@ def exact_mc_perm_test(
         raise ValueError(f"Argument `n_counts` must be positive, found `{n_counts}`.")
 
     start = logg.info("Starting exact permutation test")
-    np.random.seed(seed)
+    seeds = np.random.SeedSequence(seed).spawn(
+        int(np.ceil(n_perms / _PERMS_PER_BLOCK)) + 1
+    )
+    rng = np.random.default_rng(seeds.pop())
 
     # consider the two possible directions
     lin_key = str(LinKey.FORWARD if final else LinKey.BACKWARD)
 
-    xs = adata[adata.obs[cluster_key] == cluster1].obsm[lin_key]
-    ys = adata[adata.obs[cluster_key] == cluster2].obsm[lin_key]
+    lin = adata.obsm[lin_key]
+    clusters = adata.obs[cluster_key]
+    xs = lin[(clusters == cluster1).values, :]
+    ys = lin[(clusters == cluster2).values, :]
 
-    diff = []  # list of distances
-    n, k = len(xs), 0
-    xs_av = np.nanmean(xs, axis=0)  # average of both distributions ignoring nan values
-    ys_av = np.nanmean(ys, axis=0)
+    n = len(xs)
+    # average of both distributions ignoring nan values
+    avgs = lin.groupby(clusters).mean()
+    xs_av, ys_av = avgs.loc[cluster1].values, avgs.loc[cluster2].values
 
     if use_counts:
         logg.debug("DEBUG: Using counts distribution")
-        freq_x = _get_counts(xs_av, n_counts)
-        freq_y = _get_counts(ys_av, n_counts)
-        dist = dist_measure(freq_x, freq_y, **kwargs)
+        freq_x = _get_counts(xs_av, n_counts, rng)
+        freq_y = _get_counts(ys_av, n_counts, rng)
+        obs = dist_measure(freq_x, freq_y, **kwargs)
     else:
         logg.debug("DEBUG: Using probability distribution")
-        dist = dist_measure(xs_av, ys_av, **kwargs)  # Distance between both averages
-    diff.append(dist)
+        obs = dist_measure(xs_av, ys_av, **kwargs)  # Distance between both averages
 
     zs = np.concatenate(
-        (xs, ys), axis=0
+        (xs.X, ys.X), axis=0
     )  # create a extended list with all the distributions
 
-    for j in range(n_perms):
-        np.random.shuffle(zs)  # randomly permute the clusters
-        xs_sh = np.nanmean(zs[:n], axis=0)  # cluster 1
-        ys_sh = np.nanmean(zs[n:], axis=0)  # cluster 2
-
-        if use_counts:
-            freq_x = _get_counts(xs_sh, n_counts)
-            freq_y = _get_counts(ys_sh, n_counts)
-            dist = dist_measure(freq_x, freq_y, **kwargs)
-        else:
-            dist = dist_measure(xs_sh, ys_sh, **kwargs)
-
-        diff.append(dist)  # calculate distance
+    diff = parallelize(
+        _perm_dists,
+        list(range(len(seeds))),
+        n_jobs=n_jobs,
+        unit="block",
+        as_array=False,
+        extractor=np.concatenate,
+        backend=backend,
+        show_progress_bar=show_progress_bar,
+    )(zs, n, n_perms, seeds, dist_measure, use_counts, n_counts, **kwargs)
+
+    p_value = float((1 + np.sum(diff >= obs)) / (1 + n_perms))
+    logg.info("    Finish", time=start)
 
-    # plot a histogram of the distances and the CDF
-    gs = plt.GridSpec(nrows=1, ncols=2, figure=plt.figure(None, (10, 5)))
+    if plot:
+        # plot a histogram of the distances and the CDF
+        gs = plt.GridSpec(nrows=1, ncols=2, figure=plt.figure(None, (10, 5)))
 
-    plt.subplot(gs[0])
-    plt.hist(diff, density=True, bins=n_bins)
-    plt.title("Histogram")
+        plt.subplot(gs[0])
+        plt.hist(np.r_[obs, diff], density=True, bins=n_bins)
+        plt.axvline(obs, color="black", linestyle="--")
+        plt.title("Histogram")
 
-    plt.subplot(gs[1])
-    cum = plt.hist(diff, density=True, bins=n_bins, cumulative=True)
-    plt.title("CDF")
+        plt.subplot(gs[1])
+        plt.hist(np.r_[obs, diff], density=True, bins=n_bins, cumulative=True)
+        plt.axvline(obs, color="black", linestyle="--")
+        plt.title("CDF")
 
-    # calculate the pvalue
-    thr = [n for n, i in enumerate(cum[1]) if i >= diff[0]][0]
-    p_value = 1 - cum[0][thr - 1]
-    logg.info("    Finish", time=start)
-
-    return diff[1:], diff[0], p_value
+    return diff.tolist(), float(obs), p_value
 
 
 def _counts(
@@ -172,7 +406,8 @@ def _counts(
     clusters: Optional[List[str]] = None,
     n_samples: int = 1000,
     final: bool = True,
-) -> Dict[str, List[float]]:
+    seed: Union[int, np.random.Generator, None] = None,
+) -> Dict[str, np.ndarray]:
     """
     Calculates the counts for each endpoint per cluster.
 
@@ -191,11 +426,13 @@ def _counts(
         Number of cells to sample from per cluster.
     final
         Whether the evolution is calculated towards end points or towards starting points.
+    seed
+        Random seed or :class:`numpy.random.Generator`. If `None`, use the global random state of :mod:`numpy`.
 
     Returns
     -------
     :class:`dict`
-        Dictionary with keys as cluster names and values as lists with counts per endpoint.
+        Dictionary with keys as cluster names and values as arrays with counts per endpoint.
     """
 
     if cluster_key not in adata.obs:
@@ -218,21 +455,37 @@ def _counts(
         raise KeyError(f"Lineages key `{lin_key!r}` not found in `adata.obsm`.")
 
     logg.debug("Calculating counts distribution of endpoint per cluster")
-    d = {}
+    state = _get_state(seed)
+    data = np.asarray(adata.obsm[lin_key].X, dtype=np.float64)
+    dim = data.shape[1]
+    labels = adata.obs[cluster_key].values
+
+    rows, samples, valid = [], [], []
     for name in cluster_names:
-        data = adata[adata.obs[cluster_key] == name].obsm[lin_key]
-        dim = data.shape[1]
-        index = np.random.randint(data.shape[0], size=n_samples)
-        l = [
-            np.random.choice(np.arange(dim), 1, p=np.atleast_1d(data[ind]))[0]
-            if ~np.isnan(data[ind]).any()
-            else 0
-            for ind in index
-        ]
-        freq = (l.count(i) for i in range(dim))
-        d[name] = [i if i > 0 else 1e-5 for i in freq]
+        ixs = np.where(labels == name)[0]
+        ixs = ixs[_integers(state, len(ixs), n_samples)]
+        # cells with missing values are counted to the first endpoint
+        ok = ~np.isnan(data[ixs]).any(axis=1)
+        rows.append(ixs)
+        valid.append(ok)
+        samples.append(state.random(np.sum(ok)))
 
-    return d
+    rows, valid = np.concatenate(rows), np.concatenate(valid)
+    cats = np.zeros_like(rows)
+
+    # only compute the distributions of the sampled cells
+    uniq, inverse = np.unique(rows[valid], return_inverse=True)
+    cdf = np.cumsum(data[uniq], axis=1)
+    cdf /= cdf[:, -1:]
+    cats[valid] = _sample_categories(cdf, inverse, np.concatenate(samples))
+
+    groups = np.repeat(np.arange(len(cluster_names)), n_samples)
+    freq = np.bincount(groups * dim + cats, minlength=len(cluster_names) * dim).reshape(
+        -1, dim
+    )
+    freq = np.where(freq > 0, freq, 1e-5)
+
+    return dict(zip(cluster_names, freq))
 
 
 def _cramers_v(x: List[float], y: List[float]) -> float:
@@ -268,3 +521,46 @@ def _cramers_v(x: List[float], y: List[float]) -> float:
     kcorr = k - ((k - 1) ** 2) / (n - 1)
 
     return np.sqrt(phi2corr / min((kcorr - 1), (rcorr - 1)))
+
+
+def _cramers_v_matrix(counts: np.ndarray) -> np.ndarray:
+    """
+    Calculates :func:`_cramers_v` for all pairs of rows of :paramref:`counts` at once.
+
+    Params
+    ------
+    counts
+        Counts of shape `(n_clusters, n_categories)`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Symmetric matrix of shape `(n_clusters, n_clusters)` with the Cramer's V statistics.
+    """
+
+    counts = np.asarray(counts, dtype=np.float64)
+    r, k = 2, counts.shape[1]
+
+    # confusion matrices of shape `(n_clusters, n_clusters, 2, n_categories)`
+    observed = np.stack(np.broadcast_arrays(counts[:, None], counts[None, :]), axis=2)
+    row_sums = observed.sum(-1, keepdims=True)
+    col_sums = observed.sum(-2, keepdims=True)
+    n = row_sums.sum(-2, keepdims=True)
+    expected = row_sums * col_sums / n
+
+    dof = (r - 1) * (k - 1)
+    if dof == 1:
+        # Yates' correction, as in :func:`scipy.stats.chi2_contingency`
+        diff = expected - observed
+        observed = observed + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+    chi2 = np.sum((observed - expected) ** 2 / expected, axis=(-2, -1))
+    if dof == 0:
+        chi2 = np.zeros_like(chi2)
+
+    n = n[..., 0, 0]
+    phi2 = chi2 / n
+    phi2corr = np.maximum(0, phi2 - ((k - 1) * (r - 1)) / (n - 1))
+    rcorr = r - ((r - 1) ** 2) / (n - 1)
+    kcorr = k - ((k - 1) ** 2) / (n - 1)
+
+    return np.sqrt(phi2corr / np.minimum(kcorr - 1, rcorr - 1))
@@ -1,20 +1,39 @@
 # -*- coding: utf-8 -*-
 from types import MappingProxyType
-from typing import Sequence, Optional, Any, Union, Tuple, List, Mapping, Dict
+from typing import Sequence, Optional, Any, Union, Tuple, List, Mapping, Callable
 
 import numpy as np
 import pandas as pd
 
 from anndata import AnnData
 from scanpy import logging as logg
+from scipy.sparse import csr_matrix
+from scipy.stats import beta
 from sklearn.ensemble import RandomForestRegressor
 from statsmodels.stats.multitest import multipletests
 
-from cellrank.utils.models import Model
-from cellrank.plotting._utils import _is_any_gam_mgcv, _create_models, _model_type
+from cellrank.utils.models._models import _put_trends
+from cellrank.plotting._utils import (
+    _is_any_gam_mgcv,
+    _create_models,
+    _model_type,
+    _fit,
+    _merge_trends,
+    _lookup_trends,
+    _to_fitted_trends,
+)
 from cellrank.tools._constants import LinKey
+from cellrank.utils._cache import get_trend_cache
+from cellrank.utils._executors import Executor, _is_thread_backend
 from cellrank.utils._parallelize import parallelize
-from cellrank.utils._utils import check_collection, _get_n_cores
+from cellrank.utils._shared import shared_models
+from cellrank.utils._threads import get_thread_budget
+from cellrank.utils._utils import check_collection, _get_n_cores, _get_gene_costs
+
+_PERMS_PER_ROUND = 50
+_SEQUENTIAL_ERROR = 1e-3
+_PERMS_PER_BLOCK = 128
+_NULL_METHODS = ("refit", "oob")
 
 
 def _gi_permute(
@@ -65,51 +84,243 @@ def _gi_permute(
     return imps
 
 
-def _gi_process(
-    genes: Sequence[str],
-    models: Dict[str, Dict[str, Model]],
-    lineage_name: str,
-    norm: bool,
-    queue,
-    **kwargs,
+def _gi_sequential_pvals(
+    importances: np.ndarray,
+    permute: Callable[[int, int], np.ndarray],
+    n_perms: int,
+    alpha: float,
+    round_size: int = _PERMS_PER_ROUND,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
+    Run the permutations in rounds and stop once every gene is decided at :paramref:`alpha`.
+
+    As in the full permutation test, the importance of each gene is compared against the permuted importances of all
+    genes, of which there are `N = n_perms * n_genes`. A gene is decided as not significant as soon as
+    `h = floor(alpha * N) + 1` permuted importances exceed its importance and its p-value is the sequential
+    Monte Carlo p-value `h / L` of [Besag91]_, where `L` is the number of permuted importances needed.
+    A gene is decided as significant as soon as `h` cannot be reached anymore, in which case its p-value is
+    the largest one the remaining permutations could give, or once the Clopper-Pearson upper bound of its p-value
+    with error `_SEQUENTIAL_ERROR` is below :paramref:`alpha`, in which case its p-value is `(k + 1) / (L + 1)`,
+    where `k` is the number of the `L` permuted importances exceeding its importance. Genes which need all
+    permutations get the same p-value as with the full permutation test.
 
     Params
     ------
-    genes
-        Genes for which to calculate the importances.
-    models
-        Gene and lineage specific models.
-    lineage_name
-        Name of the lineage for which to calculate the gene importances.
-    queue
-        Signalling queue in the parent process/thread used to update the progress bar.
-    kwargs
-        Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+    importances
+        Importances of the genes.
+    permute
+        Function which takes the index of the first permutation and the number of permutations and returns
+        the permuted importances of shape `(n_permutations, n_genes)`.
+    n_perms
+        Maximum number of permutations.
+    alpha
+        Significance level at which the genes are decided.
+    round_size
+        Number of permutations per round.
 
     Returns
     -------
+    :class:`numpy.ndarray`, :class:`numpy.ndarray`
+        The p-values and the number of permutations used for each gene.
     """
 
-    res = []
+    n_genes = len(importances)
+    n_total = n_perms * n_genes
+    h = int(np.floor(alpha * n_total)) + 1
+
+    n_exceed = np.zeros(n_genes, dtype=np.int64)
+    n_used = np.full(n_genes, n_perms, dtype=np.int64)
+    pvals = np.full(n_genes, np.nan)
+    active = np.ones(n_genes, dtype=bool)
+
+    n_done = 0
+    while n_done < n_perms and np.any(active):
+        size = min(round_size, n_perms - n_done)
+        perms = permute(n_done, size)
+        if perms.shape != (size, n_genes):
+            raise RuntimeError(
+                "Sanity check failed: the number of permutations differ."
+            )
 
-    for gene in genes:
-        model = models[gene][lineage_name].prepare(gene, lineage_name, **kwargs).fit()
-        res.append([model.x_test.squeeze(), model.predict()])
-        queue.put(1)
-    queue.put(None)  # sentinel
+        ixs = np.where(active)[0]
+        # number of permuted importances exceeding the importance of each active gene, per permutation
+        counts = n_genes - np.stack(
+            [np.searchsorted(np.sort(p), importances[ixs], side="right") for p in perms]
+        )
+        cum = n_exceed[ixs] + np.cumsum(counts, axis=0)
+
+        for i in np.where(cum[-1] >= h)[0]:
+            row = np.argmax(cum[:, i] >= h)
+            before = cum[row - 1, i] if row else n_exceed[ixs[i]]
+            # position of the `h`-th exceedance within the permutation, in the order of the genes
+            pos = np.argmax(np.cumsum(perms[row] > importances[ixs[i]]) >= h - before)
+            pvals[ixs[i]] = h / ((n_done + row) * n_genes + pos + 1)
+            n_used[ixs[i]] = n_done + row + 1
+            active[ixs[i]] = False
+        n_exceed[ixs] = cum[-1]
+
+        n_done += size
+        n_left = (n_perms - n_done) * n_genes
+        decided = active & (n_exceed + n_left < h)
+        pvals[decided] = (n_exceed[decided] + n_left) / n_total
+        n_used[decided] = n_done
+        active[decided] = False
+
+        n_seen = n_done * n_genes
+        upper = beta.ppf(1 - _SEQUENTIAL_ERROR, n_exceed + 1, n_seen - n_exceed)
+        decided = active & (upper < alpha)
+        pvals[decided] = (n_exceed[decided] + 1) / (n_seen + 1)
+        n_used[decided] = n_done
+        active[decided] = False
+
+        logg.debug(
+            f"DEBUG: `{np.sum(active)}` gene(s) undecided after `{n_done}` permutations"
+        )
+
+    return pvals, n_used
+
+
+def _gi_oob_null(
+    model: RandomForestRegressor,
+    x: np.ndarray,
+    y: np.ndarray,
+    n_perms: int,
+    seed: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the out-of-bag permutation importances of the already fitted :paramref:`model` and their null
+    distribution under permuted targets, without fitting any new forests.
 
-    res = np.array(res).swapaxes(1, 2)  # genes x points x 2
-    x, res = res[..., 0], res[..., 1]
+    For every tree, the out-of-bag cells are predicted once as they are and once with each feature used by the tree
+    permuted. The importance of a feature is the increase of the out-of-bag mean squared error, averaged over
+    the trees. It's linear in the target, so the importances for many permuted targets are computed at once
+    from the sparse differences of the predictions.
 
-    if not norm:
-        return x, res
+    The out-of-bag cells are recovered using the private helpers of :mod:`sklearn.ensemble._forest`
+    and :paramref:`max_samples` of the forest, both available since `scikit-learn` `0.22`. They may change
+    between the versions of `scikit-learn`.
 
-    mean = np.expand_dims(np.mean(res, 1), -1)
-    sd = np.expand_dims(np.sqrt(np.var(res, 1)), -1)
+    Params
+    ------
+    model
+        Random forest fitted on :paramref:`x` and :paramref:`y` with `bootstrap=True`.
+    x
+        Features.
+    y
+        Dependent variable, such as pseudotime.
+    n_perms
+        Number of permutations of the target.
+    seed
+        Random seed for reproducibility.
 
-    return x, (res - mean) / sd
+    Returns
+    -------
+    :class:`numpy.ndarray`, :class:`numpy.ndarray`
+        The importances of shape `(n_features,)` and the null importances of shape `(n_perms, n_features)`.
+    """
+
+    try:
+        from sklearn.ensemble._forest import (
+            _generate_unsampled_indices,
+            _get_n_samples_bootstrap,
+        )
+    except ImportError:
+        raise ImportError(
+            "Method `null_method='oob'` requires the private out-of-bag helpers of `scikit-learn>=0.22`, "
+            "use `null_method='refit'` instead."
+        )
+
+    n_cells, n_genes = x.shape
+    n_trees = len(model.estimators_)
+    n_bootstrap = _get_n_samples_bootstrap(n_cells, model.max_samples)
+    state = np.random.RandomState(seed)
+
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float64)
+    trees, offset = [], np.zeros(n_genes)
+
+    for tree in model.estimators_:
+        oob = _generate_unsampled_indices(tree.random_state, n_cells, n_bootstrap)
+        if not len(oob):
+            continue
+        features = np.unique(tree.tree_.feature[tree.tree_.feature >= 0])
+
+        data = x[oob]
+        pred = tree.predict(data, check_input=False)
+        perm = state.permutation(len(oob))
+        diffs = np.empty((len(features), len(oob)))
+        for i, feature in enumerate(features):
+            orig = data[:, feature].copy()
+            data[:, feature] = orig[perm]
+            diffs[i] = tree.predict(data, check_input=False) - pred
+            data[:, feature] = orig
+
+        # mean((p' - y) ** 2 - (p - y) ** 2) = mean(d * (p' + p)) - 2 * mean(d * y), where d = p' - p
+        offset[features] += np.mean(diffs * (diffs + 2 * pred), axis=1)
+        trees.append((oob, features, csr_matrix(diffs) * (-2 / len(oob))))
+
+    def importances(targets: np.ndarray) -> np.ndarray:
+        res = np.zeros((len(targets), n_genes))
+        for oob, features, diffs in trees:
+            res[:, features] += (diffs @ targets[:, oob].T).T
+        return (res + offset) / n_trees
+
+    null = np.empty((n_perms, n_genes))
+    for start in range(0, n_perms, _PERMS_PER_BLOCK):
+        size = min(_PERMS_PER_BLOCK, n_perms - start)
+        targets = y[np.argsort(state.rand(size, n_cells), axis=1)]
+        null[start : start + size] = importances(targets)
+
+    return importances(y[np.newaxis, :])[0], null
+
+
+def _gi_correct(
+    importances: pd.DataFrame,
+    model: RandomForestRegressor,
+    fdr_correction: Optional[str],
+    alpha: float,
+    return_model: bool,
+) -> Union[pd.DataFrame, Tuple[pd.DataFrame, RandomForestRegressor]]:
+    """
+    Correct the p-values in :paramref:`importances` for false discovery rate and sort it.
+
+    Params
+    ------
+    importances
+        Dataframe with `'importance'` and `'pval'` columns.
+    model
+        The fitted model.
+    fdr_correction
+        Method used to correct for false discovery rate or `None`.
+    alpha
+        Family-wise error rate for FDR correction.
+    return_model
+        Whether to also return the fitted model.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        The sorted importances, optionally with the model.
+    """
+
+    sort_by = "pval"
+
+    if fdr_correction is not None:
+        _, qvals, _, _ = multipletests(
+            importances["pval"].values,
+            alpha=alpha,
+            method=fdr_correction,
+            is_sorted=False,
+            returnsorted=False,
+        )
+        importances["qval"] = qvals
+        sort_by = "qval"
+
+    importances.sort_values(
+        [sort_by, "importance"], ascending=[True, False], inplace=True
+    )
+
+    return (importances, model) if return_model else importances
 
 
 def gene_importance(
@@ -122,12 +333,14 @@ def gene_importance(
     final: bool = True,
     norm: bool = True,
     n_perms: Optional[int] = None,
+    sequential: bool = False,
+    null_method: str = "refit",
     fdr_correction: Optional[str] = "fdr_bh",
     alpha: float = 0.05,
     n_jobs: Optional[int] = 1,
     seed: Optional[int] = None,
     return_model: bool = False,
-    backend: str = "multiprocessing",
+    backend: Union[str, Executor] = "multiprocessing",
     show_progress_bar: bool = True,
     rf_kwargs: Mapping[str, Any] = MappingProxyType({"criterion": "mse"}),
     **kwargs,
@@ -141,7 +354,7 @@ def gene_importance(
     correction.
 
     We adapted SCORPIUS to work with soft lineage assignments given by our lineage probabilities computed using
-    :func:`cellrank.tl.lineages`.
+    :func:`cellrank.tl.lineages`. Trends found in :func:`cellrank.ul.get_trend_cache` are not fitted again.
 
     Params
     ------
@@ -165,6 +378,23 @@ def gene_importance(
         Number of permutations to perform.
 
         Use `None` if you don't want to calculate the p-values.
+    sequential
+        Whether to run the permutations in rounds and stop as soon as each gene is decided to be significant or not
+        at :paramref:`alpha`, in which case :paramref:`n_perms` is the maximum number of permutations.
+        Genes which are clearly not significant get the sequential Monte Carlo p-value of [Besag91]_,
+        the p-values are reproducible given :paramref:`seed` and :paramref:`n_jobs`.
+        Only used when :paramref:`null_method` `='refit'`.
+    null_method
+        How to compute the p-values. Valid options are:
+
+            - `'refit'` - fit a new random forest for each permutation of the cells, as in [SCORPIUS16]_.
+              The p-values are exact, but each permutation costs as much as the fit of the model.
+            - `'oob'` - fit the forest only once and test its out-of-bag permutation importances against
+              the importances of the same trees under permuted pseudotime. The permutations are evaluated
+              in batches and only need the predictions of the already trained trees, which makes it much cheaper
+              for many genes. The p-values are conditional on the fitted trees, they test the out-of-bag
+              permutation importances in `'oob_importance'` column rather than `'importance'` and
+              require `bootstrap=True` in :paramref:`rf_kwargs`.
     fdr_correction
         Method used to correct for false discovery rate.
 
@@ -179,11 +409,14 @@ def gene_importance(
         Whether to also return the fitted model.
     backend
         Which backend to use for multiprocessing.
-        See :class:`joblib.Parallel` for valid options.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`.
     show_progress_bar
         Whether to show a progress bar tracking models fitted.
     rf_kwargs
-        Keyword arguments for :class:`sklearn.ensemble.RandomForestRegressor`.
+        Keyword arguments for :class:`sklearn.ensemble.RandomForestRegressor`. If `'n_jobs'` is not specified,
+        the forests in the permutation test use the cores left by the parallel jobs,
+        see :func:`cellrank.ul.thread_budget`.
     **kwargs:
         Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
 
@@ -193,6 +426,10 @@ def gene_importance(
         Dataframe with `'importance'` column which contains genes' importances.
 
         - If :paramref:`n_perm` `!=None`, it also contains `'pval'` columns with calculated `p-values`.
+        - If :paramref:`null_method` `='oob'`, it also contains `'oob_importance'` column with the out-of-bag
+          permutation importances.
+        - If :paramref:`sequential` `=True`, it also contains `'n_perms'` column with the number of permutations
+          used for each gene.
         - If :paramref:`fdr_correction` `!= None`, it also contains `'qval'` column, containing the
           corrected `p-values`.
     (:class:`sklearn.ensemble.RandomForestRegressor`, :class:`pandas.DataFrame`)
@@ -210,6 +447,12 @@ def gene_importance(
             raise ValueError(
                 f"Number of permutations must be `>= 0`, found `{n_perms}`."
             )
+    if null_method not in _NULL_METHODS:
+        raise ValueError(
+            f"Invalid null method `{null_method!r}`. Valid options are: `{list(_NULL_METHODS)}`."
+        )
+    if null_method == "oob" and not rf_kwargs.get("bootstrap", True):
+        raise ValueError("Null method `'oob'` requires `bootstrap=True`.")
     check_collection(adata, genes, "var_names")
 
     n_jobs = _get_n_cores(n_jobs, len(genes))
@@ -217,35 +460,75 @@ def gene_importance(
     kwargs["final"] = final
     kwargs["time_key"] = time_key
     kwargs["n_test_points"] = n_points
+    kwargs["cache"] = get_trend_cache()
 
     models = _create_models(model, genes, [lineage_name])
-    if _is_any_gam_mgcv(models):
+    strict_backend = False
+    if _is_any_gam_mgcv(models) and _is_thread_backend(backend):
         logg.debug(
             "DEBUG: Setting backend to multiprocessing because model is `GamMGCV`"
         )
         backend = "multiprocessing"
+        strict_backend = True
 
     start = logg.info(f"Calculating gene trends using `{n_jobs}` core(s)")
-    data = parallelize(
-        _gi_process,
+    start_lineages = [kwargs.pop("start_lineage", None)]
+    end_lineages = [kwargs.pop("end_lineage", None)]
+    hits, keys, fit_kwargs = _lookup_trends(
         genes,
-        n_jobs=n_jobs,
-        unit="gene",
-        as_array=False,
-        extractor=np.hstack,
-        backend=backend,
-        show_progress_bar=show_progress_bar,
-    )(models, lineage_name, norm, **kwargs).T
+        [lineage_name],
+        start_lineages,
+        end_lineages,
+        n_jobs,
+        backend,
+        models=models,
+        **kwargs,
+    )
+    missing = [gene for gene in genes if gene not in hits]
+    trends = {}
+    if missing:
+        with shared_models(
+            adata,
+            models,
+            missing,
+            backend=backend if n_jobs > 1 else "sequential",
+            data_key=kwargs.get("data_key", "X"),
+            time_key=time_key,
+        ):
+            trends = parallelize(
+                _fit,
+                missing,
+                n_jobs=n_jobs,
+                unit="gene",
+                as_array=False,
+                extractor=_merge_trends,
+                backend=backend,
+                strict_backend=strict_backend,
+                show_progress_bar=show_progress_bar,
+                scheduler="dynamic",
+                costs=_get_gene_costs(adata, missing, kwargs.get("data_key", "X")),
+            )([lineage_name], start_lineages, end_lineages, **fit_kwargs)
+        _put_trends(
+            kwargs["cache"], keys, [t for ts in trends.values() for t in ts.values()]
+        )
+    trends = _merge_trends([trends, _to_fitted_trends(hits)])
     logg.info("    Finish", time=start)
 
-    x, y = data[..., 1], data[:, 0, 0]
-    if np.all(y[..., np.newaxis] != data[..., 0]):
+    # shape: n_points x n_genes
+    x_test = np.array([trends[gene][lineage_name].x_test for gene in genes]).T
+    x = np.array([trends[gene][lineage_name].y_test for gene in genes]).T
+    if norm:
+        x = (x - np.mean(x, axis=0)) / np.sqrt(np.var(x, axis=0))
+
+    y = x_test[:, 0]
+    if np.all(y[..., np.newaxis] != x_test):
         raise RuntimeError("Sanity check failed: pseudotime differs for genes.")
     if np.all(np.sort(y) != y):
         raise RuntimeError("Sanity check failed: pseudotime is not sorted.")
 
     rf_kwargs = dict(rf_kwargs)
-    if rf_kwargs.get("n_jobs", None) is None:
+    user_rf_n_jobs = rf_kwargs.get("n_jobs", None)
+    if user_rf_n_jobs is None:
         rf_kwargs["n_jobs"] = n_jobs
 
     logg.debug("DEBUG: Running random forest")
@@ -259,41 +542,57 @@ def gene_importance(
         importances.sort_values("importance", ascending=False, inplace=True)
         return (importances, model) if return_model else importances
 
-    # since we use most of the threads for permutations, don't want to use many of them
-    rf_kwargs["n_jobs"] = 4
+    if null_method == "oob":
+        start = logg.info("Running out-of-bag permutation test")
+        oob_importances, null = _gi_oob_null(model, x, y, n_perms, seed=seed)
+        logg.info("    Finish", time=start)
 
-    # shape: n_perms x n_genes
-    start = logg.info(f"Running permutation test using `{n_jobs}` core(s)")
-    perms = parallelize(
-        _gi_permute,
-        list(range(n_perms)),
-        unit="perm",
-        n_jobs=n_jobs,
-        backend=backend,
-        extractor=np.vstack,
-        use_ixs=True,
-        show_progress_bar=show_progress_bar,
-    )(x, y, seed, **rf_kwargs)
-    if perms.shape != (n_perms, len(genes)):
-        raise RuntimeError("Sanity check failed: the number of permutations differ.")
-    logg.info("    Finish", time=start)
+        importances["oob_importance"] = oob_importances
+        importances["pval"] = (1 + np.sum(null >= oob_importances, axis=0)) / (
+            1 + n_perms
+        )
+        return _gi_correct(importances, model, fdr_correction, alpha, return_model)
 
-    importances["pval"] = np.mean(importances.values < np.ravel(perms), axis=1)
-    sort_by = "pval"
+    # since we use most of the cores for permutations, give each forest only its share of them
+    budget = get_thread_budget(n_jobs)
+    if user_rf_n_jobs is None:
+        rf_kwargs["n_jobs"] = budget.n_threads
 
-    if fdr_correction is not None:
-        _, qvals, _, _ = multipletests(
-            importances["pval"].values,
-            alpha=alpha,
-            method=fdr_correction,
-            is_sorted=False,
-            returnsorted=False,
+    # shape: n_perms x n_genes
+    start = logg.info(
+        f"Running permutation test using `{budget.n_jobs}` core(s) "
+        f"with `{budget.n_threads}` thread(s) each"
+    )
+
+    def permute(offset: int, size: int) -> np.ndarray:
+        # each chunk seeds its own random state, shift them so that the rounds don't repeat the permutations
+        return parallelize(
+            _gi_permute,
+            list(range(offset, offset + size)),
+            unit="perm",
+            n_jobs=n_jobs,
+            backend=backend,
+            extractor=np.vstack,
+            use_ixs=True,
+            show_progress_bar=show_progress_bar,
+        )(x, y, None if seed is None else seed + offset, **rf_kwargs)
+
+    if sequential:
+        round_size = int(np.ceil(_PERMS_PER_ROUND / n_jobs)) * n_jobs
+        pvals, n_used = _gi_sequential_pvals(
+            importances["importance"].values, permute, n_perms, alpha, round_size
         )
-        importances["qval"] = qvals
-        sort_by = "qval"
+        logg.info(f"    Finish after `{np.max(n_used)}` permutations", time=start)
+        importances["pval"] = pvals
+        importances["n_perms"] = n_used
+    else:
+        perms = permute(0, n_perms)
+        if perms.shape != (n_perms, len(genes)):
+            raise RuntimeError(
+                "Sanity check failed: the number of permutations differ."
+            )
+        logg.info("    Finish", time=start)
 
-    importances.sort_values(
-        [sort_by, "importance"], ascending=[True, False], inplace=True
-    )
+        importances["pval"] = np.mean(importances.values < np.ravel(perms), axis=1)
 
-    return (importances, model) if return_model else importances
+    return _gi_correct(importances, model, fdr_correction, alpha, return_model)
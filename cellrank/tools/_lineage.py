@@ -1,17 +1,47 @@
 # -*- coding: utf-8 -*-
-from typing import Optional, Iterable, Callable, TypeVar, List, Union
-from cellrank.tools._utils import _create_categorical_colors
+from typing import (
+    Optional,
+    Iterable,
+    Callable,
+    TypeVar,
+    List,
+    Union,
+    Any,
+    Sequence,
+    Tuple,
+    Iterator,
+)
+from pathlib import Path
+from cellrank.tools._utils import _create_categorical_colors, _group_indicator
+from scipy.stats import entropy
 import matplotlib.colors as c
 import numpy as np
+import pandas as pd
 
 
 ColorLike = TypeVar("ColorLike")
 _ERROR_NOT_ITERABLE = "Expected `{}` to be iterable, found type `{}`."
 _ERROR_WRONG_SIZE = "Expected `{}` to be of size `{{}}`, found `{{}}`."
+_VALID_DTYPES = (np.float16, np.float32, np.float64)
 
 
-def _at_least_2d(array: np.ndarray, dim: int):
-    return np.expand_dims(array, dim) if array.ndim < 2 else array
+def _as_slice(ixs: np.ndarray) -> Union[slice, np.ndarray]:
+    """
+    Convert equally spaced indices to a :class:`slice`, which allows for basic (zero-copy) indexing.
+    """
+
+    if ixs.ndim != 1 or not len(ixs):
+        return ixs
+    if len(ixs) == 1:
+        return slice(ixs[0], ixs[0] + 1)
+
+    steps = np.diff(ixs)
+    step = steps[0]
+    if step == 0 or np.any(steps != step):
+        return ixs
+
+    stop = ixs[-1] + step
+    return slice(ixs[0], None if stop < 0 else stop, step)
 
 
 class Lineage(np.ndarray):
@@ -26,6 +56,10 @@ class Lineage(np.ndarray):
         Names of the lineages.
     colors
         Colors of the lineages
+    dtype
+        Storage type of the probabilities. Can be one of `numpy.float16`, `numpy.float32` or `numpy.float64`.
+        If `None`, use the type of :paramref:`input_array`. Unless specified otherwise using `dtype`,
+        :meth:`sum`, :meth:`mean`, :meth:`std` and :meth:`var` are always accumulated in `numpy.float64`.
     """
 
     def __new__(
@@ -34,12 +68,16 @@ class Lineage(np.ndarray):
         *,
         names: Iterable[str],
         colors: Optional[Iterable[ColorLike]] = None,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
     ) -> "Lineage":
         if not isinstance(input_array, np.ndarray):
             raise TypeError(
                 f"Input array must be of type `numpy.ndarray`, found `{type(input_array).__name__!r}`"
             )
 
+        if dtype is not None:
+            input_array = input_array.astype(_check_dtype(dtype), copy=False)
+
         obj = np.asarray(input_array).view(cls)
         if obj.ndim == 1:
             obj = np.expand_dims(obj, -1)
@@ -64,87 +102,90 @@ class Lineage(np.ndarray):
         self._names = getattr(obj, "names", None)
         self._colors = getattr(obj, "colors", None)
         self._n_lineages = getattr(obj, "_n_lineages", 0)
-        self._names_to_ixs = getattr(
-            "obj",
-            "_names_to_ixs",
-            None
-            if self.names is None
-            else {name: ix for ix, name in enumerate(self.names)},
-        )
+        self._names_to_ixs = getattr(obj, "_names_to_ixs", None)
 
     def __getitem__(self, item) -> "Lineage":
-        is_tuple_len_2 = isinstance(item, tuple) and len(item) == 2
-        if is_tuple_len_2:
-            _, col = item
-
-            if isinstance(col, (int, str)):
-                col = [col]
-
-            if isinstance(col, (list, tuple)):
-                col = self._maybe_convert_names(col)
-                item = _, col
+        if self.ndim != 2:
+            # e.g. the results of reductions, such as `.sum(axis=0)`
+            return super().__getitem__(item)
+        if isinstance(item, tuple) and len(item) == 1:
+            item = item[0]
+        if (isinstance(item, np.ndarray) and item.ndim > 1) or item is Ellipsis:
+            # e.g. element-wise masks, used by `numpy` itself
+            return super().__getitem__(item)
+
+        if isinstance(item, tuple) and len(item) == 2:
+            row, col = item
         else:
-            if isinstance(item, (int, str)):
+            if isinstance(item, (int, np.integer, str)):
                 item = [item]
-
-            col = range(len(self.names))
-            if isinstance(item, (tuple, list)):
-                if any(map(lambda i: isinstance(i, str), item)):
-                    item = (slice(None, None, None), self._maybe_convert_names(item))
-                    col = item[1]
-
-        shape, row_order, col_order = None, None, None
-        if (
-            is_tuple_len_2
-            and not isinstance(item[0], slice)
-            and not isinstance(item[1], slice)
-        ):
-            item_0 = (
-                np.array(item[0]) if not isinstance(item[0], np.ndarray) else item[0]
-            )
-            item_1 = (
-                np.array(item[1]) if not isinstance(item[1], np.ndarray) else item[1]
-            )
-            item_0 = _at_least_2d(item_0, -1)
-            item_1 = _at_least_2d(item_1, 0)
-            if item_1.dtype == np.bool:
-                if item_0.dtype != np.bool:
-                    if not issubclass(item_0.dtype.type, np.integer):
-                        raise TypeError(f"Invalid type `{item_0.dtype.type}`.")
-                    row_order = np.argsort(item_0[:, 0])
-                    item_0 = _at_least_2d(np.isin(np.arange(self.shape[0]), item_0), -1)
-                item = item_0 * item_1
-                shape = np.max(np.sum(item, axis=0)), np.max(np.sum(item, axis=1))
-                col = np.where(np.all(item_1, axis=0))[0]
-            elif item_0.dtype == np.bool:
-                if item_1.dtype != np.bool:
-                    if not issubclass(item_1.dtype.type, np.integer):
-                        raise TypeError(f"Invalid type `{item_1.dtype.type}`.")
-                    col_order = np.argsort(item_1[0, :])
-                    item_1 = _at_least_2d(np.isin(np.arange(self.shape[1]), item_1), 0)
-                item = item_0 * item_1
-                shape = np.max(np.sum(item, axis=0)), np.max(np.sum(item, axis=1))
-                col = np.where(np.all(item_1, axis=0))[0]
+            if isinstance(item, (tuple, list)) and any(
+                map(lambda i: isinstance(i, str), item)
+            ):
+                row, col = slice(None), item
             else:
-                item = (item_0, item_1)
+                row, col = item, slice(None)
 
-        obj = super().__getitem__(item)
-        if shape is not None:  # keep the resulting shape
-            obj = obj.reshape(shape)
-        if row_order is not None:
-            obj = obj[row_order, :]
-        if col_order is not None:
-            obj = obj[:, col_order]
+        row, col = self._normalize_row(row), self._normalize_col(col)
+
+        if isinstance(row, np.ndarray) and isinstance(col, np.ndarray):
+            # outer indexing, never creates the `n_cells x n_lineages` masks
+            obj = super().__getitem__(np.ix_(row, col))
+        else:
+            # at least one slice - the result is a view when both are slices
+            obj = super().__getitem__((row, col))
 
         if isinstance(obj, Lineage):
             obj._names = np.atleast_1d(self.names[col])
             obj._colors = np.atleast_1d(self.colors[col])
-            if col_order is not None:
-                obj._names = obj._names[col_order]
-                obj._colors = obj._colors[col_order]
+            obj._n_lineages = obj.shape[1]
+            if not (isinstance(col, slice) and col == slice(None)):
+                obj._names_to_ixs = None
 
         return obj
 
+    def _normalize_row(self, row: Any) -> Union[slice, np.ndarray, Any]:
+        if isinstance(row, (int, np.integer)):
+            ix = row + self.shape[0] if row < 0 else row
+            if not 0 <= ix < self.shape[0]:
+                raise IndexError(
+                    f"Index `{row}` is out of bounds for axis `0` with size `{self.shape[0]}`."
+                )
+            return slice(ix, ix + 1)
+        if isinstance(row, (list, tuple, range)):
+            row = np.asarray(row)
+        if isinstance(row, np.ndarray) and row.dtype != np.bool_:
+            if not issubclass(row.dtype.type, np.integer):
+                raise TypeError(f"Invalid type `{row.dtype.type}`.")
+
+        return row
+
+    def _normalize_col(self, col: Any) -> Union[slice, np.ndarray]:
+        if isinstance(col, slice):
+            return col
+        if isinstance(col, (int, np.integer, str)):
+            col = [col]
+        if isinstance(col, (list, tuple, range)):
+            col = np.asarray(self._maybe_convert_names(col), dtype=np.int64)
+        elif isinstance(col, np.ndarray):
+            if col.dtype == np.bool_:
+                col = np.flatnonzero(col)
+            elif col.dtype.kind in ("U", "S", "O"):
+                col = np.asarray(self._maybe_convert_names(col), dtype=np.int64)
+            elif not issubclass(col.dtype.type, np.integer):
+                raise TypeError(f"Invalid type `{col.dtype.type}`.")
+        else:
+            raise TypeError(f"Invalid column index of type `{type(col).__name__}`.")
+
+        n = self.shape[1]
+        if np.any((col < -n) | (col >= n)):
+            invalid = col[(col < -n) | (col >= n)]
+            raise IndexError(
+                f"Column indices `{list(invalid)}` are out of bounds for `{n}` lineages."
+            )
+
+        return _as_slice(np.where(col < 0, col + n, col))
+
     @property
     def names(self) -> np.ndarray:
         """Lineage names. Must be unique."""
@@ -190,6 +231,9 @@ class Lineage(np.ndarray):
     def _maybe_convert_names(
         self, names: Iterable[Union[int, str]], is_singleton: bool = False
     ) -> Union[int, List[int]]:
+        if self._names_to_ixs is None:
+            self._names_to_ixs = {name: ix for ix, name in enumerate(self.names)}
+
         res = []
         for name in names:
             if isinstance(name, str):
@@ -230,6 +274,29 @@ class Lineage(np.ndarray):
 
         return np.array(array)
 
+    def groupby(
+        self,
+        labels: Union[pd.Series, Sequence[Any]],
+        weights: Optional[np.ndarray] = None,
+    ) -> "LineageGroupBy":
+        """
+        Group the rows by :paramref:`labels` to compute per-group summaries of the lineages.
+
+        Params
+        ------
+        labels
+            Group label for each row, such as cluster annotations from `adata.obs`. `NaN` values are ignored.
+        weights
+            Optional weight of each row. If `None`, all rows have weight `1`.
+
+        Returns
+        -------
+        :class:`cellrank.tl._lineage.LineageGroupBy`
+            Object which computes the reductions for all groups at once.
+        """
+
+        return LineageGroupBy(self, labels, weights=weights)
+
     @property
     def X(self) -> np.ndarray:
         """Convert self to numpy array, losing names and colors."""
@@ -254,7 +321,107 @@ class Lineage(np.ndarray):
 
         self._names_to_ixs = {name: ix for ix, name in enumerate(self.names)}
 
+    @classmethod
+    def from_memmap(
+        cls,
+        filename: Union[str, Path],
+        *,
+        names: Iterable[str],
+        colors: Optional[Iterable[ColorLike]] = None,
+        mode: str = "r",
+    ) -> "Lineage":
+        """
+        Create a lineage backed by a memory-mapped `.npy` file.
+
+        Params
+        ------
+        filename
+            Path to the `.npy` file, e.g. created by :meth:`to_memmap`.
+        names
+            Names of the lineages.
+        colors
+            Colors of the lineages.
+        mode
+            Mode in which to open the file, see :func:`numpy.load`.
+
+        Returns
+        -------
+        :class:`cellrank.tl.Lineage`
+            Lineage whose data is read lazily from :paramref:`filename`.
+        """
+
+        return cls(np.load(filename, mmap_mode=mode), names=names, colors=colors)
+
+    def to_memmap(
+        self,
+        filename: Union[str, Path],
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+    ) -> "Lineage":
+        """
+        Write the lineage to a `.npy` file and return a lineage backed by it.
+
+        Params
+        ------
+        filename
+            Path where to save the data.
+        dtype
+            Storage type of the probabilities. If `None`, keep the current type.
+
+        Returns
+        -------
+        :class:`cellrank.tl.Lineage`
+            Lineage whose data is memory-mapped from :paramref:`filename`. Pickling it only sends a reference
+            to the file.
+        """
+
+        dtype = self.dtype if dtype is None else _check_dtype(dtype)
+        mmap = np.lib.format.open_memmap(
+            str(filename), mode="w+", dtype=dtype, shape=self.shape
+        )
+        mmap[:] = self
+        mmap.flush()
+        del mmap
+
+        return Lineage.from_memmap(
+            filename, names=self.names, colors=self.colors, mode="r+"
+        )
+
+    def _memmap_reference(self) -> Optional[Tuple[Any, ...]]:
+        """Return the arguments of :func:`_from_memmap` if self covers a whole memory-mapped file."""
+
+        base = self.base
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        if base is None or getattr(base, "filename", None) is None:
+            return None
+
+        if (
+            self.shape != base.shape
+            or self.strides != base.strides
+            or self.dtype != base.dtype
+            or self.__array_interface__["data"][0]
+            != base.__array_interface__["data"][0]
+        ):
+            return None
+
+        mode = "r+" if base.mode in ("r+", "w+") else base.mode
+
+        return (
+            base.filename,
+            base.offset,
+            self.shape,
+            self.dtype.str,
+            "F" if not self.flags.c_contiguous else "C",
+            mode,
+            self.names,
+            self.colors,
+        )
+
     def __reduce__(self):
+        ref = self._memmap_reference()
+        if ref is not None:
+            return _from_memmap, ref
+
         res = list(super().__reduce__())
 
         names = self.names.__reduce__()
@@ -263,6 +430,24 @@ class Lineage(np.ndarray):
 
         return tuple(res)
 
+    def _reduce(self, name: str, dtype: Optional[np.dtype], *args, **kwargs):
+        # accumulate the reduced-precision storage in float64, unless specified otherwise
+        if dtype is None and self.dtype.itemsize < 8:
+            dtype = np.float64
+        return getattr(super(), name)(*args, dtype=dtype, **kwargs)
+
+    def sum(self, axis=None, dtype=None, out=None, **kwargs):
+        return self._reduce("sum", dtype, axis=axis, out=out, **kwargs)
+
+    def mean(self, axis=None, dtype=None, out=None, **kwargs):
+        return self._reduce("mean", dtype, axis=axis, out=out, **kwargs)
+
+    def std(self, axis=None, dtype=None, out=None, ddof=0, **kwargs):
+        return self._reduce("std", dtype, axis=axis, out=out, ddof=ddof, **kwargs)
+
+    def var(self, axis=None, dtype=None, out=None, ddof=0, **kwargs):
+        return self._reduce("var", dtype, axis=axis, out=out, ddof=ddof, **kwargs)
+
     def copy(self, order="C") -> "Lineage":
         return Lineage(
             np.array(self, copy=True, order=order),
@@ -271,6 +456,32 @@ class Lineage(np.ndarray):
         )
 
 
+def _check_dtype(dtype: Union[str, np.dtype, type]) -> np.dtype:
+    dtype = np.dtype(dtype)
+    if dtype not in _VALID_DTYPES:
+        raise ValueError(
+            f"Invalid dtype `{dtype}`. Valid options are: `{[np.dtype(d).name for d in _VALID_DTYPES]}`."
+        )
+
+    return dtype
+
+
+def _from_memmap(
+    filename: str,
+    offset: int,
+    shape: Tuple[int, int],
+    dtype: str,
+    order: str,
+    mode: str,
+    names: np.ndarray,
+    colors: np.ndarray,
+) -> Lineage:
+    data = np.memmap(
+        filename, dtype=dtype, mode=mode, offset=offset, shape=shape, order=order
+    )
+    return Lineage(data, names=names, colors=colors)
+
+
 class LineageView(Lineage):
     def copy(self, order="C") -> Lineage:
         return Lineage(
@@ -278,3 +489,171 @@ class LineageView(Lineage):
             names=np.array(self.names, copy=True, order=order),
             colors=np.array(self.colors, copy=True, order=order),
         )
+
+
+class LineageGroupBy:
+    """
+    Grouped reductions of a :class:`cellrank.tl.Lineage`.
+
+    All groups are reduced at once using a sparse group x cell indicator matrix, which contains
+    the row weights. Missing values are ignored.
+
+    Params
+    ------
+    lineage
+        Lineage to group.
+    labels
+        Group label for each row.
+    weights
+        Optional weight of each row.
+    """
+
+    def __init__(
+        self,
+        lineage: Lineage,
+        labels: Union[pd.Series, Sequence[Any]],
+        weights: Optional[np.ndarray] = None,
+    ):
+        if len(labels) != lineage.shape[0]:
+            raise ValueError(
+                f"Expected `labels` to be of size `{lineage.shape[0]}`, found `{len(labels)}`."
+            )
+
+        self._lineage = lineage
+        self._weighted = weights is not None
+        self._groups, self._indicator = _group_indicator(labels, weights=weights)
+        self._moments = None
+
+    @property
+    def groups(self) -> pd.Index:
+        """Group names."""
+        return self._groups
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def __iter__(self) -> Iterator[Tuple[Any, Lineage]]:
+        indptr, indices = self._indicator.indptr, self._indicator.indices
+        for i, group in enumerate(self._groups):
+            yield group, self._lineage[indices[indptr[i] : indptr[i + 1]], :]
+
+    def _get_moments(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._moments is None:
+            # always accumulate in float64
+            X = np.array(self._lineage, dtype=np.float64)
+            valid = ~np.isnan(X)
+            X[~valid] = 0
+
+            n = self._indicator @ valid.astype(np.float64)
+            s1 = self._indicator @ X
+            s2 = self._indicator @ (X * X)
+            self._moments = n, s1, s2
+
+        return self._moments
+
+    def _to_frame(self, values: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(values, index=self._groups, columns=self._lineage.names)
+
+    def counts(self) -> pd.Series:
+        """
+        Weighted number of rows in each group.
+        """
+
+        return pd.Series(np.ravel(self._indicator.sum(axis=1)), index=self._groups)
+
+    def sum(self) -> pd.DataFrame:
+        """
+        Weighted sum of the lineages in each group.
+        """
+
+        return self._to_frame(self._get_moments()[1])
+
+    def mean(self) -> pd.DataFrame:
+        """
+        Weighted mean of the lineages in each group.
+        """
+
+        n, s1, _ = self._get_moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._to_frame(s1 / n)
+
+    def std(self) -> pd.DataFrame:
+        """
+        Weighted standard deviation of the lineages in each group, using `0` degrees of freedom.
+        """
+
+        n, s1, s2 = self._get_moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = s1 / n
+            return self._to_frame(np.sqrt(np.maximum(s2 / n - mean * mean, 0)))
+
+    def entropy(self) -> pd.Series:
+        """
+        Entropy of the mean lineage distribution of each group.
+        """
+
+        mean = self.mean().values
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.Series(entropy(mean.T), index=self._groups)
+
+    def quantile(self, q: Union[float, Sequence[float]] = 0.5) -> pd.DataFrame:
+        """
+        Weighted quantiles of the lineages in each group.
+
+        Params
+        ------
+        q
+            Quantile or a sequence of quantiles to compute, in `[0, 1]`.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            The quantiles. If :paramref:`q` is a sequence, the index is a :class:`pandas.MultiIndex`
+            of groups and quantiles.
+        """
+
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if np.any((qs < 0) | (qs > 1)):
+            raise ValueError(f"Quantiles must be in `[0, 1]`, found `{list(qs)}`.")
+
+        indptr, indices, data = (
+            self._indicator.indptr,
+            self._indicator.indices,
+            self._indicator.data,
+        )
+        X = np.asarray(self._lineage, dtype=np.float64)
+        res = np.full((len(self._groups), len(qs), X.shape[1]), np.nan)
+
+        for i in range(len(self._groups)):
+            segment = slice(indptr[i], indptr[i + 1])
+            values, w = X[indices[segment]], data[segment]
+            for j in range(X.shape[1]):
+                res[i, :, j] = _quantile(values[:, j], w, qs, self._weighted)
+
+        if np.ndim(q) == 0:
+            return self._to_frame(res[:, 0, :])
+
+        return pd.DataFrame(
+            res.reshape(-1, X.shape[1]),
+            index=pd.MultiIndex.from_product([self._groups, qs]),
+            columns=self._lineage.names,
+        )
+
+
+def _quantile(
+    values: np.ndarray, weights: np.ndarray, qs: np.ndarray, weighted: bool
+) -> np.ndarray:
+    mask = ~np.isnan(values)
+    values, weights = values[mask], weights[mask]
+    if not len(values):
+        return np.full_like(qs, np.nan)
+    if not weighted:
+        return np.quantile(values, qs)
+
+    ixs = np.argsort(values)
+    values, weights = values[ixs], weights[ixs]
+    cum_weights = np.cumsum(weights)
+    if cum_weights[-1] <= 0:
+        return np.full_like(qs, np.nan)
+
+    return np.interp(qs, (cum_weights - weights / 2) / cum_weights[-1], values)
@@ -11,7 +11,7 @@ import scvelo as scv
 
 from anndata import AnnData
 from itertools import combinations
-from pandas import Series, DataFrame, to_numeric
+from pandas import Series, DataFrame
 from pandas.api.types import is_categorical_dtype
 from scanpy import logging as logg
 from scipy.linalg import solve
@@ -44,9 +44,11 @@ from cellrank.tools._utils import (
     _create_categorical_colors,
     _compute_mean_color,
     _convert_to_categorical_series,
+    _group_indicator,
     partition,
     save_fig,
 )
+from cellrank.utils._threads import limit_threads
 
 
 class MarkovChain:
@@ -297,16 +299,17 @@ class MarkovChain:
         """
 
         logg.info("Computing eigendecomposition of transition matrix")
-        if self._is_sparse:
-            logg.debug(f"DEBUG: Computing top `{k}` eigenvalues for sparse matrix")
-            D, V_l = eigs(self._T.T, k=k, which=which)
-            _, V_r = eigs(self._T, k=k, which=which)
-        else:
-            logg.warning(
-                "This transition matrix is not sparse, computing full eigendecomposition"
-            )
-            D, V_l = np.linalg.eig(self._T.T)
-            _, V_r = np.linalg.eig(self._T)
+        with limit_threads():
+            if self._is_sparse:
+                logg.debug(f"DEBUG: Computing top `{k}` eigenvalues for sparse matrix")
+                D, V_l = eigs(self._T.T, k=k, which=which)
+                _, V_r = eigs(self._T, k=k, which=which)
+            else:
+                logg.warning(
+                    "This transition matrix is not sparse, computing full eigendecomposition"
+                )
+                D, V_l = np.linalg.eig(self._T.T)
+                _, V_r = np.linalg.eig(self._T)
 
         # Sort the eigenvalues and eigenvectors and take the real part
         logg.debug("DEBUG: Sorting eigenvalues by their real part")
@@ -847,6 +850,8 @@ class MarkovChain:
         keys: Optional[Sequence[str]] = None,
         check_irred: bool = False,
         norm_by_frequ: bool = False,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        filename: Optional[Union[str, Path]] = None,
     ) -> None:
         """
         Compute absorption probabilities for a Markov chain.
@@ -863,6 +868,10 @@ class MarkovChain:
             Check whether the matrix restricted to the given transient states is irreducible.
         norm_by_frequ
             Divide absorption probabilities for `rc_i` by `|rc_i|`.
+        dtype
+            Storage type of the absorption probabilities, such as `numpy.float32`. If `None`, use `numpy.float64`.
+        filename
+            If not `None`, store the absorption probabilities in a memory-mapped `.npy` file under this path.
 
         Returns
         -------
@@ -944,7 +953,8 @@ class MarkovChain:
 
         # compute abs probs. Since we don't expect sparse solution, dense computation is faster.
         logg.debug("DEBUG: Solving the linear system to find absorption probabilities")
-        abs_states = solve(eye - q, s)
+        with limit_threads():
+            abs_states = solve(eye - q, s)
 
         # aggregate to class level by summing over columns belonging to the same approx_rcs
         approx_rc_red = approx_rcs_[mask]
@@ -979,7 +989,13 @@ class MarkovChain:
             abs_classes,
             names=list(self._lin_probs.names),
             colors=list(self._lin_probs.colors),
+            dtype=dtype,
         )
+        if filename is not None:
+            logg.debug(
+                f"DEBUG: Memory-mapping absorption probabilities to `{filename}`"
+            )
+            self._lin_probs = self._lin_probs.to_memmap(filename)
 
         self._adata.obsm[self._lin_key] = self._lin_probs
         self._adata.obs[f"{self._lin_key}_dp"] = self._dp
@@ -1237,19 +1253,14 @@ class MarkovChain:
             raise KeyError(f"Cluster key `{cluster_key!r}` not found in `.adata.obs`.")
 
         # create dataframe to store approx_rc associtation with ts_clusters
-        ts_labels = self._adata.obs[cluster_key]
-        approx_rc_clusters = rc_labels.cat.categories
-        ts_clusters = ts_labels.cat.categories
-        rc_df = DataFrame(None, index=approx_rc_clusters, columns=ts_clusters)
-
-        # populate the df - compute the overlap
-        for cl in approx_rc_clusters:
-            row = [
-                np.sum(ts_labels.loc[np.array(rc_labels == cl)] == key)
-                for key in ts_clusters
-            ]
-            rc_df.loc[cl] = row
-        rc_df = rc_df.apply(to_numeric)
+        # populate the df - compute the overlap as a product of the indicator matrices
+        approx_rc_clusters, rc_ind = _group_indicator(rc_labels)
+        ts_clusters, ts_ind = _group_indicator(self._adata.obs[cluster_key])
+        rc_df = DataFrame(
+            (rc_ind @ ts_ind.T).A.astype(np.int64),
+            index=approx_rc_clusters,
+            columns=ts_clusters,
+        )
 
         # label endpoints and add uncertainty through entropy
         rc_df["entropy"] = entropy(rc_df.T)
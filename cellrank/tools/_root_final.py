@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from anndata import AnnData
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple, List
 from scanpy import logging as logg
+from scipy.sparse import csr_matrix
+
+import joblib as jl
 
 from cellrank.tools._markov_chain import MarkovChain
-from cellrank.tools._constants import RcKey
+from cellrank.tools._constants import RcKey, Direction, _transition, _colors, _probs
 from cellrank.tools._transition_matrix import transition_matrix
 from cellrank.utils._docs import inject_docs
+from cellrank.utils._threads import get_thread_budget, _apply_budget
 
 
 _find_docs = """\
@@ -41,14 +45,22 @@ n_start_end
     Otherwise, an eigen-gap heuristic is used.
 show_plots
     Whether to show plots of the spectrum and eigenvectors in the embedding.
-copy
+{extra}copy
     Whether to update the existing :paramref:`adata` object or to return a copy.
 
 Returns
 -------
 :class:`anndata.AnnData` or :class:`NoneType`
     Depending on :paramref:`copy`, either updates the existing :paramref:`adata` object or returns a copy.
-    Marked cells can be found in :paramref:`adata` `.obs` under `{key_added!r}`.
+    Marked cells can be found in :paramref:`adata` `.obs` under {key_added}.
+"""
+
+_parallel_docs = """\
+n_jobs
+    Number of parallel jobs. At most `2` jobs are used, one for each direction.
+backend
+    Which backend to use for parallelization. See :class:`joblib.Parallel` for valid options.
+    For process-based backends, large arrays are memory-mapped once and shared by both workers.
 """
 
 
@@ -64,9 +76,43 @@ def _root_final(
     copy: bool = False,
 ) -> Optional[AnnData]:
 
+    adata = adata.copy() if copy else adata
+    mc = _root_final_mc(
+        adata,
+        final=final,
+        cluster_key=cluster_key,
+        weight_connectivities=weight_connectivities,
+        percentile=percentile,
+        n_matches_min=n_matches_min,
+        n_start_end=n_start_end,
+    )
+
+    if show_plots:
+        _plot_root_final(mc, n_start_end=n_start_end)
+
+    return adata if copy else None
+
+
+def _root_final_mc(
+    adata: AnnData,
+    final: bool = True,
+    cluster_key: Optional[str] = None,
+    weight_connectivities: float = None,
+    percentile: int = 98,
+    n_matches_min: Optional[int] = 1,
+    n_start_end: Optional[int] = None,
+) -> MarkovChain:
+    """
+    Compute the root or final cells in :paramref:`adata`.
+
+    Returns
+    -------
+    :class:`cellrank.tl.MarkovChain`
+        The Markov chain used for the computation.
+    """
+
     key = RcKey.FORWARD if final else RcKey.BACKWARD
     logg.info(f"Computing `{key}`")
-    adata = adata.copy() if copy else adata
 
     # compute kernel object
     kernel = transition_matrix(
@@ -86,16 +132,77 @@ def _root_final(
         cluster_key=cluster_key,
     )
 
-    if show_plots:
-        mc.plot_real_spectrum()
-        mc.plot_eig_embedding(abs_value=True, perc=[0, 98], use=n_start_end)
-        mc.plot_eig_embedding(left=False, use=n_start_end)
+    return mc
 
-    return adata if copy else None
+
+def _plot_root_final(mc: MarkovChain, n_start_end: Optional[int] = None) -> None:
+    mc.plot_real_spectrum()
+    mc.plot_eig_embedding(abs_value=True, perc=[0, 98], use=n_start_end)
+    mc.plot_eig_embedding(left=False, use=n_start_end)
+
+
+def _result_keys(final: bool) -> Tuple[List[str], List[str]]:
+    """
+    Return keys in `adata.obs` and `adata.uns` written by :func:`_root_final`.
+    """
+
+    direction = Direction.FORWARD if final else Direction.BACKWARD
+    rc_key = str(RcKey.FORWARD if final else RcKey.BACKWARD)
+
+    return (
+        [rc_key, _probs(rc_key)],
+        [_transition(direction), f"eig_{direction}", _colors(rc_key)],
+    )
+
+
+def _shallow_copy(adata: AnnData) -> AnnData:
+    """
+    Create an annotated data object which shares the read-only inputs with :paramref:`adata`.
+
+    Only `.obs` is copied, the neighbor graphs, velocity graphs and the embeddings are passed by reference.
+    """
+
+    kwargs = {}
+    if hasattr(adata, "obsp"):
+        kwargs["obsp"] = dict(adata.obsp)
+
+    return AnnData(
+        csr_matrix((adata.n_obs, 0)),
+        obs=adata.obs.copy(),
+        obsm=dict(adata.obsm),
+        uns=dict(adata.uns),
+        **kwargs,
+    )
+
+
+def _root_final_worker(
+    adata: AnnData, final: bool, return_mc: bool = False, **kwargs
+) -> Dict[str, Any]:
+    """
+    Compute the root or final cells on a shallow copy of :paramref:`adata`.
+
+    Returns
+    -------
+    :class:`dict`
+        The computed values, stored under `'obs'` and `'uns'`, and the Markov chain under `'mc'`,
+        if :paramref:`return_mc` is `True`.
+    """
+
+    bdata = _shallow_copy(adata)
+    mc = _root_final_mc(bdata, final=final, **kwargs)
+    obs_keys, uns_keys = _result_keys(final)
+
+    return {
+        "obs": {k: bdata.obs[k] for k in obs_keys},
+        "uns": {k: bdata.uns[k] for k in uns_keys},
+        "mc": mc if return_mc else None,
+    }
 
 
 @inject_docs(
-    root=_find_docs.format(cells="root", direction="start", key_added="root_cells")
+    root=_find_docs.format(
+        cells="root", direction="start", key_added="`'root_cells'`", extra=""
+    )
 )
 def find_root(
     adata: AnnData,
@@ -125,7 +232,9 @@ def find_root(
 
 
 @inject_docs(
-    final=_find_docs.format(cells="final", direction="end", key_added="final_cells")
+    final=_find_docs.format(
+        cells="final", direction="end", key_added="`'final_cells'`", extra=""
+    )
 )
 def find_final(
     adata: AnnData,
@@ -152,3 +261,67 @@ def find_final(
         show_plots=show_plots,
         copy=copy,
     )
+
+
+@inject_docs(
+    both=_find_docs.format(
+        cells="root and final",
+        direction="start- and end",
+        key_added="`'root_cells'` and `'final_cells'`",
+        extra=_parallel_docs,
+    )
+)
+def root_final(
+    adata: AnnData,
+    cluster_key: Optional[str] = None,
+    weight_connectivities: float = None,
+    percentile: int = 98,
+    n_start_end: Optional[int] = None,
+    n_jobs: Optional[int] = 2,
+    backend: str = "threading",
+    show_plots: bool = False,
+    copy: bool = False,
+) -> Optional[AnnData]:
+    """
+    Root and final cells of a dynamic process in single cells.
+
+    Computes the same as :func:`cellrank.tl.find_root` and :func:`cellrank.tl.find_final`, but both directions
+    are processed concurrently. The kNN and velocity graphs are shared between the two computations and the results
+    are written to :paramref:`adata` at once, after both directions have finished.
+
+    {both}
+    """
+
+    adata = adata.copy() if copy else adata
+
+    start = logg.info(f"Computing `{RcKey.BACKWARD}` and `{RcKey.FORWARD}`")
+    budget = get_thread_budget(n_jobs)
+    logg.debug(f"DEBUG: Using `{budget}`")
+    worker, limit = _apply_budget(_root_final_worker, budget, backend)
+    with limit:
+        res = jl.Parallel(n_jobs=n_jobs, backend=backend, mmap_mode="r")(
+            jl.delayed(worker)(
+                adata,
+                final=final,
+                cluster_key=cluster_key,
+                weight_connectivities=weight_connectivities,
+                percentile=percentile,
+                n_start_end=n_start_end,
+                return_mc=show_plots,
+            )
+            for final in (False, True)
+        )
+
+    for r in res:
+        for k, v in r["obs"].items():
+            adata.obs[k] = v
+        adata.uns.update(r["uns"])
+
+    if show_plots:
+        # the Markov chains were computed with the same kernels, on the shallow copies of `adata`
+        for r in res:
+            _plot_root_final(r["mc"], n_start_end=n_start_end)
+
+    logg.info("    Finish", time=start)
+
+    return adata if copy else None
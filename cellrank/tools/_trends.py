@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from typing import Optional, Sequence, Union, Iterator, List, Dict
+
+import numpy as np
+
+from anndata import AnnData
+from scanpy import logging as logg
+
+from cellrank.plotting._utils import (
+    _create_models,
+    _is_any_gam_mgcv,
+    _lookup_trends,
+    _model_type,
+)
+from cellrank.tools._constants import LinKey
+from cellrank.utils._cache import TrendCache, get_trend_cache
+from cellrank.utils._executors import Executor, get_executor, _is_thread_backend
+from cellrank.utils._parallelize import _get_tqdm, _split_by_costs, _N_CHUNKS_PER_JOB
+from cellrank.utils._shared import shared_models
+from cellrank.utils._utils import (
+    check_collection,
+    _get_n_cores,
+    _get_gene_costs,
+    _make_unique,
+)
+from cellrank.utils.models import Model
+from cellrank.utils.models._models import _Preparer, _put_trends
+
+Trend = namedtuple("Trend", ["gene", "lineage", "x_test", "y_test", "conf_int"])
+Trend.__doc__ = """\
+Fitted trend of one gene in one lineage, see :func:`cellrank.tl.iter_trends`."""
+
+
+def _fit_trends(
+    genes: Sequence[str],
+    lineage_names: Sequence[Optional[str]],
+    start_lineages: Sequence[Optional[str]],
+    end_lineages: Sequence[Optional[str]],
+    models: Dict[str, Dict[str, Model]],
+    conf_int: bool = False,
+    cache: Optional[TrendCache] = None,
+    **kwargs,
+) -> List[Trend]:
+    """
+    Fit models for given genes and lineages and keep only the predictions.
+
+    Params
+    ------
+    genes
+        Genes for which to fit the models.
+    lineage_names
+        Lineages for which to fit the models.
+    start_lineages
+        Start clusters for given :paramref:`lineage_names`.
+    end_lineages
+        End clusters for given :paramref:`lineage_names`.
+    models
+        Gene and lineage specific models.
+    conf_int
+        Whether to compute the confidence interval.
+    cache
+        Cache of the fitted trends.
+    kwargs
+        Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+    Returns
+    -------
+    :class:`list`
+        The fitted trends.
+    """
+
+    res, prepare = [], _Preparer(genes)
+    for gene, fitted in prepare.fit(
+        models,
+        lineage_names,
+        start_lineages,
+        end_lineages,
+        conf_int=conf_int,
+        cache=cache,
+        **kwargs,
+    ):
+        for ln, model in fitted.items():
+            ci = model.conf_int if conf_int else None
+            res.append(Trend(gene, ln, np.squeeze(model.x_test), model.y_test, ci))
+
+    return res
+
+
+def iter_trends(
+    adata: AnnData,
+    model: _model_type,
+    genes: Union[str, Sequence[str]],
+    lineages: Optional[Union[str, Sequence[str]]] = None,
+    data_key: str = "X",
+    final: bool = True,
+    start_lineage: Optional[Union[str, Sequence[str]]] = None,
+    end_lineage: Optional[Union[str, Sequence[str]]] = None,
+    conf_int: bool = False,
+    n_jobs: Optional[int] = 1,
+    backend: Union[str, Executor] = "loky",
+    show_progress_bar: bool = True,
+    **kwargs,
+) -> Iterator[Trend]:
+    """
+    Fit gene trends and yield them as soon as they are computed.
+
+    Unlike :func:`cellrank.pl.gene_trends`, the fitted models are not kept in memory, only their predictions
+    are passed to the caller, which makes it possible to process large number of genes incrementally.
+    Trends found in :func:`cellrank.ul.get_trend_cache` are not fitted again.
+
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
+        Annotated data object.
+    model
+        Model to fit.
+
+        - If a :class:`dict`, gene and lineage specific models can be specified. Use `'*'` to indicate
+          all genes or lineages, for example `{'Map2': {'*': ...}, 'Dcx': {'Alpha': ..., '*': ...}}`.
+    genes
+        Genes in :paramref:`adata` `.var_names` or in :paramref:`adata` `.obs`, see :paramref:`data_key`.
+    lineages
+        Names of the lineages for which to fit the trends. If `None`, use all lineages.
+    data_key
+        Key in :paramref:`adata` `.layers`, `'X'` for :paramref:`adata` `.X` or `'obs'` for :paramref:`adata` `.obs`.
+    final
+        Whether to consider cells going to final states or vice versa.
+    start_lineage
+        Lineages from which to select cells with lowest pseudotime as starting points.
+    end_lineage
+        Lineages from which to select cells with highest pseudotime as endpoints.
+    conf_int
+        Whether to compute the confidence interval.
+    n_jobs
+        Number of parallel jobs. If `-1`, use all available cores. If `None` or `1`, the execution is sequential.
+    backend
+        Which backend to use. Valid options are `'threading'`, `'multiprocessing'`, `'loky'`, `'dask'`
+        or an instance of :class:`cellrank.ul.Executor`, such as
+        :class:`cellrank.ul.DaskExecutor` connected to a remote cluster.
+    show_progress_bar
+        Whether to show a progress bar tracking the fitted genes.
+    kwargs
+        Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+    Yields
+    ------
+    :class:`cellrank.tl._trends.Trend`
+        Named tuple `(gene, lineage, x_test, y_test, conf_int)`, in the order of completion.
+        `conf_int` is `None` if :paramref:`conf_int` `=False`.
+    """
+
+    ln_key = str(LinKey.FORWARD if final else LinKey.BACKWARD)
+    if ln_key not in adata.obsm:
+        raise KeyError(f"Lineages key `{ln_key!r}` not found in `adata.obsm`.")
+
+    if isinstance(genes, str):
+        genes = [genes]
+    genes = _make_unique(genes)
+    check_collection(adata, genes, "obs" if data_key == "obs" else "var_names")
+
+    if lineages is None:
+        lineages = adata.obsm[ln_key].names
+    elif isinstance(lineages, str):
+        lineages = [lineages]
+    lineages = _make_unique(lineages)
+    for ln in filter(lambda ln: ln is not None, lineages):
+        _ = adata.obsm[ln_key][ln]
+
+    if isinstance(start_lineage, (str, type(None))):
+        start_lineage = [start_lineage] * len(lineages)
+    if isinstance(end_lineage, (str, type(None))):
+        end_lineage = [end_lineage] * len(lineages)
+    if len(start_lineage) != len(lineages) or len(end_lineage) != len(lineages):
+        raise ValueError(
+            f"Expected the number of start and end lineages to be the same as number of lineages "
+            f"`{len(lineages)}`, found `{len(start_lineage)}` and `{len(end_lineage)}`."
+        )
+
+    models = _create_models(model, genes, lineages)
+    if _is_any_gam_mgcv(models) and _is_thread_backend(backend):
+        logg.debug("DEBUG: Setting backend to `'loky'` because model is `GamMGCV`")
+        backend = "loky"
+
+    kwargs["data_key"] = data_key
+    kwargs["final"] = final
+    kwargs["conf_int"] = conf_int
+    kwargs["cache"] = cache = get_trend_cache()
+
+    n_jobs = _get_n_cores(n_jobs, len(genes))
+    hits, keys, kwargs = _lookup_trends(
+        genes,
+        lineages,
+        start_lineage,
+        end_lineage,
+        n_jobs,
+        backend,
+        models=models,
+        **kwargs,
+    )
+    models = kwargs.pop("models")
+
+    tqdm = _get_tqdm(show_progress_bar)
+    pbar = None if tqdm is None else tqdm(total=len(genes), unit="gene")
+
+    for gene, trends in hits.items():
+        for ln, (x_test, y_test, ci) in trends.items():
+            yield Trend(gene, ln, np.squeeze(x_test), y_test, ci if conf_int else None)
+        if pbar is not None:
+            pbar.update(1)
+
+    genes = [gene for gene in genes if gene not in hits]
+    if not genes:
+        if pbar is not None:
+            pbar.close()
+        return
+
+    chunks, costs = _split_by_costs(
+        genes, _get_gene_costs(adata, genes, data_key), _N_CHUNKS_PER_JOB * n_jobs
+    )
+    order = iter(np.argsort(-costs, kind="stable"))
+
+    with shared_models(
+        adata,
+        models,
+        genes,
+        backend=backend if n_jobs > 1 else "sequential",
+        data_key=data_key,
+        time_key=kwargs.get("time_key", "latent_time"),
+    ):
+        args = (lineages, start_lineage, end_lineage)
+        if n_jobs == 1:
+            for ix in order:
+                yield from _fit_trends(chunks[ix], *args, models=models, **kwargs)
+                if pbar is not None:
+                    pbar.update(len(chunks[ix]))
+            if pbar is not None:
+                pbar.close()
+            return
+
+        executor = get_executor(backend, n_jobs)
+        pending = set()
+
+        def submit() -> None:
+            ix = next(order, None)
+            if ix is not None:
+                chunk = chunks[ix]
+                pending.add(
+                    executor.submit(
+                        _fit_trends,
+                        chunk,
+                        *args,
+                        models={gene: models[gene] for gene in chunk},
+                        **kwargs,
+                    )
+                )
+
+        try:
+            # keep a bounded number of chunks in flight
+            for _ in range(2 * n_jobs):
+                submit()
+            while pending:
+                done, pending = executor.wait(pending)
+                for future in done:
+                    trends = executor.result(future)
+                    submit()
+                    _put_trends(cache, keys, trends)
+                    if pbar is not None:
+                        pbar.update(len(trends) // len(lineages))
+                    yield from trends
+        finally:
+            for future in pending:
+                executor.cancel(future)
+            # only shut down the executors we've created
+            if executor is not backend:
+                executor.shutdown()
+            if pbar is not None:
+                pbar.close()
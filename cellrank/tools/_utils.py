@@ -17,13 +17,12 @@ import numpy as np
 import scanpy as sc
 
 from anndata import AnnData
-from pandas import Series
+from pandas import Series, Categorical, Index
 from pandas.api.types import is_categorical_dtype
 from scanpy import logging as logg
 from scipy.sparse import csr_matrix, spmatrix
 from scipy.sparse import issparse
 from sklearn.cluster import KMeans
-from sklearn.neighbors import NearestNeighbors
 
 from cellrank.utils._utils import has_neighs, get_neighs, get_neighs_params
 
@@ -98,18 +97,85 @@ def bias_knn(conn, pseudotime, n_neighbors, k=3):
     return conn_biased
 
 
-def _vec_mat_corr(X: Union[np.ndarray, spmatrix], y: np.ndarray) -> np.ndarray:
+def _read_rows(
+    X: Any, start: int, stop: int, cols: Optional[np.ndarray] = None
+) -> Union[np.ndarray, csr_matrix]:
     """
-    Computes the correlation between columns in matrix X and a vector y
+    Read the rows `[start, stop)` of a possibly backed matrix.
 
-    Returns NaN for genes which don't vary across cells
+    Params
+    ------
+    X
+        Dense or sparse matrix, or its backed counterpart, such as :class:`h5py.Dataset`.
+    start
+        Index of the first row.
+    stop
+        Index after the last row.
+    cols
+        Sorted indices of the columns to read. If `None`, read all columns.
+
+    Returns
+    -------
+    :class:`numpy.ndarray` or :class:`scipy.sparse.csr_matrix`
+        The rows as a dense or a sparse matrix.
+    """
+
+    if isinstance(X, np.ndarray) and cols is not None:
+        return X[start:stop, cols]
+
+    X = X[start:stop]
+    X = csr_matrix(X) if issparse(X) else np.asarray(X)
+
+    return X if cols is None else X[:, cols]
+
+
+def _block_moments(X: Union[np.ndarray, csr_matrix]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the mean and the sum of squared deviations of the columns of :paramref:`X` without densifying it.
 
     Params
     ------
     X
-        Matrix of `NxM` elements.
-    y:
-        Vector of `M` elements.
+        Dense or sparse matrix.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`, :class:`numpy.ndarray`
+        The means and the sums of squared deviations from the mean.
+    """
+
+    if not issparse(X):
+        X = np.asarray(X, dtype=np.float64)
+        mean = X.mean(axis=0)
+        return mean, np.sum((X - mean) ** 2, axis=0)
+
+    n, n_cols = X.shape
+    mean = np.bincount(X.indices, weights=X.data, minlength=n_cols) / n
+    m2 = np.bincount(
+        X.indices, weights=(X.data - mean[X.indices]) ** 2, minlength=n_cols
+    )
+    # the implicit zeros
+    m2 += (n - np.bincount(X.indices, minlength=n_cols)) * mean ** 2
+
+    return mean, m2
+
+
+def _corr_from_moments(
+    xty: np.ndarray, mean: np.ndarray, m2: np.ndarray, y: np.ndarray
+) -> np.ndarray:
+    """
+    Computes the correlation from the moments accumulated by :func:`_vec_mat_corr` and :func:`cyto_trace`.
+
+    Params
+    ------
+    xty
+        Product of the transposed matrix with :paramref:`y`.
+    mean
+        Means of the columns of the matrix.
+    m2
+        Sums of squared deviations of the columns of the matrix.
+    y
+        Vector of `N` elements.
 
     Returns
     -------
@@ -117,24 +183,66 @@ def _vec_mat_corr(X: Union[np.ndarray, spmatrix], y: np.ndarray) -> np.ndarray:
         The computed correlation.
     """
 
-    X_bar, y_std, n = np.array(X.mean(axis=0)).reshape(-1), np.std(y), X.shape[0]
-    denom = X.T.dot(y) - n * X_bar * np.mean(y)
-    nom = (
-        (n - 1) * np.std(X.A, axis=0) * y_std
-        if issparse(X)
-        else (X.shape[0] - 1) * np.std(X, axis=0) * y_std
-    )
+    n = len(y)
+    denom = xty - n * mean * np.mean(y)
+    nom = (n - 1) * np.sqrt(m2 / n) * np.std(y)
 
     if np.sum(nom == 0) > 0:
         logg.warning(
             f"No variation found in `{np.sum(nom==0)}` genes. Setting correlation for these to `NaN`"
         )
 
-    return denom / nom
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return denom / nom
+
+
+def _merge_moments(
+    n: int,
+    mean: np.ndarray,
+    m2: np.ndarray,
+    n_b: int,
+    mean_b: np.ndarray,
+    m2_b: np.ndarray,
+) -> Tuple[int, np.ndarray, np.ndarray]:
+    """Merge the moments of two blocks of rows, see :func:`_block_moments`."""
+
+    n_new = n + n_b
+    delta = mean_b - mean
+
+    return n_new, mean + delta * n_b / n_new, m2 + m2_b + delta ** 2 * n * n_b / n_new
+
+
+def _vec_mat_corr(X: Union[np.ndarray, spmatrix], y: np.ndarray) -> np.ndarray:
+    """
+    Computes the correlation between columns in matrix X and a vector y
+
+    Returns NaN for genes which don't vary across cells
+
+    Params
+    ------
+    X
+        Matrix of `NxM` elements.
+    y:
+        Vector of `N` elements.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The computed correlation.
+    """
+
+    X = csr_matrix(X) if issparse(X) else X
+    mean, m2 = _block_moments(X)
+
+    return _corr_from_moments(np.asarray(X.T.dot(y)).reshape(-1), mean, m2, y)
 
 
 def cyto_trace(
-    adata: AnnData, layer: str = "Ms", copy: bool = False, use_median: bool = False
+    adata: AnnData,
+    layer: str = "Ms",
+    copy: bool = False,
+    use_median: bool = False,
+    block_size: int = 1024,
 ) -> Optional[AnnData]:
     """
     Re-implementation of the CytoTrace algorithm by *Gulati et al.* to infer cell plasticity.
@@ -142,6 +250,9 @@ def cyto_trace(
     Finds the top 200 genes correlated with #genes/cell and computes their (imputed) mean or median expression.
     For more references, see [Cyto20]_.
 
+    The expression is read in blocks of :paramref:`block_size` cells, sparse matrices are never densified,
+    so :paramref:`adata` can also be opened in backed mode.
+
     Workflow
     In *scanpy*, take your raw :paramref:`adata` object and run :func:`scvelo.pp.moments` on it. Then run this function.
 
@@ -150,9 +261,11 @@ def cyto_trace(
     adata : :class:`anndata.AnnData`
         Annotated data object.
     copy
-        Whether to write directly to :paramref:`adata` or to a copy.
+        Whether to write directly to :paramref:`adata` or to a copy. Not supported if :paramref:`adata` is backed.
     use_median
         If `True`, use *median*, otherwise *mean*.
+    block_size
+        Number of cells processed at once.
 
     Returns
     -------
@@ -160,41 +273,72 @@ def cyto_trace(
         Depending on :paramref:`copy`, either updates :paramref:`adata` or returns a copy.
     """
 
-    # check use_raw and copy
-    adata_comp = adata.copy() if copy else adata
-    if layer not in adata_comp.layers:
+    if layer != "X" and layer not in adata.layers:
         raise KeyError(f"Compute layer `{layer!r}` first")
+    if block_size <= 0:
+        raise ValueError(f"Expected `block_size` to be positive, found `{block_size}`.")
+    if copy and adata.isbacked:
+        raise ValueError(
+            "Unable to copy `adata` in backed mode, use `copy=False` to write directly to it."
+        )
 
     start = logg.info(f"Computing CytoTrace score with `{adata.n_vars}` genes")
-    if adata_comp.n_vars < 10000:
+    if adata.n_vars < 10000:
         logg.warning("Consider using more genes")
 
-    # compute number of expressed genes per cell
+    blocks = [
+        (i, min(i + block_size, adata.n_obs)) for i in range(0, adata.n_obs, block_size)
+    ]
+
+    # compute number of expressed genes per cell, together with the moments of the genes
     logg.debug("Computing number of genes expressed per cell")
-    num_exp_genes = np.array((adata_comp.X > 0).sum(axis=1)).reshape(-1)
-    adata_comp.obs["num_exp_genes"] = num_exp_genes
+    num_exp_genes = np.empty(adata.n_obs, dtype=np.int64)
+    n, mean, m2 = 0, np.zeros(adata.n_vars), np.zeros(adata.n_vars)
+    xty = np.zeros(adata.n_vars)
+
+    for i, j in blocks:
+        X = _read_rows(adata.X, i, j)
+        if issparse(X):
+            rows = np.repeat(np.arange(j - i), np.diff(X.indptr))
+            y = np.bincount(rows, weights=X.data > 0, minlength=j - i)
+        else:
+            y = np.sum(X > 0, axis=1)
+        num_exp_genes[i:j] = y
+
+        n, mean, m2 = _merge_moments(n, mean, m2, j - i, *_block_moments(X))
+        xty += np.asarray(X.T.dot(y.astype(np.float64))).reshape(-1)
 
     # compute correlation with all genes
     logg.debug("Correlating all genes with number of genes expressed per cell")
-    gene_corr = _vec_mat_corr(adata_comp.X, num_exp_genes)
+    gene_corr = _corr_from_moments(xty, mean, m2, num_exp_genes)
 
     # annotate the top 200 genes in terms of correlation
     logg.debug("Finding the top `200` most correlated genes")
-    adata_comp.var["gene_corr"] = gene_corr
-    top_200 = adata_comp.var.sort_values(by="gene_corr", ascending=False).index[:200]
-    adata_comp.var["correlates"] = False
-    adata_comp.var.loc[top_200, "correlates"] = True
+    top_200 = (
+        Series(gene_corr, index=adata.var_names)
+        .sort_values(ascending=False)
+        .index[:200]
+    )
+    correlates = adata.var_names.isin(top_200)
 
     # compute mean/median over top 200 genes, aggregate over genes and shift to [0, 1] range
     logg.debug("Aggregating imputed gene expression")
-    corr_mask = adata_comp.var["correlates"]
-    imputed_exp = (
-        adata_comp[:, corr_mask].X
-        if layer == "X"
-        else adata_comp[:, corr_mask].layers[layer]
-    )
-    gcs = np.median(imputed_exp, axis=1) if use_median else np.mean(imputed_exp, axis=1)
+    imputed = adata.X if layer == "X" else adata.layers[layer]
+    cols = np.where(correlates)[0]
+    gcs = np.empty(adata.n_obs)
+
+    for i, j in blocks:
+        X = _read_rows(imputed, i, j, cols)
+        if use_median:
+            gcs[i:j] = np.median(X.toarray() if issparse(X) else X, axis=1)
+        else:
+            gcs[i:j] = np.asarray(X.mean(axis=1)).reshape(-1)
     gcs /= np.max(gcs)
+
+    adata_comp = adata.copy() if copy else adata
+    adata_comp.obs["num_exp_genes"] = num_exp_genes
+    adata_comp.var["gene_corr"] = gene_corr
+    adata_comp.var["correlates"] = correlates
     adata_comp.obs["gcs"] = gcs
 
     logg.info("    Finish", time=start)
@@ -431,10 +575,14 @@ def _subsample_embedding(
     n_dim: int = 2,
     n_grid_points_total: Optional[int] = None,
     n_grid_points_dim: Optional[int] = None,
+    n_per_voxel: int = 1,
 ) -> Tuple[np.ndarray, float]:
     """
     Subsample cells to uniformly cover an embedding.
-    If using default parameter settings, this will get very slow for more than 4 embedding dimensions.
+
+    The cells are binned into the voxels centered at the grid points and from each occupied voxel,
+    the cell closest to its center is selected. The running time only depends on the number of cells,
+    not on the number of grid points.
 
     Params
     ------
@@ -450,6 +598,9 @@ def _subsample_embedding(
     n_grid_points_dim
         Determines how many gridpoints to use in each dimension.
         Only one of :paramref:`n_grid_points_total` and :paramref:`n_grid_points_dim` can be specified.
+    n_per_voxel
+        Number of cells closest to the center to select from each voxel. Values larger than `1` keep more cells
+        in the dense regions of the embedding.
 
     Returns
     -------
@@ -465,7 +616,12 @@ def _subsample_embedding(
             raise ValueError(f"Basis {basis} not found.")
         X_em = data.obsm[f"X_{basis}"][:, :n_dim]
     else:
-        X_em = data[:, n_dim]
+        X_em = data[:, :n_dim]
+
+    if n_per_voxel <= 0:
+        raise ValueError(
+            f"Expected `n_per_voxel` to be positive, found `{n_per_voxel}`."
+        )
 
     # handle grid specification
     if (n_grid_points_total is not None) and (n_grid_points_dim is not None):
@@ -478,31 +634,26 @@ def _subsample_embedding(
         n_grid_points_total = 10 ** (2 + n_dim)
         n_grid_points_dim = int((n_grid_points_total) ** (1 / n_dim))
 
-    # set up the grid
-    steps = np.repeat(n_grid_points_dim, n_dim)
-    grs = []
-    for dim_i in range(n_dim):
-        m, M = np.min(X_em[:, dim_i]), np.max(X_em[:, dim_i])
-        m = m - 0.025 * np.abs(M - m)
-        M = M + 0.025 * np.abs(M - m)
-        gr = np.linspace(m, M, steps[dim_i])
-        grs.append(gr)
-    meshes_tuple = np.meshgrid(*grs)
-    gridpoints_coordinates = np.vstack([i.flat for i in meshes_tuple]).T
-
-    # fit nearest neighbors classifier to embedding and determine nearest neighbors of each grid point
-    nn = NearestNeighbors()
-    nn.fit(X_em)
-    dist, ixs = nn.kneighbors(gridpoints_coordinates, 1)
-
-    # reduce this to indices coming from gridpoints covered by the data
-    diag_step_dist = np.linalg.norm(
-        [grs[dim_i][1] - grs[dim_i][0] for dim_i in range(n_dim)]
-    )
-    min_dist = diag_step_dist / 2
-    ixs = ixs[dist < min_dist]
+    # set up the grid, only its origin and the distance between the neighboring points are needed
+    m, M = np.min(X_em, axis=0), np.max(X_em, axis=0)
+    m = m - 0.025 * np.abs(M - m)
+    M = M + 0.025 * np.abs(M - m)
+    step = (M - m) / (n_grid_points_dim - 1)
+    diag_step_dist = np.linalg.norm(step)
+    step[step == 0] = 1
+
+    # bin the cells into the voxels centered at the grid points
+    voxels = np.rint((X_em - m) / step).astype(np.int64)
+    _, groups = np.unique(voxels, axis=0, return_inverse=True)
+    dist = np.linalg.norm(X_em - (m + voxels * step), axis=1)
+
+    # sort the cells by their voxel and distance to its center and keep the first ones in each voxel
+    order = np.lexsort((np.arange(len(dist)), dist, groups))
+    groups = groups[order]
+    first = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    rank = np.arange(len(groups)) - np.repeat(first, np.diff(np.r_[first, len(groups)]))
 
-    cells_ixs = np.unique(ixs)
+    cells_ixs = np.sort(order[rank < n_per_voxel])
 
     return cells_ixs, diag_step_dist
 
@@ -798,3 +949,45 @@ def _convert_to_categorical_series(
         rc_labels[cells] = rc
 
     return rc_labels.astype("category")
+
+
+def _group_indicator(
+    labels: Union[Series, Sequence[Any]], weights: Optional[np.ndarray] = None
+) -> Tuple[Index, csr_matrix]:
+    """
+    Create a sparse one-hot indicator matrix of groups x observations.
+
+    Params
+    ------
+    labels
+        Group labels for each observation. `NaN` values don't belong to any group.
+    weights
+        Optional weight of each observation. If `None`, all observations have weight `1`.
+
+    Returns
+    -------
+    :class:`pandas.Index`, :class:`scipy.sparse.csr_matrix`
+        The groups and the indicator matrix of shape `(n_groups, n_observations)`.
+    """
+
+    labels = labels.values if isinstance(labels, Series) else labels
+    cat = labels if isinstance(labels, Categorical) else Categorical(labels)
+    codes = np.asarray(cat.codes)
+    n_obs = len(codes)
+
+    if weights is None:
+        weights = np.ones(n_obs, dtype=np.float64)
+    else:
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+        if weights.shape != (n_obs,):
+            raise ValueError(
+                f"Expected `weights` to be of shape `{(n_obs,)}`, found `{weights.shape}`."
+            )
+
+    mask = codes != -1
+    indicator = csr_matrix(
+        (weights[mask], (codes[mask], np.where(mask)[0])),
+        shape=(len(cat.categories), n_obs),
+    )
+
+    return cat.categories, indicator
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from cellrank.utils._cache import TrendCache, trend_cache, get_trend_cache
+from cellrank.utils._parallelize import pool
+from cellrank.utils._progress import Telemetry, get_telemetry
+from cellrank.utils._threads import (
+    ThreadBudget,
+    thread_budget,
+    get_thread_budget,
+    limit_threads,
+)
+from cellrank.utils._executors import (
+    Executor,
+    ThreadExecutor,
+    ProcessExecutor,
+    LokyExecutor,
+    DaskExecutor,
+)
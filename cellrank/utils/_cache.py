@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import hashlib
+import os
+
+import numpy as np
+
+_DEFAULT_MAXSIZE = 4096
+
+_caches: List["TrendCache"] = []
+
+
+def _fingerprint(*parts: Any) -> str:
+    """
+    Hash :paramref:`parts` into a hexadecimal string.
+
+    Arrays are hashed by their type, shape and content, everything else by its :func:`repr`.
+
+    Params
+    ------
+    parts
+        Parts to hash.
+
+    Returns
+    -------
+    :class:`str`
+        The hash.
+    """
+
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.dtype.str}{part.shape}".encode())
+            h.update(np.ascontiguousarray(part).data)
+        else:
+            h.update(repr(part).encode())
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+def _read_only(arr: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if arr is None:
+        return None
+    arr = np.array(arr, copy=True)
+    arr.setflags(write=False)
+    return arr
+
+
+class TrendCache:
+    """
+    Least recently used cache of fitted gene trends, shared by :func:`cellrank.pl.gene_trends`,
+    :func:`cellrank.pl.heatmap`, :func:`cellrank.pl.cluster_lineage` and :func:`cellrank.tl.gene_importance`.
+
+    The trends are identified by the gene, the lineage, the type and hyper-parameters of the model, the arguments of
+    :meth:`cellrank.ul.models.Model.prepare` and the fingerprints of the expression, pseudotime and weights,
+    so modifying the data invalidates them.
+
+    With process-based backends, the trends are looked up before the genes are dispatched and the newly fitted ones
+    are stored once the workers return them, since only :paramref:`dirname` is pickled.
+    Use :paramref:`dirname` to share the trends between sessions.
+
+    Params
+    ------
+    maxsize
+        Maximum number of trends kept in memory. If `0`, nothing is kept in memory.
+    dirname
+        Directory where to additionally store the trends. If `None`, they are only kept in memory.
+    """
+
+    def __init__(self, maxsize: int = _DEFAULT_MAXSIZE, dirname: Optional[str] = None):
+        if maxsize < 0:
+            raise ValueError(f"Expected `maxsize` to be `>= 0`, found `{maxsize}`.")
+        if dirname is not None:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.maxsize = maxsize
+        self.dirname = dirname
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[np.ndarray, ...]]" = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the trends are stored anywhere."""
+        return self.maxsize > 0 or self.dirname is not None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dirname, f"{key}.npz")
+
+    def _store(self, key: str, value: Tuple[Optional[np.ndarray], ...]) -> None:
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(
+        self, key: str, conf_int: bool = False
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+        """
+        Return the trend stored under :paramref:`key`.
+
+        Params
+        ------
+        key
+            Key of the trend.
+        conf_int
+            Whether the confidence interval is required. If it is and the stored trend doesn't have one,
+            it's considered missing.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`, :class:`numpy.ndarray`, :class:`numpy.ndarray`
+            Copies of the test points, the predictions and the confidence interval or `None` if not found.
+        """
+
+        with self._lock:
+            value = self._data.get(key, None)
+            if value is not None:
+                self._data.move_to_end(key)
+
+        if value is None and self.dirname is not None:
+            try:
+                with np.load(self._path(key), allow_pickle=False) as f:
+                    value = tuple(
+                        _read_only(f[k]) if k in f else None
+                        for k in ("x_test", "y_test", "conf_int")
+                    )
+            except (OSError, ValueError, KeyError):
+                value = None
+            if value is not None:
+                self._store(key, value)
+
+        if value is None or (conf_int and value[2] is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return tuple(None if v is None else v.copy() for v in value)
+
+    def put(
+        self,
+        key: str,
+        x_test: np.ndarray,
+        y_test: np.ndarray,
+        conf_int: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Store a trend.
+
+        Params
+        ------
+        key
+            Key of the trend.
+        x_test
+            Test points.
+        y_test
+            Predictions for :paramref:`x_test`.
+        conf_int
+            Confidence interval or `None`.
+
+        Returns
+        -------
+        None
+            Nothing, just stores the trend.
+        """
+
+        value = (_read_only(x_test), _read_only(y_test), _read_only(conf_int))
+        self._store(key, value)
+
+        if self.dirname is not None:
+            arrays = dict(zip(("x_test", "y_test", "conf_int"), value))
+            if conf_int is None:
+                del arrays["conf_int"]
+            # write to a temporary file first, so that other processes never read a partial one
+            tmp = self._path(f"{key}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._path(key))
+
+    def clear(self) -> None:
+        """Remove all trends from memory and from :paramref:`dirname`."""
+        with self._lock:
+            self._data.clear()
+        if self.dirname is not None:
+            for fname in os.listdir(self.dirname):
+                if fname.endswith(".npz"):
+                    os.remove(os.path.join(self.dirname, fname))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"maxsize": self.maxsize, "dirname": self.dirname}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}[n_trends={len(self)}, maxsize={self.maxsize}, "
+            f"dirname={self.dirname!r}, hits={self.hits}, misses={self.misses}]"
+        )
+
+
+_default_cache = TrendCache()
+
+
+@contextmanager
+def trend_cache(
+    maxsize: int = _DEFAULT_MAXSIZE, dirname: Optional[str] = None
+) -> Iterator[TrendCache]:
+    """
+    Use a separate cache of fitted gene trends within the context.
+
+    Params
+    ------
+    maxsize
+        Maximum number of trends kept in memory. Use `0` together with :paramref:`dirname` `=None`
+        to disable caching.
+    dirname
+        Directory where to additionally store the trends, e.g. to reuse them in another session.
+
+    Yields
+    ------
+    :class:`cellrank.ul.TrendCache`
+        The cache.
+    """
+
+    cache = TrendCache(maxsize, dirname)
+    _caches.append(cache)
+    try:
+        yield cache
+    finally:
+        _caches.remove(cache)
+
+
+def get_trend_cache() -> TrendCache:
+    """
+    Return the cache of fitted gene trends used by the plotting and tools functions.
+
+    Returns
+    -------
+    :class:`cellrank.ul.TrendCache`
+        The innermost cache set by :func:`cellrank.ul.trend_cache` or the default in-memory cache.
+    """
+
+    return _caches[-1] if _caches else _default_cache
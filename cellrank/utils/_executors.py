@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+from abc import ABC, abstractmethod
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from typing import Any, Callable, Iterable, Optional, Set, Tuple, Union
+
+_THREAD_BACKENDS = ("threading", "sequential")
+
+
+class Executor(ABC):
+    """
+    Base class for executors which run the parallel tasks of :func:`cellrank.utils._parallelize.parallelize`
+    and :func:`cellrank.tl.iter_trends`.
+
+    Params
+    ------
+    n_jobs
+        Number of parallel jobs.
+    """
+
+    #: Whether the tasks run in separate processes.
+    is_process_based = True
+    #: Whether the workers run on this machine and can read its temporary files.
+    is_local = True
+
+    def __init__(self, n_jobs: int = 1):
+        self.n_jobs = n_jobs
+
+    @abstractmethod
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Schedule `fn(*args, **kwargs)` to be run.
+
+        Params
+        ------
+        fn
+            Function to run.
+        args
+            Positional arguments for :paramref:`fn`.
+        kwargs
+            Keyword arguments for :paramref:`fn`.
+
+        Returns
+        -------
+        :class:`concurrent.futures.Future`
+            Future-like object representing the execution.
+        """
+
+        pass
+
+    def wait(self, futures: Iterable[Any]) -> Tuple[Set[Any], Set[Any]]:
+        """
+        Wait until at least one of :paramref:`futures` finishes.
+
+        Params
+        ------
+        futures
+            Futures returned by :meth:`submit`.
+
+        Returns
+        -------
+        :class:`set`, :class:`set`
+            The finished and the pending futures.
+        """
+
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        return set(done), set(pending)
+
+    def result(self, future: Any) -> Any:
+        """Block until :paramref:`future` finishes and return its result."""
+        return future.result()
+
+    def cancel(self, future: Any) -> None:
+        """Cancel :paramref:`future`, if it's not running yet."""
+        future.cancel()
+
+    def shutdown(self) -> None:
+        """Release the resources held by the executor."""
+        pass
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}[n_jobs={self.n_jobs}]"
+
+
+class _PoolExecutor(Executor, ABC):
+    _pool_cls = None
+
+    def __init__(self, n_jobs: int = 1):
+        super().__init__(n_jobs)
+        self._pool = None
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if self._pool is None:
+            self._pool = self._pool_cls(max_workers=self.n_jobs)
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        super().shutdown()
+
+
+class ThreadExecutor(_PoolExecutor):
+    """
+    Executor which runs the tasks in threads of this process.
+
+    Params
+    ------
+    n_jobs
+        Number of threads.
+    """
+
+    is_process_based = False
+    _pool_cls = ThreadPoolExecutor
+
+
+class ProcessExecutor(_PoolExecutor):
+    """
+    Executor which runs the tasks in a :class:`concurrent.futures.ProcessPoolExecutor`.
+
+    Params
+    ------
+    n_jobs
+        Number of processes.
+    """
+
+    _pool_cls = ProcessPoolExecutor
+
+
+class LokyExecutor(Executor):
+    """
+    Executor which runs the tasks in :mod:`joblib`'s reusable pool of processes.
+
+    The workers are kept alive after :meth:`shutdown`, so that they can be reused.
+
+    Params
+    ------
+    n_jobs
+        Number of processes.
+    """
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        # shares the workers with joblib's `'loky'` backend
+        from joblib.executor import get_memmapping_executor
+
+        return get_memmapping_executor(self.n_jobs).submit(fn, *args, **kwargs)
+
+
+class DaskExecutor(Executor):
+    """
+    Executor which runs the tasks using :mod:`dask.distributed`.
+
+    By default, a local cluster is started. To spread the tasks over multiple nodes, start a scheduler and workers,
+    e.g. using `dask-scheduler` and `dask-worker`, and pass its :paramref:`address` or an existing :paramref:`client`.
+
+    Params
+    ------
+    n_jobs
+        Number of workers of the local cluster. Only used when :paramref:`address` and :paramref:`client` are `None`.
+    address
+        Address of a running scheduler.
+    client
+        Existing :class:`distributed.Client`.
+    kwargs
+        Keyword arguments for :class:`distributed.LocalCluster`.
+    """
+
+    is_local = False
+
+    def __init__(
+        self,
+        n_jobs: Optional[int] = 1,
+        address: Optional[str] = None,
+        client: Optional[Any] = None,
+        **kwargs,
+    ):
+        try:
+            import distributed
+        except ImportError:
+            raise ImportError(
+                "Unable to import `distributed`, install it first as `pip install distributed`."
+            )
+
+        super().__init__(n_jobs)
+        self._owns_client = client is None
+        self._cluster = None
+
+        if client is None:
+            if address is None:
+                kwargs.setdefault("threads_per_worker", 1)
+                self._cluster = distributed.LocalCluster(n_workers=n_jobs, **kwargs)
+                address = self._cluster
+            client = distributed.Client(address)
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        """The :class:`distributed.Client`."""
+        return self._client
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return self._client.submit(fn, *args, pure=False, **kwargs)
+
+    def wait(self, futures: Iterable[Any]) -> Tuple[Set[Any], Set[Any]]:
+        from distributed import wait as dwait
+
+        done, pending = dwait(list(futures), return_when="FIRST_COMPLETED")
+        return set(done), set(pending)
+
+    def shutdown(self) -> None:
+        if self._owns_client and self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._cluster is not None:
+            self._cluster.close()
+            self._cluster = None
+        super().shutdown()
+
+
+_EXECUTORS = {
+    "threading": ThreadExecutor,
+    "multiprocessing": ProcessExecutor,
+    "loky": LokyExecutor,
+    "dask": DaskExecutor,
+}
+
+
+def get_executor(backend: Union[str, Executor], n_jobs: int = 1) -> Executor:
+    """
+    Return an :class:`cellrank.ul.Executor` for :paramref:`backend`.
+
+    Params
+    ------
+    backend
+        Either an executor, which is returned as is, or one of `'threading'`, `'multiprocessing'`,
+        `'loky'` or `'dask'`.
+    n_jobs
+        Number of parallel jobs.
+
+    Returns
+    -------
+    :class:`cellrank.ul.Executor`
+        The executor.
+    """
+
+    if isinstance(backend, Executor):
+        return backend
+    if backend == "sequential":
+        backend = "threading"
+    if backend not in _EXECUTORS:
+        raise ValueError(
+            f"Invalid backend `{backend!r}`. Valid options are: `{sorted(_EXECUTORS.keys()) + ['sequential']}`."
+        )
+
+    return _EXECUTORS[backend](n_jobs)
+
+
+def _is_thread_backend(backend: Union[str, Executor]) -> bool:
+    """Return whether :paramref:`backend` runs the tasks in threads of this process."""
+    if isinstance(backend, Executor):
+        return not backend.is_process_based
+    return backend in _THREAD_BACKENDS
+
+
+def _is_local_process_backend(backend: Union[str, Executor]) -> bool:
+    """Return whether :paramref:`backend` runs the tasks in other processes on this machine."""
+    if isinstance(backend, Executor):
+        return backend.is_process_based and backend.is_local
+    return backend not in _THREAD_BACKENDS and backend != "dask"
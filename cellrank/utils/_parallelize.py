@@ -1,14 +1,253 @@
 # -*- coding: utf-8 -*-
-from multiprocessing import Manager
-from threading import Thread
-from typing import Any, Union, Sequence, Callable, Optional
+from contextlib import contextmanager
+from threading import Lock
+from typing import (
+    Any,
+    Union,
+    Sequence,
+    Callable,
+    Optional,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+)
 
+import atexit
 import joblib as jl
 import numpy as np
 
+from scanpy import logging as logg
+
+from cellrank.utils import _progress
+from cellrank.utils._executors import Executor, get_executor, _THREAD_BACKENDS
+from cellrank.utils._progress import (
+    ProgressChannel,
+    Telemetry,
+    progress_counters,
+    _Tracked,
+)
+from cellrank.utils._threads import get_thread_budget, _apply_budget
 from cellrank.utils._utils import _get_n_cores
 
 _msg_shown = False
+_SCHEDULERS = ("static", "dynamic")
+_N_CHUNKS_PER_JOB = 4
+
+
+def _warmup() -> None:
+    """Import the heavy dependencies in a worker, so that the first task doesn't pay for it."""
+    import scanpy  # noqa
+    import scvelo  # noqa
+    import sklearn  # noqa
+    import cellrank  # noqa
+
+
+class _WorkerPool:
+    """
+    Long-lived pool of workers reused across :func:`parallelize` calls.
+
+    The :class:`joblib.Parallel` workers are created lazily on first use. Calls requesting fewer jobs
+    than the size of the pool run on a subset of the workers, see :meth:`run`.
+
+    Params
+    ------
+    n_jobs
+        Number of parallel jobs, the maximum for all calls.
+    backend
+        Which backend to use for multiprocessing.
+        See :class:`joblib.Parallel` for valid options.
+    """
+
+    def __init__(self, n_jobs: int, backend: str):
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.lock = Lock()
+        self.is_warm = False
+        self._parallel = None
+
+    @property
+    def is_process_based(self) -> bool:
+        """Whether the workers are separate processes."""
+        return self.n_jobs != 1 and self.backend not in _THREAD_BACKENDS
+
+    def is_compatible(self, backend: str, strict: bool = False) -> bool:
+        """
+        Return whether tasks requested with :paramref:`backend` can run in this pool.
+
+        Params
+        ------
+        backend
+            Requested backend.
+        strict
+            Whether only exactly :paramref:`backend` is accepted, otherwise any process based pool
+            can run the tasks of a process based backend.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the pool can be used.
+        """
+
+        return self.backend == backend or (
+            not strict and self.is_process_based and backend not in _THREAD_BACKENDS
+        )
+
+    @property
+    def parallel(self) -> jl.Parallel:
+        """The managed :class:`joblib.Parallel` instance."""
+        if self.backend == "loky":
+            # loky's executor is already reusable and shared with other users, such as
+            # `cellrank.ul.LokyExecutor`, managing it here would shut it down under their hands
+            parallel = jl.Parallel(n_jobs=self.n_jobs, backend=self.backend)
+            if not self.is_warm and self.is_process_based:
+                parallel(jl.delayed(_warmup)() for _ in range(self.n_jobs))
+            self.is_warm = True
+            return parallel
+
+        if self._parallel is None:
+            self._parallel = jl.Parallel(n_jobs=self.n_jobs, backend=self.backend)
+            self._parallel.__enter__()
+            if self.is_process_based:
+                self._parallel(jl.delayed(_warmup)() for _ in range(self.n_jobs))
+            self.is_warm = True
+
+        return self._parallel
+
+    def run(self, tasks: Iterable[Any], n_jobs: Optional[int] = None) -> List[Any]:
+        """
+        Run the :paramref:`tasks` using at most :paramref:`n_jobs` workers at once.
+
+        Params
+        ------
+        tasks
+            Tasks created by :func:`joblib.delayed`.
+        n_jobs
+            Maximum number of tasks running at once. If `None`, use all workers.
+
+        Returns
+        -------
+        :class:`list`
+            The results of the tasks.
+        """
+
+        parallel = self.parallel
+        # a new task is only dispatched when one finishes, so at most `pre_dispatch` run at once
+        parallel.pre_dispatch = (
+            self.n_jobs if n_jobs is None else max(1, min(n_jobs, self.n_jobs))
+        )
+
+        return parallel(tasks)
+
+    def shutdown(self) -> None:
+        """Terminate the workers."""
+        if self._parallel is not None:
+            self._parallel.__exit__(None, None, None)
+            self._parallel = None
+        self.is_warm = False
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}[n_jobs={self.n_jobs}, backend={self.backend!r}]"
+        )
+
+
+_scoped_pools = []
+_default_pool: Optional[_WorkerPool] = None
+
+
+def _get_pool(n_jobs: int, backend: str, strict: bool = False) -> _WorkerPool:
+    """
+    Return the innermost pool created by :func:`pool`, if compatible, or the lazily created default pool.
+
+    The default pool is only recreated when the :paramref:`backend` changes or more jobs are requested,
+    calls with fewer jobs use a subset of its workers.
+    """
+
+    global _default_pool
+
+    if _scoped_pools and _scoped_pools[-1].is_compatible(backend, strict=strict):
+        return _scoped_pools[-1]
+
+    if _default_pool is not None and (
+        _default_pool.n_jobs < n_jobs or _default_pool.backend != backend
+    ):
+        if _default_pool.backend == backend:
+            n_jobs = max(n_jobs, _default_pool.n_jobs)
+        _default_pool.shutdown()
+        _default_pool = None
+    if _default_pool is None:
+        _default_pool = _WorkerPool(n_jobs, backend)
+
+    return _default_pool
+
+
+@atexit.register
+def _shutdown_default_pool() -> None:
+    global _default_pool
+
+    if _default_pool is not None:
+        _default_pool.shutdown()
+        _default_pool = None
+
+
+@contextmanager
+def pool(n_jobs: Optional[int] = None, backend: str = "loky") -> Iterator[_WorkerPool]:
+    """
+    Create a pool of workers which is reused by all parallel computations within the context.
+
+    Without it, `cellrank` keeps a single pool alive between calls and shuts it down at exit.
+
+    Params
+    ------
+    n_jobs
+        Number of parallel jobs. If `-1`, use all available cores. If `None`, use `1` core.
+    backend
+        Which backend to use for multiprocessing.
+        See :class:`joblib.Parallel` for valid options.
+
+    Yields
+    ------
+    :class:`cellrank.utils._parallelize._WorkerPool`
+        The pool, which is shut down when leaving the context.
+    """
+
+    p = _WorkerPool(_get_n_cores(n_jobs, 2), backend)
+    _scoped_pools.append(p)
+    try:
+        yield p
+    finally:
+        _scoped_pools.remove(p)
+        p.shutdown()
+
+
+def _get_tqdm(show_progress_bar: bool = True) -> Optional[Callable[..., Any]]:
+    """
+    Return the progress bar class or `None` if it's not requested or available.
+    """
+
+    if not show_progress_bar:
+        return None
+
+    try:
+        try:
+            from tqdm.notebook import tqdm
+        except ImportError:
+            from tqdm import tqdm_notebook as tqdm
+        import ipywidgets
+    except ImportError:
+        global _msg_shown
+        tqdm = None
+
+        if not _msg_shown:
+            print(
+                "Unable to create progress bar. Consider installing `tqdm` as `pip install tqdm` "
+                "and `ipywidgets` as `pip install ipywidgets`.\n"
+                "Optionally, you can disable the progress bar using `show_progress_bar=False`."
+            )
+            _msg_shown = True
+
+    return tqdm
 
 
 def parallelize(
@@ -19,9 +258,12 @@ def parallelize(
     unit: str = "",
     as_array: bool = True,
     use_ixs: bool = False,
-    backend: str = "multiprocessing",
+    backend: Union[str, Executor] = "multiprocessing",
     extractor: Optional[Callable[[Any], Any]] = None,
     show_progress_bar: bool = True,
+    scheduler: str = "static",
+    costs: Optional[Sequence[float]] = None,
+    strict_backend: bool = False,
 ) -> Union[np.ndarray, Any]:
     """
     Params
@@ -34,7 +276,8 @@ def parallelize(
         Number of parallel jobs.
     n_split
         Split :paramref:`collection` into :paramref:`n_split` chunks.
-        If `None`, split into :paramref:`n_jobs` chunks.
+        If `None`, split into :paramref:`n_jobs` chunks for :paramref:`scheduler` `='static'`,
+        otherwise into `4` * :paramref:`n_jobs` chunks.
     unit
         Unit of the progress bar.
     as_array
@@ -43,71 +286,184 @@ def parallelize(
         Whether to pass indices to the callback.
     backend
         Which backend to use for multiprocessing.
-        See :class:`joblib.Parallel` for valid options.
+        See :class:`joblib.Parallel` for valid options. Can also be `'dask'` or an instance of
+        :class:`cellrank.ul.Executor`, in which case the tasks are run by the executor.
     extractor
         Function to apply to the result after all jobs have finished.
     show_progress_bar
         Whether to show a progress bar.
+    scheduler
+        How to schedule the chunks:
+
+        - If `'static'`, split :paramref:`collection` into equally sized chunks.
+        - If `'dynamic'`, split :paramref:`collection` into smaller chunks of roughly equal :paramref:`costs`
+          and dispatch the most expensive ones first. Idle workers pick up the remaining chunks as they finish.
+    costs
+        Estimated cost of each item in :paramref:`collection`, such as the number of non-zero values per gene.
+        Only used when :paramref:`scheduler` `='dynamic'`. If `None`, all items have the same cost.
+    strict_backend
+        Whether to run the tasks using exactly :paramref:`backend`, such as when it's required by the model,
+        instead of any compatible pool created by :func:`cellrank.ul.pool`.
 
     Returns
     -------
         Result depending on :paramref:`extractor` and :paramref:`as_array`.
+        The results of the chunks are always in the order of :paramref:`collection`.
+
+    The cores are split between the workers and their BLAS/OpenMP thread pools,
+    see :func:`cellrank.ul.thread_budget`.
     """
 
-    if show_progress_bar:
+    if scheduler not in _SCHEDULERS:
+        raise ValueError(
+            f"Invalid scheduler `{scheduler!r}`. Valid options are: `{list(_SCHEDULERS)}`."
+        )
+
+    tqdm = _get_tqdm(show_progress_bar)
+
+    def tasks(counters, *args, **kwargs):
+        for i in order:
+            yield (
+                (i, collections[i], *args) if use_ixs else (collections[i], *args),
+                {**kwargs, "queue": ProgressChannel(i, counters)},
+            )
+
+    def run_executor(pbar, callback, *args, **kwargs):
+        executor = get_executor(backend, n_jobs)
         try:
-            try:
-                from tqdm.notebook import tqdm
-            except ImportError:
-                from tqdm import tqdm_notebook as tqdm
-            import ipywidgets
-        except ImportError:
-            global _msg_shown
-            tqdm = None
-
-            if not _msg_shown:
-                print(
-                    "Unable to create progress bar. Consider installing `tqdm` as `pip install tqdm` "
-                    "and `ipywidgets` as `pip install ipywidgets`.\n"
-                    "Optionally, you can disable the progress bar using `show_progress_bar=False`."
-                )
-                _msg_shown = True
-    else:
-        tqdm = None
+            with progress_counters(
+                len(collections),
+                pbar,
+                is_process_based=executor.is_process_based,
+                is_local=executor.is_local,
+            ) as counters:
+                futures = [
+                    executor.submit(callback, *args_, **kwargs_)
+                    for args_, kwargs_ in tasks(counters, *args, **kwargs)
+                ]
+                res = []
+                for future in futures:
+                    res.append(executor.result(future))
+                    # the workers don't share the counters, update once the chunk finishes
+                    if counters is None and pbar is not None:
+                        pbar.update(len(res[-1][1]["times"]))
+        finally:
+            # only shut down the executors we've created
+            if executor is not backend:
+                executor.shutdown()
 
-    def update(pbar, queue, n_total):
-        n_finished = 0
-        while n_finished < n_total:
-            if queue.get() is None:
-                n_finished += 1
-            elif pbar is not None:
-                pbar.update()
+        return res
+
+    def run_joblib(pbar, callback, *args, **kwargs):
+        workers = _get_pool(n_jobs, backend, strict=strict_backend)
+        with progress_counters(
+            len(collections), pbar, is_process_based=workers.is_process_based
+        ) as counters:
+            delayed = (
+                jl.delayed(callback)(*args_, **kwargs_)
+                for args_, kwargs_ in tasks(counters, *args, **kwargs)
+            )
+            # the pool's workers can't be shared by concurrent calls, e.g. from different threads
+            if workers.lock.acquire(blocking=False):
+                try:
+                    res = workers.run(delayed, n_jobs)
+                finally:
+                    workers.lock.release()
+            else:
+                res = jl.Parallel(n_jobs=n_jobs, backend=backend)(delayed)
 
-        if pbar is not None:
-            pbar.close()
+        return res
 
     def wrapper(*args, **kwargs):
+        budget = get_thread_budget(n_jobs)
+        logg.debug(f"DEBUG: Using `{budget}`")
+        fn, limit = _apply_budget(_Tracked(callback), budget, backend)
+
         pbar = None if tqdm is None else tqdm(total=len(collection), unit=unit)
+        try:
+            with limit:
+                if isinstance(backend, Executor) or backend == "dask":
+                    res = run_executor(pbar, fn, *args, **kwargs)
+                else:
+                    res = run_joblib(pbar, fn, *args, **kwargs)
+        finally:
+            if pbar is not None:
+                pbar.close()
 
-        queue = Manager().Queue()
-        thread = Thread(target=update, args=(pbar, queue, len(collections)))
-        thread.start()
+        # restore the original order of the chunks
+        ordered, stats = [None] * len(res), [None] * len(res)
+        for i, (r, st) in zip(order, res):
+            ordered[i], stats[i] = r, st
+        res = ordered
 
-        res = jl.Parallel(n_jobs=n_jobs, backend=backend)(
-            jl.delayed(callback)(
-                *((i, cs) if use_ixs else (cs,)), *args, **kwargs, queue=queue
-            )
-            for i, cs in enumerate(collections)
-        )
+        _progress._last_telemetry = Telemetry._from_stats(collections, stats)
+        logg.debug(f"DEBUG: Finished `{_progress._last_telemetry}`")
 
         res = np.array(res) if as_array else res
-        thread.join()
 
         return res if extractor is None else extractor(res)
 
     n_jobs = _get_n_cores(n_jobs, len(collection))
-    if n_split is None:
-        n_split = n_jobs
-    collections = list(filter(len, np.array_split(collection, n_split)))
+    if scheduler == "static":
+        if n_split is None:
+            n_split = n_jobs
+        collections = list(filter(len, np.array_split(collection, n_split)))
+        order = list(range(len(collections)))
+    else:
+        if n_split is None:
+            n_split = _N_CHUNKS_PER_JOB * n_jobs
+        collections, chunk_costs = _split_by_costs(collection, costs, n_split)
+        order = list(np.argsort(-chunk_costs, kind="stable"))
 
     return wrapper
+
+
+def _split_by_costs(
+    collection: Sequence[Any], costs: Optional[Sequence[float]], n_split: int
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Split :paramref:`collection` into roughly :paramref:`n_split` contiguous chunks of similar total cost.
+
+    Params
+    ------
+    collection
+        Sequence of items which to chunkify.
+    costs
+        Estimated cost of each item. If `None`, all items have the same cost.
+    n_split
+        Maximum number of chunks.
+
+    Returns
+    -------
+    :class:`list`, :class:`numpy.ndarray`
+        The chunks and their total costs.
+    """
+
+    n = len(collection)
+    if costs is None:
+        costs = np.ones(n, dtype=np.float64)
+    else:
+        costs = np.asarray(costs, dtype=np.float64).reshape(-1)
+        if costs.shape != (n,):
+            raise ValueError(
+                f"Expected `costs` to be of shape `{(n,)}`, found `{costs.shape}`."
+            )
+        if np.any(costs < 0) or not np.all(np.isfinite(costs)):
+            raise ValueError("Costs must be finite and non-negative.")
+        if not np.any(costs):
+            costs = np.ones(n, dtype=np.float64)
+
+    # greedily start a new chunk once the current one would exceed the target cost
+    target = np.sum(costs) / max(1, min(n_split, n))
+    cuts, acc = [], 0
+    for i, cost in enumerate(costs):
+        if acc > 0 and acc + cost > target:
+            cuts.append(i)
+            acc = 0
+        acc += cost
+    cuts = np.array(cuts, dtype=np.int64)
+
+    collections = np.split(np.asarray(collection), cuts)
+    chunk_costs = np.add.reduceat(costs, np.r_[0, cuts]) if n else np.array([])
+
+    return collections, chunk_costs
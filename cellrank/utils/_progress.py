@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+_FLUSH_INTERVAL = 0.1  # in seconds
+_FLUSH_EVERY = 64  # number of items
+
+_last_telemetry: Optional["Telemetry"] = None
+
+
+class _Counters:
+    """
+    Number of finished items per chunk, shared between the workers and the parent process.
+
+    Each chunk only writes to its own slot, so no locking is necessary.
+
+    Params
+    ------
+    n_chunks
+        Number of chunks.
+    filename
+        If not `None`, store the counters in a memory-mapped `.npy` file, so that they can be shared with
+        the worker processes. Only the filename is pickled.
+    """
+
+    def __init__(self, n_chunks: int, filename: Optional[str] = None):
+        self._filename = filename
+        if filename is None:
+            self._array = np.zeros(n_chunks, dtype=np.int64)
+        else:
+            self._array = np.lib.format.open_memmap(
+                filename, mode="w+", dtype=np.int64, shape=(n_chunks,)
+            )
+
+    def __setitem__(self, ix: int, value: int) -> None:
+        self._array[ix] = value
+
+    def total(self) -> int:
+        """Total number of finished items."""
+        return int(np.sum(self._array))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        if self._filename is None:
+            raise RuntimeError("Counters not backed by a file cannot be shared.")
+        return {"_filename": self._filename}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self._filename = state["_filename"]
+        self._array = np.load(self._filename, mmap_mode="r+")
+
+
+class ProgressChannel:
+    """
+    Worker-side handle used by the parallelized callbacks to report finished items.
+
+    It has the same interface as the :class:`queue.Queue` it replaces: `put(1)` marks a finished item
+    and `put(None)` the end of the chunk. Updates are batched by time and count, the time spent
+    on each item is recorded. Items finished together, such as `put(n)` for a block of `n` items,
+    are assigned an equal share of the elapsed time.
+
+    Params
+    ------
+    ix
+        Index of the chunk.
+    counters
+        Shared counters. If `None`, the progress is only reported once the chunk finishes.
+    """
+
+    def __init__(self, ix: int, counters: Optional[_Counters] = None):
+        self._ix = ix
+        self._counters = counters
+        self._n = 0
+        self._n_flushed = 0
+        self._last_flush = self._last_mark = perf_counter()
+        self.times: List[float] = []
+
+    def start(self) -> None:
+        """Start measuring the time of the first item."""
+        self._last_flush = self._last_mark = perf_counter()
+        self.times = []
+
+    def put(self, value: Optional[int]) -> None:
+        """
+        Report :paramref:`value` finished items or the end of the chunk, if `None`.
+        """
+
+        now = perf_counter()
+        if value is None:
+            self._flush(now)
+            return
+
+        self._n += value
+        if value > 0:
+            self.times.extend([(now - self._last_mark) / value] * value)
+            self._last_mark = now
+
+        if (
+            self._n - self._n_flushed >= _FLUSH_EVERY
+            or now - self._last_flush >= _FLUSH_INTERVAL
+        ):
+            self._flush(now)
+
+    def _flush(self, now: float) -> None:
+        if self._counters is not None and self._n != self._n_flushed:
+            self._counters[self._ix] = self._n
+        self._n_flushed = self._n
+        self._last_flush = now
+
+
+def _peak_rss() -> Optional[float]:
+    """
+    Peak resident memory of this process since its start in MiB or `None` if it can't be determined.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+class _Tracked:
+    """
+    Picklable wrapper which returns the result of :paramref:`callback` together with its timings.
+
+    Params
+    ------
+    callback
+        Function to run. It receives a :class:`cellrank.utils._progress.ProgressChannel` as `queue`.
+    """
+
+    def __init__(self, callback: Callable[..., Any]):
+        self.callback = callback
+
+    def __call__(self, *args, queue: ProgressChannel, **kwargs) -> Any:
+        start, start_rss = perf_counter(), _peak_rss()
+        queue.start()
+        res = self.callback(*args, queue=queue, **kwargs)
+        peak_rss = _peak_rss()
+        increase = None if peak_rss is None else peak_rss - start_rss
+
+        return (
+            res,
+            {
+                "times": np.array(queue.times),
+                "time": perf_counter() - start,
+                "peak_rss": peak_rss,
+                "peak_rss_increase": increase,
+                "pid": os.getpid(),
+            },
+        )
+
+
+class _ProgressMonitor:
+    """
+    Thread in the parent process which periodically updates the progress bar from the shared counters.
+
+    Params
+    ------
+    pbar
+        Progress bar. If `None`, nothing is done.
+    counters
+        Shared counters.
+    """
+
+    def __init__(self, pbar: Optional[Any], counters: _Counters):
+        self._pbar = pbar
+        self._counters = counters
+        self._n = 0
+        self._stop = Event()
+        self._thread = None
+
+    def _update(self) -> None:
+        n = self._counters.total()
+        if n > self._n:
+            self._pbar.update(n - self._n)
+            self._n = n
+
+    def _run(self) -> None:
+        while not self._stop.wait(_FLUSH_INTERVAL):
+            self._update()
+
+    def __enter__(self) -> "_ProgressMonitor":
+        if self._pbar is not None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._update()
+
+
+@contextmanager
+def progress_counters(
+    n_chunks: int,
+    pbar: Optional[Any],
+    is_process_based: bool = True,
+    is_local: bool = True,
+) -> Iterator[Optional[_Counters]]:
+    """
+    Create the counters shared with the workers and update :paramref:`pbar` from them while in the context.
+
+    Params
+    ------
+    n_chunks
+        Number of chunks.
+    pbar
+        Progress bar. If `None`, no counters are created.
+    is_process_based
+        Whether the workers are separate processes, in which case the counters are memory-mapped.
+    is_local
+        Whether the workers run on this machine. If not, no counters are created.
+
+    Yields
+    ------
+    :class:`cellrank.utils._progress._Counters`
+        The counters or `None`.
+    """
+
+    if pbar is None or not is_local:
+        yield None
+        return
+
+    tmpdir = mkdtemp(prefix="cellrank_") if is_process_based else None
+    try:
+        counters = _Counters(
+            n_chunks, None if tmpdir is None else os.path.join(tmpdir, "progress.npy")
+        )
+        with _ProgressMonitor(pbar, counters):
+            yield counters
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class Telemetry:
+    """
+    Timings of the items and chunks of a parallel run, see :func:`cellrank.ul.get_telemetry`.
+
+    Params
+    ------
+    items
+        Dataframe indexed by the items, with the `'chunk'` they belong to and the `'time'` in seconds
+        spent on them.
+    chunks
+        Dataframe indexed by the chunks, with the number of items `'n_items'`, the `'time'` in seconds,
+        the peak resident memory `'peak_rss'` in MiB of the worker since it started, by how much
+        the chunk increased it `'peak_rss_increase'` and the `'pid'` of the worker. Workers can be reused
+        for several chunks, so only the increase can be attributed to the chunk. With the `'threading'` backend,
+        the chunks share the memory of this process.
+    """
+
+    def __init__(self, items: pd.DataFrame, chunks: pd.DataFrame):
+        self.items = items
+        self.chunks = chunks
+
+    @classmethod
+    def _from_stats(
+        cls, collections: Sequence[Sequence[Any]], stats: Sequence[Dict[str, Any]]
+    ) -> "Telemetry":
+        index, chunk, times = [], [], []
+        for i, (collection, st) in enumerate(zip(collections, stats)):
+            ts = st["times"]
+            # fall back to positions if the callback doesn't report exactly one update per item
+            items = (
+                list(collection)
+                if len(ts) == len(collection)
+                else [f"{i}:{j}" for j in range(len(ts))]
+            )
+            index.extend(items)
+            chunk.extend([i] * len(ts))
+            times.extend(ts)
+
+        items = pd.DataFrame(
+            {"chunk": np.array(chunk, dtype=np.int64), "time": np.array(times)},
+            index=pd.Index(index, name="item"),
+        )
+        chunks = pd.DataFrame(
+            {
+                "n_items": [len(st["times"]) for st in stats],
+                "time": [st["time"] for st in stats],
+                "peak_rss": [st["peak_rss"] for st in stats],
+                "peak_rss_increase": [st["peak_rss_increase"] for st in stats],
+                "pid": [st["pid"] for st in stats],
+            },
+            index=pd.RangeIndex(len(stats), name="chunk"),
+        )
+
+        return cls(items, chunks)
+
+    def slowest(self, n: int = 10) -> pd.DataFrame:
+        """
+        Return the :paramref:`n` slowest items.
+
+        Params
+        ------
+        n
+            Number of items.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            The slowest items, sorted by the `'time'`.
+        """
+
+        return self.items.sort_values("time", ascending=False).iloc[:n]
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}[n_items={len(self.items)}, n_chunks={len(self.chunks)}, "
+            f"time={self.chunks['time'].sum():.2f}s]"
+        )
+
+
+def get_telemetry() -> Optional[Telemetry]:
+    """
+    Return the timings of the last parallel computation, such as :func:`cellrank.pl.gene_trends`.
+
+    Returns
+    -------
+    :class:`cellrank.ul.Telemetry`
+        The timings or `None`, if nothing has been run in parallel yet.
+    """
+
+    return _last_telemetry
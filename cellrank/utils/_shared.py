@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from typing import Dict, Iterator, Optional, Sequence, Any, Union, Tuple
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from anndata import AnnData
+from pandas.api.types import is_categorical_dtype
+from scipy.sparse import issparse, spmatrix
+
+from cellrank.tools._constants import LinKey, RcKey
+from cellrank.tools._lineage import Lineage
+from cellrank.utils._executors import Executor, _is_local_process_backend
+
+# number of columns densified at once when sharing a sparse matrix
+_COLUMN_BLOCK_SIZE = 256
+
+
+class SharedArray:
+    """
+    Picklable handle to an array stored in a memory-mapped `.npy` file.
+
+    Only the filename is pickled, the data is mapped lazily in each process.
+
+    Params
+    ------
+    filename
+        Path to the `.npy` file.
+    """
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._data = None
+
+    @classmethod
+    def create(cls, array: np.ndarray, filename: str) -> "SharedArray":
+        """
+        Save an array to :paramref:`filename` and return its handle.
+
+        Params
+        ------
+        array
+            Array to save.
+        filename
+            Path where to save the array.
+
+        Returns
+        -------
+        :class:`cellrank.ul._shared.SharedArray`
+            The handle.
+        """
+
+        np.save(filename, np.ascontiguousarray(array), allow_pickle=False)
+        return cls(filename)
+
+    @classmethod
+    def create_columns(
+        cls,
+        array: Union[np.ndarray, spmatrix],
+        filename: str,
+        columns: Optional[np.ndarray] = None,
+        block_size: int = _COLUMN_BLOCK_SIZE,
+    ) -> "SharedArray":
+        """
+        Save the :paramref:`columns` of an array to :paramref:`filename` and return its handle.
+
+        The columns are written in dense blocks into a preallocated memory-mapped file,
+        so the whole (possibly sparse) selection is never densified in memory.
+
+        Params
+        ------
+        array
+            Dense or sparse 2-dimensional array.
+        filename
+            Path where to save the array.
+        columns
+            Indices of the columns to save. If `None`, save all columns.
+        block_size
+            Number of columns to write at once.
+
+        Returns
+        -------
+        :class:`cellrank.ul._shared.SharedArray`
+            The handle.
+        """
+
+        if columns is None:
+            columns = np.arange(array.shape[1])
+        if issparse(array):
+            # column slicing of CSC is proportional to the number of selected entries
+            array = array[:, columns].tocsc()
+            columns = np.arange(array.shape[1])
+
+        out = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=array.dtype, shape=(array.shape[0], len(columns))
+        )
+        for start in range(0, len(columns), block_size):
+            block = array[:, columns[start : start + block_size]]
+            out[:, start : start + block_size] = (
+                block.toarray() if issparse(block) else block
+            )
+        out.flush()
+        del out
+
+        return cls(filename)
+
+    def get(self) -> np.ndarray:
+        """Read-only memory-mapped view of the array."""
+        if self._data is None:
+            self._data = np.load(self._filename, mmap_mode="r")
+        return self._data
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"_filename": self._filename, "_data": None}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}[{self._filename!r}]"
+
+
+class SharedAnnData:
+    """
+    Lightweight stand-in for :class:`anndata.AnnData` used by :meth:`cellrank.ul.models.Model.prepare`.
+
+    It only contains the expression of selected genes, selected observation columns and lineages,
+    all of which are memory-mapped. Pickling it only sends the file references.
+
+    Params
+    ------
+    var_names
+        Names of the genes in :paramref:`data`.
+    data
+        Expression handles, mapping data keys (`'X'` or a key in `.layers`) to arrays of shape
+        `(n_obs, len(var_names))`.
+    obs
+        Observation handles. Categorical columns are stored as a tuple of codes and categories.
+    obsm
+        Lineages stored in :paramref:`obsm`, they must be memory-mapped.
+    obs_names
+        Names of the observations.
+    """
+
+    def __init__(
+        self,
+        var_names: pd.Index,
+        data: Dict[str, SharedArray],
+        obs: Dict[str, Union[SharedArray, Tuple[SharedArray, pd.Index]]],
+        obsm: Dict[str, Lineage],
+        obs_names: pd.Index,
+    ):
+        self._var_names = var_names
+        self._data = data
+        self._obs_handles = obs
+        self._obsm = obsm
+        self._obs_names = obs_names
+        self._obs = None
+
+    @property
+    def n_obs(self) -> int:
+        """Number of observations."""
+        return len(self._obs_names)
+
+    @property
+    def var_names(self) -> pd.Index:
+        """Names of the shared genes."""
+        return self._var_names
+
+    @property
+    def X(self) -> np.ndarray:
+        """Expression of the shared genes."""
+        return self._data["X"].get()
+
+    @property
+    def layers(self) -> Dict[str, np.ndarray]:
+        """Shared layers."""
+        return {k: v.get() for k, v in self._data.items() if k != "X"}
+
+    @property
+    def obsm(self) -> Dict[str, Lineage]:
+        """Shared lineages."""
+        return self._obsm
+
+    @property
+    def obs(self) -> pd.DataFrame:
+        """Shared observation columns."""
+        if self._obs is None:
+            columns = {}
+            for key, handle in self._obs_handles.items():
+                if isinstance(handle, tuple):
+                    codes, categories = handle
+                    columns[key] = pd.Categorical.from_codes(
+                        np.asarray(codes.get()), categories=categories
+                    )
+                else:
+                    columns[key] = handle.get()
+            self._obs = pd.DataFrame(columns, index=self._obs_names)
+
+        return self._obs
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_obs"] = None
+        return state
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}[n_obs={self.n_obs}, n_vars={len(self.var_names)}]"
+
+
+def _share(
+    adata: AnnData,
+    genes: Sequence[str],
+    dirname: str,
+    data_key: str = "X",
+    time_key: str = "latent_time",
+) -> SharedAnnData:
+    """
+    Save the arrays needed to fit the models for :paramref:`genes` into :paramref:`dirname`.
+
+    Params
+    ------
+    adata
+        Annotated data object.
+    genes
+        Genes or observations for which the models will be fitted.
+    dirname
+        Directory where to save the arrays.
+    data_key
+        Key in :paramref:`adata` `.layers`, `'X'` for :paramref:`adata` `.X` or `'obs'` for :paramref:`adata` `.obs`.
+    time_key
+        Key in :paramref:`adata` `.obs` where the pseudotime is stored.
+
+    Returns
+    -------
+    :class:`cellrank.ul._shared.SharedAnnData`
+        The shared object.
+    """
+
+    def path(name: str) -> str:
+        return os.path.join(dirname, f"{name}.npy")
+
+    obs_keys = [time_key, str(RcKey.FORWARD), str(RcKey.BACKWARD)]
+    if data_key == "obs":
+        obs_keys += list(genes)
+        var_names = adata.var_names[:0]
+    else:
+        var_names = pd.Index(pd.unique(np.asarray(genes)))
+
+    data = {}
+    if data_key != "obs":
+        ixs = adata.var_names.get_indexer(var_names)
+        x = adata.X if data_key == "X" else adata.layers[data_key]
+        data[data_key] = SharedArray.create_columns(
+            x, path(f"data_{data_key}"), columns=ixs
+        )
+
+    obs = {}
+    for i, key in enumerate(pd.unique(np.asarray(obs_keys))):
+        if key not in adata.obs:
+            continue
+        col = adata.obs[key]
+        if is_categorical_dtype(col):
+            obs[key] = (
+                SharedArray.create(col.cat.codes.values, path(f"obs_{i}")),
+                col.cat.categories,
+            )
+        else:
+            obs[key] = SharedArray.create(col.values, path(f"obs_{i}"))
+
+    obsm = {}
+    for key in map(str, LinKey):
+        lin = adata.obsm.get(key, None)
+        if isinstance(lin, Lineage):
+            obsm[key] = lin.to_memmap(path(key))
+
+    return SharedAnnData(var_names, data, obs, obsm, adata.obs_names.copy())
+
+
+def _bind_adata(models: Dict[str, Dict[str, Any]], adata: Any) -> None:
+    """Set the annotated data object of the models, skipping the values which are not models."""
+    from cellrank.utils.models import Model
+
+    for ms in models.values():
+        for m in ms.values():
+            if isinstance(m, Model):
+                m._adata = adata
+
+
+@contextmanager
+def shared_models(
+    adata: AnnData,
+    models: Dict[str, Dict[str, Any]],
+    genes: Sequence[str],
+    backend: Union[str, Executor],
+    data_key: str = "X",
+    time_key: str = "latent_time",
+    dirname: Optional[str] = None,
+) -> Iterator[None]:
+    """
+    Temporarily point the :paramref:`models` to a memory-mapped :class:`cellrank.ul._shared.SharedAnnData`.
+
+    This prevents pickling the whole :paramref:`adata` to every worker and back.
+    For thread-based backends and for backends whose workers may not run on this machine, this is a no-op.
+
+    Params
+    ------
+    adata
+        Annotated data object.
+    models
+        Gene and lineage specific models.
+    genes
+        Genes or observations for which the models will be fitted.
+    backend
+        Parallel backend, see :func:`cellrank.utils._parallelize.parallelize`.
+    data_key
+        Key in :paramref:`adata` `.layers`, `'X'` for :paramref:`adata` `.X` or `'obs'` for :paramref:`adata` `.obs`.
+    time_key
+        Key in :paramref:`adata` `.obs` where the pseudotime is stored.
+    dirname
+        Directory where to store the arrays. If `None`, use a temporary one.
+
+    Yields
+    ------
+    None
+        Nothing, the :paramref:`models` are rebound to :paramref:`adata` on exit.
+    """
+
+    if not _is_local_process_backend(backend):
+        yield
+        return
+
+    tmpdir = mkdtemp(prefix="cellrank_", dir=dirname)
+    try:
+        _bind_adata(
+            models, _share(adata, genes, tmpdir, data_key=data_key, time_key=time_key)
+        )
+        yield
+    finally:
+        _bind_adata(models, adata)
+        shutil.rmtree(tmpdir, ignore_errors=True)
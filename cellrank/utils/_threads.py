@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Iterator, List, Optional, Tuple, Union
+
+import joblib as jl
+
+from scanpy import logging as logg
+
+from cellrank.utils._executors import Executor, _is_thread_backend
+
+_budgets: List[int] = []
+_active_limits: List[int] = []
+_msg_shown = False
+
+
+class ThreadBudget:
+    """
+    Split of the available cores between parallel workers and the thread pools within them.
+
+    Params
+    ------
+    n_cores
+        Total number of cores which can be used.
+    n_jobs
+        Number of parallel workers, processes or threads.
+
+    Attributes
+    ----------
+    n_threads
+        Number of threads each worker can use for BLAS/OpenMP and for nested estimators,
+        such as :class:`sklearn.ensemble.RandomForestRegressor`.
+    """
+
+    def __init__(self, n_cores: int, n_jobs: int = 1):
+        self.n_cores = max(1, n_cores)
+        self.n_jobs = max(1, n_jobs)
+        self.n_threads = max(1, self.n_cores // self.n_jobs)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}[n_cores={self.n_cores}, n_jobs={self.n_jobs}, "
+            f"n_threads={self.n_threads}]"
+        )
+
+
+@contextmanager
+def thread_budget(n_cores: Optional[int] = None) -> Iterator[ThreadBudget]:
+    """
+    Limit the total number of cores used by all parallel computations within the context.
+
+    The cores are split between the worker processes of :func:`cellrank.utils._parallelize.parallelize`,
+    the BLAS/OpenMP thread pools of :mod:`numpy` and :mod:`scipy` and nested estimators.
+    Without it, all cores of the machine are split.
+
+    Params
+    ------
+    n_cores
+        Number of cores. If `None` or `-1`, use all available cores.
+
+    Yields
+    ------
+    :class:`cellrank.ul.ThreadBudget`
+        The budget for sequential computations.
+    """
+
+    if n_cores is None or n_cores == -1:
+        n_cores = jl.cpu_count()
+    if n_cores <= 0:
+        raise ValueError(f"Number of cores must be `> 0`, found `{n_cores}`.")
+
+    _budgets.append(n_cores)
+    try:
+        with limit_threads(n_cores):
+            yield ThreadBudget(n_cores)
+    finally:
+        _budgets.remove(n_cores)
+
+
+def get_thread_budget(n_jobs: Optional[int] = 1) -> ThreadBudget:
+    """
+    Return the split of the cores for :paramref:`n_jobs` parallel workers.
+
+    Params
+    ------
+    n_jobs
+        Number of parallel workers. If `None`, use `1`. Negative values are interpreted as in :class:`joblib.Parallel`.
+
+    Returns
+    -------
+    :class:`cellrank.ul.ThreadBudget`
+        The split, limited by the innermost :func:`cellrank.ul.thread_budget`.
+    """
+
+    n_cores = _budgets[-1] if _budgets else jl.cpu_count()
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = max(1, jl.cpu_count() + 1 + n_jobs)
+
+    return ThreadBudget(n_cores, n_jobs)
+
+
+@contextmanager
+def limit_threads(n_threads: Optional[int] = None) -> Iterator[None]:
+    """
+    Limit the number of threads used by BLAS/OpenMP libraries within the context.
+
+    Nested limits can only lower the number of threads. This is a no-op if `threadpoolctl` is not installed.
+
+    Params
+    ------
+    n_threads
+        Number of threads. If `None`, use all the cores of the current budget.
+
+    Yields
+    ------
+    None
+        Nothing.
+    """
+
+    if n_threads is None:
+        n_threads = get_thread_budget().n_threads
+    if _active_limits:
+        n_threads = min(n_threads, _active_limits[-1])
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        global _msg_shown
+        if not _msg_shown:
+            logg.debug(
+                "DEBUG: Unable to import `threadpoolctl`, not limiting the number of threads"
+            )
+            _msg_shown = True
+        threadpool_limits = None
+
+    _active_limits.append(n_threads)
+    try:
+        if threadpool_limits is None:
+            yield
+        else:
+            with threadpool_limits(limits=n_threads):
+                yield
+    finally:
+        _active_limits.remove(n_threads)
+
+
+class _ThreadLimited:
+    """
+    Picklable wrapper which runs :paramref:`callback` in a worker with limited number of threads.
+
+    Params
+    ------
+    callback
+        Function to run.
+    n_threads
+        Number of BLAS/OpenMP threads for the worker.
+    """
+
+    def __init__(self, callback: Callable[..., Any], n_threads: int):
+        self.callback = callback
+        self.n_threads = n_threads
+
+    def __call__(self, *args, **kwargs) -> Any:
+        with limit_threads(self.n_threads):
+            return self.callback(*args, **kwargs)
+
+
+def _apply_budget(
+    callback: Callable[..., Any], budget: ThreadBudget, backend: Union[str, Executor]
+) -> Tuple[Callable[..., Any], ContextManager]:
+    """
+    Apply :paramref:`budget` to :paramref:`callback` run using :paramref:`backend`.
+
+    Params
+    ------
+    callback
+        Function to run in parallel.
+    budget
+        The split of the cores.
+    backend
+        Parallel backend, see :func:`cellrank.utils._parallelize.parallelize`.
+
+    Returns
+    -------
+    :class:`callable`, :class:`contextmanager`
+        The callback to run in the workers and the context in which to run them.
+        Thread-based workers share the limit set in this process, process-based workers set their own.
+        The workers of remote executors are not limited.
+    """
+
+    if _is_thread_backend(backend):
+        return callback, limit_threads(budget.n_threads)
+    if (isinstance(backend, Executor) and not backend.is_local) or backend == "dask":
+        return callback, limit_threads(None)
+
+    return _ThreadLimited(callback, budget.n_threads), limit_threads(None)
@@ -2,7 +2,7 @@
 from multiprocessing import cpu_count
 from typing import Iterable, Hashable, Dict, Optional, Tuple, List, Union, Any
 
-from scipy.sparse import spmatrix
+from scipy.sparse import spmatrix, issparse
 import anndata
 import numpy as np
 
@@ -36,6 +36,41 @@ def check_collection(
             raise KeyError(f"{key_name} `{needle}` not found in `adata.{attr_name}`.")
 
 
+def _get_gene_costs(
+    adata: anndata.AnnData, genes: Iterable[str], data_key: str = "X"
+) -> Optional[np.ndarray]:
+    """
+    Estimate the cost of fitting a model for each gene as the number of its non-zero values.
+
+    Params
+    ------
+    adata: :class:`anndata.AnnData`
+        Annotated data object.
+    genes
+        Genes in :paramref:`adata` `.var_names`.
+    data_key
+        Key in :paramref:`adata` `.layers` or `'X'` for :paramref:`adata` `.X`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray` or `None`
+        The costs or `None`, if :paramref:`data_key` does not refer to the expression.
+    """
+
+    if data_key == "X":
+        data = adata.X
+    elif data_key in adata.layers:
+        data = adata.layers[data_key]
+    else:
+        return None
+
+    data = data[:, adata.var_names.get_indexer(genes)]
+    if issparse(data):
+        return np.asarray(data.getnnz(axis=0)).ravel()
+
+    return np.count_nonzero(data, axis=0)
+
+
 def _get_n_cores(n_cores: Optional[int], n_genes: int) -> int:
     """
     Make number of cores a positive integer.
@@ -1,2 +1,9 @@
 # -*- coding: utf-8 -*-
-from cellrank.utils.models._models import Model, SKLearnModel, GamMGCVModel
+from cellrank.utils.models._models import (
+    Model,
+    SKLearnModel,
+    GamMGCVModel,
+    SplineModel,
+    KernelModel,
+    PreparePlan,
+)
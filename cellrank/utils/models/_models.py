@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 from cellrank.tools._constants import LinKey
 from cellrank.utils._utils import _minmax
+from cellrank.utils._cache import TrendCache, _fingerprint
 from cellrank.tools._utils import save_fig
 from cellrank.tools._lineage import Lineage
 
 from abc import ABC, abstractmethod
-from typing import Optional, Iterable, Tuple, Any
+from typing import Optional, Iterable, Iterator, Tuple, Any, Dict, Sequence, List
 from inspect import signature
 from scipy.sparse import issparse
 from copy import copy
@@ -21,145 +22,116 @@ import matplotlib.cm as cm
 import sklearn
 
 _dup_spaces = re.compile(r" +")
+_GENE_BLOCK_SIZE = 256
 
 
-class Model(ABC):
+class _GeneBlockExtractor:
     """
-    Base class for other model classes.
+    Dense columns of a block of genes, extracted from the expression matrix at once.
+
+    Sparse matrices are sliced and converted to CSC only once, so that getting a column only costs its number of
+    non-zero values, instead of scanning the whole matrix for every gene. Backed matrices are read in contiguous
+    blocks of at most :paramref:`block_size` genes. Dense in-memory matrices are not copied.
 
     Params
     ------
     adata : :class:`anndata.AnnData`
         Annotated data object.
-    model
-        Underlying model.
-    weight_name
-        Name of the weight argument for :paramref:`model`.
+    genes
+        Genes in :paramref:`adata` `.var_names` which will be extracted. Other genes are ignored.
+    data_key
+        Key in :paramref:`adata` `.layers` or `'X'` for :paramref:`adata` `.X`.
+    dtype
+        Type of the returned columns.
+    block_size
+        Maximum number of genes read at once from backed matrices.
     """
 
     def __init__(
-        self, adata: anndata.AnnData, model: Any, weight_name: Optional[str] = None
+        self,
+        adata: anndata.AnnData,
+        genes: Sequence[str],
+        data_key: str = "X",
+        dtype: type = np.float32,
+        block_size: int = _GENE_BLOCK_SIZE,
     ):
-        self._adata = adata
-        self._model = model
-        self.weight_name = weight_name
-
-        self._x_all = None
-        self._y_all = None
-        self._w_all = None
-
-        self._x = None
-        self._y = None
-        self._w = None
-
-        self._x_test = None
-        self._y_test = None
-        self._x_hat = None
-        self._y_hat = None
-
-        self._conf_int = None
+        data = adata.X if data_key == "X" else adata.layers[data_key]
+        genes = pd.unique(np.asarray(genes))
+        ixs = adata.var_names.get_indexer(genes)
+        mask = ixs >= 0
+        # gene -> its column in `adata`
+        self._columns = dict(zip(genes[mask], ixs[mask]))
+        self._ixs = np.unique(ixs[mask])
+
+        self._dtype = dtype
+        self._data = data
+        self._block = None
+        self._block_size = block_size
+        self._cached_block = (None, None)
+
+        if issparse(data):
+            self._block = data[:, self._ixs].tocsc()
+            self._data = None
+
+    def __contains__(self, gene: str) -> bool:
+        return gene in self._columns
+
+    def __getitem__(self, gene: str) -> np.ndarray:
+        ix = self._columns[gene]
+
+        if self._block is not None:
+            j = np.searchsorted(self._ixs, ix)
+            col = np.zeros(self._block.shape[0], dtype=self._dtype)
+            start, end = self._block.indptr[j], self._block.indptr[j + 1]
+            col[self._block.indices[start:end]] = self._block.data[start:end]
+            return col
+
+        if isinstance(self._data, np.ndarray):
+            return np.asarray(self._data[:, ix], dtype=self._dtype).reshape(-1)
+
+        # backed storage, such as `h5py.Dataset`, read the contiguous span of the next requested genes
+        start, block = self._cached_block
+        if block is None or not (start <= ix < start + block.shape[1]):
+            pos = np.searchsorted(self._ixs, ix)
+            end = self._ixs[min(pos + self._block_size, len(self._ixs)) - 1] + 1
+            end = min(end, ix + self._block_size)
+            block = self._data[:, ix:end]
+            block = block.tocsc() if issparse(block) else np.asarray(block)
+            self._cached_block = start, block = ix, block
+
+        col = block[:, ix - start]
+        if issparse(col):
+            col = col.toarray()
+
+        return np.asarray(col, dtype=self._dtype).reshape(-1)
+
+
+class PreparePlan:
+    """
+    Gene-independent part of :meth:`cellrank.ul.models.Model.prepare` for one lineage.
 
-        self._dtype = np.float32
+    It holds the sorted unique pseudotime, the lineage weights and the test points, so that preparing a model
+    for a gene only needs to gather its expression. It can be shared by all models created for
+    the same :paramref:`adata`.
 
-    @property
-    def adata(self) -> anndata.AnnData:
-        """
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
         Annotated data object.
-        """
-        return self._adata
-
-    @property
-    def model(self) -> Any:
-        """
-        The underlying model.
-        """
-        return self._model
-
-    @property
-    def x_all(self) -> np.ndarray:
-        """
-        Original independent variables.
-        """
-        return self._x_all
-
-    @property
-    def y_all(self) -> np.ndarray:
-        """
-        Original dependent variables.
-        """
-        return self._y_all
-
-    @property
-    def w_all(self) -> np.ndarray:
-        """
-        Original weights.
-        """
-        return self._w_all
-
-    @property
-    def x(self) -> np.ndarray:
-        """
-        Independent variables used for model fitting.
-        """
-        return self._x
-
-    @property
-    def y(self) -> np.ndarray:
-        """
-        Dependent variables used for model fitting.
-        """
-        return self._y
-
-    @property
-    def w(self) -> np.ndarray:
-        """
-        Weights of independet variables used for model fitting.
-        """
-        return self._w
-
-    @property
-    def x_test(self) -> np.ndarray:
-        """
-        Independent variables used for prediction.
-        """
-        return self._x_test
-
-    @property
-    def y_test(self) -> np.ndarray:
-        """
-        Predicted values.
-        """
-        return self._y_test
-
-    @property
-    def x_hat(self) -> np.ndarray:
-        """
-        Independent variables used when calculating default confidence interval.
-        """
-        return self._x_hat
-
-    @property
-    def y_hat(self) -> np.ndarray:
-        """
-        Dependent variables used when calculating default confidence interval.
-        """
-        return self._y_hat
-
-    @property
-    def conf_int(self) -> np.ndarray:
-        """
-        Confidence interval.
-        """
-        return self._conf_int
-
-    @abstractmethod
-    def __copy__(self) -> "Model":
-        pass
+    lineage_name
+        Name of a lineage in :paramref:`adata` `.obsm`. If `None`, all weights are `1`.
+    dtype
+        Type of the weights.
+    extractor
+        Extractor of the expression of a block of genes. Genes not in the block are read from :paramref:`adata`.
+    kwargs
+        See :meth:`cellrank.ul.models.Model.prepare`.
+    """
 
-    def prepare(
+    def __init__(
         self,
-        gene: str,
-        lineage_name: str,
+        adata: anndata.AnnData,
+        lineage_name: Optional[str],
         data_key: str = "X",
         final: bool = True,
         time_key: str = "latent_time",
@@ -170,131 +142,71 @@ class Model(ABC):
         weight_scale: float = 1,
         filter_data: float = False,
         n_test_points: int = 200,
-    ) -> "Model":
-        """
-        Prepare the model to be ready for fitting.
-
-        Params
-        ------
-        gene
-            Gene in :paramref:`adata` `.var_names`.
-        lineage_name
-            Name of a lineage in :paramref:`adata` `.uns`:paramref:`lineage_key`.
-        data_key
-            Key in :attr:`paramref.adata` `.layers` or `'X'` for :paramref:`adata` `.X`
-        final
-            Whether to consider cells going to final states or vice versa.
-        time_key
-            Key in :paramref:`adata` `.obs` where the pseudotime is stored.
-        start_lineage
-            Lineage from which to select cells with lowest pseudotime as starting points.
-            If specified, the trends start at the earliest pseudotime within that lineage,
-            otherwise they start from time `0`.
-        end_lineage
-            Lineage from which to select cells with highest pseudotime as endpoints.
-            If specified, the trends end at the latest pseudotime within that lineage,
-            otherwise, it is determined automatically.
-        threshold
-            Consider only cells with :paramref:`weights` > :paramref:`threshold` when estimating the testing endpoint.
-            If `None`, use median of :paramref:`w`.
-        weight_threshold
-            Set all weights below this to :paramref:`weight_scale` * :paramref:`weight_threshold`.
-        weight_scale
-            Weight threshold scale, see :paramref:`weight_threshold`.
-        filter_data
-            Use only testing points for fitting.
-        n_test_points
-            Number or test points.
-            if `None`, use the original points based on :paramref:`threshold`.
-
-        Returns
-        -------
-        None
-            Nothing, but updates the following fields:
-
-            - :paramref:`x`
-            - :paramref:`y`
-            - :paramref:`w`
-            - :paramref:`x_test`
-        """
-
-        if data_key not in ["X", "obs"] + list(self.adata.layers.keys()):
+        n_bins: Optional[int] = None,
+        dtype: type = np.float32,
+        extractor: Optional[_GeneBlockExtractor] = None,
+    ):
+        if data_key not in ["X", "obs"] + list(adata.layers.keys()):
             raise KeyError(
-                f"Data key must be a key of `adata.layers`: `{list(self.adata.layers.keys())}`, '`obs`' or `'X'`."
+                f"Data key must be a key of `adata.layers`: `{list(adata.layers.keys())}`, '`obs`' or `'X'`."
             )
-        if time_key not in self.adata.obs:
+        if time_key not in adata.obs:
             raise KeyError(f"Time key `{time_key!r}` not found in `adata.obs`.")
-
-        if data_key != "obs":
-            if gene not in self.adata.var_names:
-                raise KeyError(f"Gene `{gene!r}` not found in `adata.var_names`.")
-        else:
-            if gene not in self.adata.obs:
-                raise KeyError(f"Unable to find key `{gene!r}` in `adata.obs`.")
+        if n_bins is not None and n_bins <= 0:
+            raise ValueError(f"Expected `n_bins` to be `> 0`, found `{n_bins}`.")
 
         lineage_key = str(LinKey.FORWARD if final else LinKey.BACKWARD)
-        if lineage_key not in self.adata.obsm:
+        if lineage_key not in adata.obsm:
             raise KeyError(f"Lineage key `{lineage_key!r}` not found in `adata.obsm`.")
-        if not isinstance(self.adata.obsm[lineage_key], Lineage):
+        if not isinstance(adata.obsm[lineage_key], Lineage):
             raise TypeError(
-                f"Expected `adata.obsm[{lineage_key}]` to be of type `cellrank.tl.Lineage`, found `{type(self.adata.obsm[lineage_key]).__name__}`."
+                f"Expected `adata.obsm[{lineage_key}]` to be of type `cellrank.tl.Lineage`, found `{type(adata.obsm[lineage_key]).__name__}`."
             )
 
         if lineage_name is not None:
-            _ = self.adata.obsm[lineage_key][lineage_name]
+            _ = adata.obsm[lineage_key][lineage_name]
 
         if start_lineage is not None:
-            if start_lineage not in self.adata.obsm[lineage_key].names:
+            if start_lineage not in adata.obsm[lineage_key].names:
                 raise KeyError(
                     f"Start lineage `{start_lineage!r}` not found in `adata.obsm[{lineage_key!r}].names`."
                 )
         if end_lineage is not None:
-            if end_lineage not in self.adata.obsm[lineage_key].names:
+            if end_lineage not in adata.obsm[lineage_key].names:
                 raise KeyError(
                     f"End lineage `{end_lineage!r}` not found in `adata.obsm[{lineage_key!r}].names`."
                 )
 
-        x = np.array(self.adata.obs[time_key]).astype(np.float64)
-        gene_ix = np.where(self.adata.var_names == gene)[0]
-
+        self._adata = adata
+        self._lineage_name = lineage_name
+        self._data_key = data_key
+        self._extractor = extractor if data_key != "obs" else None
         if data_key == "X":
-            y = self.adata.X[:, gene_ix]
-        elif data_key == "obs":
-            y = self.adata.obs[gene].values
-        elif data_key in self.adata.layers:
-            y = self.adata.layers[data_key][:, gene_ix]
+            self._data = adata.X
+        elif data_key != "obs":
+            self._data = adata.layers[data_key]
         else:
-            raise NotImplemented(f"Data key `{data_key!r}` is not yet implemented.")
-
-        if issparse(y):
-            y = np.asarray(y.todense())
-        y = np.squeeze(y).astype(np.float64)
+            self._data = None
 
+        x = np.array(adata.obs[time_key]).astype(np.float64)
         if lineage_name is not None:
-            w = (
-                np.array(self.adata.obsm[lineage_key][lineage_name])
-                .astype(self._dtype)
-                .squeeze()
-            )
+            w = np.array(adata.obsm[lineage_key][lineage_name]).astype(dtype).squeeze()
             w[w < weight_threshold] = np.clip(weight_threshold * weight_scale, 0, 1)
         else:
             w = np.ones_like(x)
 
-        self._x_all, self._y_all, self._w_all = x[:], y[:], w[:]
+        self._x_all, self._w_all = x, w
 
+        # `np.unique` already returns the values sorted
         x, ixs = np.unique(x, return_index=True)
-        y = y[ixs]
         w = w[ixs]
 
-        ixs = np.argsort(x)
-        x, y, w = x[ixs], y[ixs], w[ixs]
-
         if start_lineage is None or (start_lineage == lineage_name):
-            val_start = np.min(self.adata.obs[time_key])
+            val_start = np.min(adata.obs[time_key])
         else:
             from_key = "_".join(lineage_key.split("_")[1:])
             val_start = np.nanmin(
-                self.adata.obs[time_key][self.adata.obs[from_key] == start_lineage]
+                adata.obs[time_key][adata.obs[from_key] == start_lineage]
             )
 
         if end_lineage is None or (end_lineage == lineage_name):
@@ -305,14 +217,12 @@ class Model(ABC):
             val_end = x[w > threshold][np.nanargmax(tmp)]
         else:
             to_key = "_".join(lineage_key.split("_")[1:])
-            val_end = np.nanmax(
-                self.adata.obs[time_key][self.adata.obs[to_key] == end_lineage]
-            )
+            val_end = np.nanmax(adata.obs[time_key][adata.obs[to_key] == end_lineage])
 
         if val_start > val_end:
             val_start, val_end = val_end, val_start
 
-        x_test = (
+        self._x_test = (
             np.linspace(val_start, val_end, n_test_points)
             if n_test_points is not None
             else x[(x >= val_start) & (x <= val_end)]
@@ -320,393 +230,1989 @@ class Model(ABC):
 
         if filter_data:
             fil = (x >= val_start) & (x <= val_end)
-            x, y, w = x[fil], y[fil], w[fil]
-
-        self._x, self._y, self._w = (
-            self._convert(x[:]),
-            self._convert(y[:]),
-            self._convert(w[:]).squeeze(-1),
+            x, w, ixs = x[fil], w[fil], ixs[fil]
+
+        self._bins = self._counts = self._cell_w = None
+        if n_bins is not None:
+            x, w, ixs = self._bin(x, w, ixs, n_bins)
+
+        self._x, self._w, self._ixs = x, w, ixs
+        # the arrays are shared by all models using this plan
+        for arr in (
+            self._x_all,
+            self._w_all,
+            self._x,
+            self._w,
+            self._ixs,
+            self._x_test,
+        ):
+            arr.setflags(write=False)
+        self._cache = {}
+        self._fingerprint = None
+
+    def _bin(
+        self, x: np.ndarray, w: np.ndarray, ixs: np.ndarray, n_bins: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # only cells with positive weight contribute to the bins
+        mask = w > 0
+        x, w, ixs = x[mask], w[mask], ixs[mask]
+        if not len(x):
+            raise ValueError("Unable to bin the data, all weights are `0`.")
+
+        # `x` is sorted, so the bins are equally sized intervals between its minimum and maximum
+        edges = np.linspace(x[0], x[-1], n_bins + 1)
+        bins = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, n_bins - 1)
+
+        counts = np.bincount(bins, minlength=n_bins)
+        keep = counts > 0
+        bins = (np.cumsum(keep) - 1)[bins]
+
+        w64 = w.astype(np.float64)
+        weights = np.bincount(bins, weights=w64)
+
+        self._bins, self._counts, self._cell_w = bins, counts[keep], w64
+        self._bin_w = weights
+        for arr in (self._bins, self._counts, self._cell_w, self._bin_w):
+            arr.setflags(write=False)
+
+        return (
+            np.bincount(bins, weights=w64 * x) / weights,
+            weights.astype(w.dtype),
+            ixs,
         )
-        self._x_test = self._convert(x_test[:])
-
-        return self
-
-    def _convert(self, value: np.ndarray) -> np.ndarray:
-        was_1d = value.ndim == 1
-        value = np.atleast_2d(value).astype(self._dtype)
-        if was_1d:
-            return np.swapaxes(value, 0, 1)
-        return value
-
-    def _check(self, attr_name: Optional[str], value: np.ndarray, ndim: int = 2):
-        if attr_name is None:
-            return
-        if value is None:  # already called prepare
-            if not hasattr(self, attr_name):
-                raise AttributeError(f"No attribute `{attr_name!r}` found.")
-            if getattr(self, attr_name).ndim != ndim:
-                raise ValueError(
-                    f"Expected attribute `{attr_name!r}` to have `{ndim}` dimensions, found `{getattr(self, attr_name).ndim}` dimensions."
-                )
-        else:
-            setattr(self, attr_name, self._convert(value))
-            if attr_name.startswith("_"):
-                try:
-                    getattr(self, attr_name[1:])
-                except AttributeError:
-                    setattr(
-                        self,
-                        attr_name[1:],
-                        property(lambda self: getattr(self, attr_name)),
-                    )
 
-    @abstractmethod
-    def fit(
-        self,
-        x: Optional[np.ndarray] = None,
-        y: Optional[np.ndarray] = None,
-        w: Optional[np.ndarray] = None,
-        **kwargs,
-    ) -> "Model":
+    def bin(self, y: np.ndarray) -> Tuple[np.ndarray, float]:
         """
-        Fit the model.
+        Aggregate the values of a gene into the pseudotime bins.
 
         Params
         ------
-        x
-            Independent variables.
         y
-            Dependent variables.
-        w
-            Weights of :paramref:`x`.
-        kwargs
-            Keyword arguments.
+            Values of the gene for the observations in :paramref:`ixs`.
 
         Returns
         -------
-        None
-            Just fits the model.
+        :class:`numpy.ndarray`, :class:`float`
+            The weighted means of the bins and the weighted sum of squared deviations from them.
         """
 
-        self._check("_x", x)
-        self._check("_y", y)
-        self._check("_w", w, ndim=1)
+        if self._bins is None:
+            raise RuntimeError("The plan was created without `n_bins`.")
 
-        if self._x.shape != self._y.shape:
-            raise ValueError(
-                f"Inputs and targets differ in shape: `{self._x.shape}` vs. `{self._y.shape}`."
-            )
-        if self._y.shape[0] != self._w.shape[0]:
-            raise ValueError(
+        y = np.asarray(y, dtype=np.float64).reshape(-1)
+        wy = self._cell_w * y
+        mean = np.bincount(self._bins, weights=wy) / self._bin_w
+        sq = np.bincount(self._bins, weights=wy * y) / self._bin_w
+
+        return mean, float(self._bin_w @ np.clip(sq - mean ** 2, 0, None))
+
+    @property
+    def counts(self) -> Optional[np.ndarray]:
+        """
+        Number of observations in each pseudotime bin or `None` if the data is not binned.
+        """
+        return self._counts
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the pseudotime and the weights, used to identify the fitted trends.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = _fingerprint(self.x_all, self.w_all)
+        return self._fingerprint
+
+    @property
+    def cache(self) -> Dict[Any, Any]:
+        """
+        Model-specific precomputations shared by all models prepared with this plan, such as design matrices.
+        """
+        return self._cache
+
+    @property
+    def adata(self) -> anndata.AnnData:
+        """
+        Annotated data object.
+        """
+        return self._adata
+
+    @property
+    def lineage_name(self) -> Optional[str]:
+        """
+        Name of the lineage.
+        """
+        return self._lineage_name
+
+    @property
+    def x_all(self) -> np.ndarray:
+        """
+        Original pseudotime.
+        """
+        return self._x_all
+
+    @property
+    def w_all(self) -> np.ndarray:
+        """
+        Original weights.
+        """
+        return self._w_all
+
+    @property
+    def x(self) -> np.ndarray:
+        """
+        Sorted unique pseudotime used for model fitting or the weighted mean pseudotime of each bin.
+        """
+        return self._x
+
+    @property
+    def w(self) -> np.ndarray:
+        """
+        Weights used for model fitting or the summed weights of each bin.
+        """
+        return self._w
+
+    @property
+    def ixs(self) -> np.ndarray:
+        """
+        Indices of the observations used for model fitting.
+        """
+        return self._ixs
+
+    @property
+    def x_test(self) -> np.ndarray:
+        """
+        Independent variables used for prediction.
+        """
+        return self._x_test
+
+    def gather(self, gene: str) -> np.ndarray:
+        """
+        Get the values of :paramref:`gene` for all observations.
+
+        Params
+        ------
+        gene
+            Gene in :paramref:`adata` `.var_names` or a key in :paramref:`adata` `.obs`,
+            depending on the data key.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Array of shape `(n_obs,)`.
+        """
+
+        if self._data_key == "obs":
+            if gene not in self.adata.obs:
+                raise KeyError(f"Unable to find key `{gene!r}` in `adata.obs`.")
+            y = self.adata.obs[gene].values
+        else:
+            if gene not in self.adata.var_names:
+                raise KeyError(f"Gene `{gene!r}` not found in `adata.var_names`.")
+            if self._extractor is not None and gene in self._extractor:
+                return self._extractor[gene].astype(np.float64)
+            ix = self.adata.var_names.get_loc(gene)
+            if not isinstance(ix, int):
+                ix = np.where(self.adata.var_names == gene)[0]
+            y = self._data[:, ix]
+
+        if issparse(y):
+            y = y.toarray()
+
+        return np.squeeze(np.asarray(y)).astype(np.float64)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}[lineage={self.lineage_name!r}, n_obs={len(self.x)}]"
+
+
+def _plan_defaults() -> Dict[str, Any]:
+    """Default arguments of :class:`cellrank.ul.models.PreparePlan` which determine the prepared data."""
+    return {
+        name: param.default
+        for name, param in signature(PreparePlan).parameters.items()
+        if param.default is not param.empty and name not in ("dtype", "extractor")
+    }
+
+
+def _cache_params(model: "Model") -> Optional[Dict[str, Any]]:
+    """
+    Return the hyper-parameters identifying the trends of :paramref:`model` in the cache or `None` if they
+    can't be cached.
+
+    Only models whose own class defines :meth:`cellrank.ul.models.Model._hyperparams` are cached,
+    since a subclass of a model can change its behavior without changing the inherited hyper-parameters.
+    """
+
+    if "_hyperparams" not in vars(type(model)):
+        return None
+    return model._hyperparams()
+
+
+def _cache_key(
+    model: "Model",
+    gene: str,
+    lineage_name: Optional[str],
+    plan: PreparePlan,
+    plan_kwargs: Dict[str, Any],
+) -> Optional[str]:
+    """
+    Return the key of the trend of the prepared :paramref:`model` in the cache or `None` if it can't be cached.
+
+    Params
+    ------
+    model
+        Prepared model.
+    gene
+        Gene for which the model was prepared.
+    lineage_name
+        Lineage for which the model was prepared.
+    plan
+        Plan used to prepare the model.
+    plan_kwargs
+        Keyword arguments used to create the :paramref:`plan`.
+
+    Returns
+    -------
+    :class:`str`
+        The key or `None`.
+    """
+
+    params = _cache_params(model)
+    if params is None:
+        return None
+
+    return _fingerprint(
+        f"{type(model).__module__}.{type(model).__qualname__}",
+        sorted(params.items()),
+        gene,
+        lineage_name,
+        sorted({**_plan_defaults(), **plan_kwargs}.items()),
+        plan.fingerprint,
+        model.y_all,
+    )
+
+
+def _put_trends(
+    cache: TrendCache, keys: Dict[Tuple[str, Optional[str]], str], trends: Iterable[Any]
+) -> None:
+    """
+    Store the trends fitted elsewhere, e.g. by a process which doesn't share the :paramref:`cache`.
+
+    Params
+    ------
+    cache
+        Cache of the fitted trends.
+    keys
+        Keys of the trends, as returned by :meth:`_Preparer.lookup`.
+    trends
+        Objects with the `gene`, `lineage`, `x_test`, `y_test` and `conf_int` attributes.
+
+    Returns
+    -------
+    None
+        Nothing, just stores the trends which have a key.
+    """
+
+    for trend in trends:
+        key = keys.get((trend.gene, trend.lineage), None)
+        if key is not None:
+            # keep the shape of `Model.x_test`
+            cache.put(
+                key, np.reshape(trend.x_test, (-1, 1)), trend.y_test, trend.conf_int
+            )
+
+
+class _Preparer:
+    """
+    Prepare models for a block of genes, sharing the plans and the extracted expression between them.
+
+    Params
+    ------
+    genes
+        Genes for which the models will be prepared.
+    """
+
+    def __init__(self, genes: Sequence[str]):
+        self._genes = genes
+        self._plans: Dict[Tuple[Any, ...], PreparePlan] = {}
+        self._extractors: Dict[Tuple[int, str], _GeneBlockExtractor] = {}
+
+    def __call__(
+        self, model: "Model", gene: str, lineage_name: Optional[str], **kwargs
+    ) -> "Model":
+        """
+        Prepare :paramref:`model`, reusing the plans for the same annotated data object and arguments.
+
+        Params
+        ------
+        model
+            Model to prepare.
+        gene
+            Gene in :paramref:`adata` `.var_names`.
+        lineage_name
+            Name of a lineage.
+        kwargs
+            Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+        Returns
+        -------
+        :class:`cellrank.ul.models.Model`
+            The prepared model.
+        """
+
+        return model.prepare(
+            gene, lineage_name, plan=self._get_plan(model, lineage_name, **kwargs)
+        )
+
+    def _get_plan(
+        self, model: "Model", lineage_name: Optional[str], **kwargs
+    ) -> PreparePlan:
+        adata, data_key = model.adata, kwargs.get("data_key", "X")
+        key = (id(adata), lineage_name, model._dtype, tuple(sorted(kwargs.items())))
+        plan = self._plans.get(key, None)
+        if plan is None:
+            extractor = None
+            if data_key == "X" or data_key in adata.layers:
+                extractor = self._extractors.get((id(adata), data_key), None)
+                if extractor is None:
+                    extractor = self._extractors[
+                        id(adata), data_key
+                    ] = _GeneBlockExtractor(
+                        adata, self._genes, data_key=data_key, dtype=model._dtype
+                    )
+            plan = self._plans[key] = PreparePlan(
+                adata, lineage_name, dtype=model._dtype, extractor=extractor, **kwargs
+            )
+
+        return plan
+
+    def fit_blocks(
+        self,
+        models: Dict[str, Dict[str, "Model"]],
+        lineage_names: Sequence[Optional[str]],
+        start_lineages: Optional[Sequence[Optional[str]]] = None,
+        end_lineages: Optional[Sequence[Optional[str]]] = None,
+        conf_int: bool = False,
+        cache: Optional[TrendCache] = None,
+        block_size: int = _GENE_BLOCK_SIZE,
+        **kwargs,
+    ) -> Iterator[Tuple[str, Dict[str, "Model"]]]:
+        """
+        Prepare and fit the models for all genes, in blocks of genes, and compute their predictions.
+
+        Within a block, models which can be fitted together, such as :class:`cellrank.ul.models.SplineModel`,
+        are fitted at once, the rest one by one. The :paramref:`models` are copied, not modified.
+
+        Params
+        ------
+        models
+            Gene and lineage specific models.
+        lineage_names
+            Lineages for which to fit the models.
+        start_lineages
+            Start clusters for given :paramref:`lineage_names`.
+        end_lineages
+            End clusters for given :paramref:`lineage_names`.
+        conf_int
+            Whether to compute the confidence intervals.
+        cache
+            Cache of the fitted trends. Models whose trends are found in it are only prepared, not fitted.
+        block_size
+            Number of genes prepared at once.
+        kwargs
+            Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+        Yields
+        ------
+        :class:`list`
+            The genes of a block and their models for each lineage, with :paramref:`y_test` and optionally
+            :paramref:`conf_int` computed.
+        """
+
+        if start_lineages is None:
+            start_lineages = [None] * len(lineage_names)
+        if end_lineages is None:
+            end_lineages = [None] * len(lineage_names)
+
+        if cache is not None and not cache.enabled:
+            cache = None
+
+        for i in range(0, len(self._genes), block_size):
+            block, prepared, missing = self._genes[i : i + block_size], {}, []
+            for gene in block:
+                prepared[gene] = {}
+                for ln, sc, ec in zip(lineage_names, start_lineages, end_lineages):
+                    # the same instance can be specified for multiple genes or lineages
+                    model = copy(models[gene][ln])
+
+                    plan_kwargs = dict(kwargs, start_lineage=sc, end_lineage=ec)
+                    plan = self._get_plan(model, ln, **plan_kwargs)
+                    model = prepared[gene][ln] = model.prepare(gene, ln, plan=plan)
+
+                    key = (
+                        None
+                        if cache is None
+                        else _cache_key(model, gene, ln, plan, plan_kwargs)
+                    )
+                    if key is not None:
+                        trend = cache.get(key, conf_int=conf_int)
+                        if trend is not None:
+                            model._x_test, model._y_test, model._conf_int = trend
+                            continue
+                    missing.append((model, key))
+
+            _fit_many(m for m, _ in missing)
+            for model, _ in missing:
+                model.fit()
+                model.predict()
+            if conf_int:
+                _default_conf_int_many(
+                    m for m, _ in missing if m._uses_default_conf_int
+                )
+                for model, _ in missing:
+                    if not model._uses_default_conf_int:
+                        model.confidence_interval()
+
+            for model, key in missing:
+                if key is not None:
+                    cache.put(
+                        key,
+                        model.x_test,
+                        model.y_test,
+                        model.conf_int if conf_int else None,
+                    )
+
+            yield [(gene, prepared[gene]) for gene in block]
+
+    def lookup(
+        self,
+        models: Dict[str, Dict[str, "Model"]],
+        lineage_names: Sequence[Optional[str]],
+        start_lineages: Optional[Sequence[Optional[str]]] = None,
+        end_lineages: Optional[Sequence[Optional[str]]] = None,
+        conf_int: bool = False,
+        cache: Optional[TrendCache] = None,
+        **kwargs,
+    ) -> Tuple[
+        Dict[str, Dict[str, Tuple[np.ndarray, ...]]],
+        Dict[Tuple[str, Optional[str]], str],
+    ]:
+        """
+        Prepare the models for all genes and look up their trends in :paramref:`cache`, without fitting anything.
+
+        This is used before dispatching the genes to processes, which don't share the :paramref:`cache`.
+
+        Params
+        ------
+        models
+            Gene and lineage specific models.
+        lineage_names
+            Lineages for which to look up the trends.
+        start_lineages
+            Start clusters for given :paramref:`lineage_names`.
+        end_lineages
+            End clusters for given :paramref:`lineage_names`.
+        conf_int
+            Whether the confidence intervals are required.
+        cache
+            Cache of the fitted trends.
+        kwargs
+            Keyword arguments for :meth:`cellrank.ul.models.Model.prepare`.
+
+        Returns
+        -------
+        :class:`dict`, :class:`dict`
+            The test points, predictions and confidence intervals of genes whose trends were found for all lineages
+            and the keys under which to store the trends of the remaining genes, see :func:`_put_trends`.
+        """
+
+        if start_lineages is None:
+            start_lineages = [None] * len(lineage_names)
+        if end_lineages is None:
+            end_lineages = [None] * len(lineage_names)
+
+        hits, keys = {}, {}
+        if cache is None or not cache.enabled:
+            return hits, keys
+
+        for gene in self._genes:
+            found, missing = {}, {}
+            for ln, sc, ec in zip(lineage_names, start_lineages, end_lineages):
+                model = copy(models[gene][ln])
+                if _cache_params(model) is None:
+                    missing[gene, ln] = None
+                    continue
+
+                plan_kwargs = dict(kwargs, start_lineage=sc, end_lineage=ec)
+                plan = self._get_plan(model, ln, **plan_kwargs)
+                model = model.prepare(gene, ln, plan=plan)
+
+                key = _cache_key(model, gene, ln, plan, plan_kwargs)
+                trend = None if key is None else cache.get(key, conf_int=conf_int)
+                if trend is None:
+                    missing[gene, ln] = key
+                else:
+                    found[ln] = trend
+
+            # the genes are fitted for all lineages at once
+            if missing:
+                keys.update(missing)
+            else:
+                hits[gene] = found
+
+        return hits, keys
+
+    def fit(self, *args, **kwargs) -> Iterator[Tuple[str, Dict[str, "Model"]]]:
+        """
+        Prepare and fit the models for all genes, see :meth:`fit_blocks`.
+
+        Params
+        ------
+        args
+            Positional arguments for :meth:`fit_blocks`.
+        kwargs
+            Keyword arguments for :meth:`fit_blocks`.
+
+        Yields
+        ------
+        :class:`str`, :class:`dict`
+            The gene and its models for each lineage.
+        """
+
+        for block in self.fit_blocks(*args, **kwargs):
+            yield from block
+
+
+class Model(ABC):
+    """
+    Base class for other model classes.
+
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
+        Annotated data object.
+    model
+        Underlying model.
+    weight_name
+        Name of the weight argument for :paramref:`model`.
+    """
+
+    def __init__(
+        self, adata: anndata.AnnData, model: Any, weight_name: Optional[str] = None
+    ):
+        self._adata = adata
+        self._model = model
+        self.weight_name = weight_name
+
+        self._x_all = None
+        self._y_all = None
+        self._w_all = None
+
+        self._x = None
+        self._y = None
+        self._w = None
+
+        self._x_test = None
+        self._y_test = None
+        self._x_hat = None
+        self._y_hat = None
+
+        self._conf_int = None
+        self._plan_cache = None
+        self._bin_counts = None
+        self._bin_ss = None
+
+        self._dtype = np.float32
+
+    @property
+    def adata(self) -> anndata.AnnData:
+        """
+        Annotated data object.
+        """
+        return self._adata
+
+    @property
+    def model(self) -> Any:
+        """
+        The underlying model.
+        """
+        return self._model
+
+    @property
+    def x_all(self) -> np.ndarray:
+        """
+        Original independent variables.
+        """
+        return self._x_all
+
+    @property
+    def y_all(self) -> np.ndarray:
+        """
+        Original dependent variables.
+        """
+        return self._y_all
+
+    @property
+    def w_all(self) -> np.ndarray:
+        """
+        Original weights.
+        """
+        return self._w_all
+
+    @property
+    def x(self) -> np.ndarray:
+        """
+        Independent variables used for model fitting.
+        """
+        return self._x
+
+    @property
+    def y(self) -> np.ndarray:
+        """
+        Dependent variables used for model fitting.
+        """
+        return self._y
+
+    @property
+    def w(self) -> np.ndarray:
+        """
+        Weights of independet variables used for model fitting.
+        """
+        return self._w
+
+    @property
+    def x_test(self) -> np.ndarray:
+        """
+        Independent variables used for prediction.
+        """
+        return self._x_test
+
+    @property
+    def y_test(self) -> np.ndarray:
+        """
+        Predicted values.
+        """
+        return self._y_test
+
+    @property
+    def x_hat(self) -> np.ndarray:
+        """
+        Independent variables used when calculating default confidence interval.
+        """
+        return self._x_hat
+
+    @property
+    def y_hat(self) -> np.ndarray:
+        """
+        Dependent variables used when calculating default confidence interval.
+        """
+        return self._y_hat
+
+    @property
+    def conf_int(self) -> np.ndarray:
+        """
+        Confidence interval.
+        """
+        return self._conf_int
+
+    @abstractmethod
+    def __copy__(self) -> "Model":
+        pass
+
+    def _hyperparams(self) -> Optional[Dict[str, Any]]:
+        """
+        Hyper-parameters which, together with the data, determine the fitted trend or `None` if they are unknown,
+        in which case the trends are not cached.
+        """
+        return None
+
+    @property
+    def _uses_default_conf_int(self) -> bool:
+        """Whether :meth:`confidence_interval` is :meth:`default_conf_int`, which can be computed in batches."""
+        return False
+
+    def prepare(
+        self,
+        gene: str,
+        lineage_name: str,
+        data_key: str = "X",
+        final: bool = True,
+        time_key: str = "latent_time",
+        start_lineage: Optional[str] = None,
+        end_lineage: Optional[str] = None,
+        threshold: Optional[float] = None,
+        weight_threshold: float = 0.02,
+        weight_scale: float = 1,
+        filter_data: float = False,
+        n_test_points: int = 200,
+        n_bins: Optional[int] = None,
+        plan: Optional["PreparePlan"] = None,
+    ) -> "Model":
+        """
+        Prepare the model to be ready for fitting.
+
+        Params
+        ------
+        gene
+            Gene in :paramref:`adata` `.var_names`.
+        lineage_name
+            Name of a lineage in :paramref:`adata` `.uns`:paramref:`lineage_key`.
+        data_key
+            Key in :attr:`paramref.adata` `.layers` or `'X'` for :paramref:`adata` `.X`
+        final
+            Whether to consider cells going to final states or vice versa.
+        time_key
+            Key in :paramref:`adata` `.obs` where the pseudotime is stored.
+        start_lineage
+            Lineage from which to select cells with lowest pseudotime as starting points.
+            If specified, the trends start at the earliest pseudotime within that lineage,
+            otherwise they start from time `0`.
+        end_lineage
+            Lineage from which to select cells with highest pseudotime as endpoints.
+            If specified, the trends end at the latest pseudotime within that lineage,
+            otherwise, it is determined automatically.
+        threshold
+            Consider only cells with :paramref:`weights` > :paramref:`threshold` when estimating the testing endpoint.
+            If `None`, use median of :paramref:`w`.
+        weight_threshold
+            Set all weights below this to :paramref:`weight_scale` * :paramref:`weight_threshold`.
+        weight_scale
+            Weight threshold scale, see :paramref:`weight_threshold`.
+        filter_data
+            Use only testing points for fitting.
+        n_test_points
+            Number or test points.
+            if `None`, use the original points based on :paramref:`threshold`.
+        n_bins
+            If not `None`, aggregate the cells into this many equally sized pseudotime bins and fit the model
+            on the weighted means of the bins, weighted by the summed weights of their cells.
+            The cost of fitting is then independent of the number of cells. The pseudotime within a bin is
+            replaced by its weighted mean, so the bins should be much narrower than the features of the trends,
+            e.g. `1000` bins for `200` test points. The residual variance used by :meth:`default_conf_int`
+            and :class:`cellrank.ul.models.SplineModel` includes the variance within the bins, the confidence
+            intervals of other underlying models only account for the variance of the bin means.
+        plan
+            Plan created for :paramref:`lineage_name`, which contains the preprocessing shared by all genes.
+            If not `None`, all other arguments, except for :paramref:`gene` and :paramref:`lineage_name`, are ignored.
+
+        Returns
+        -------
+        None
+            Nothing, but updates the following fields:
+
+            - :paramref:`x`
+            - :paramref:`y`
+            - :paramref:`w`
+            - :paramref:`x_test`
+        """
+
+        if plan is None:
+            plan = PreparePlan(
+                self.adata,
+                lineage_name,
+                data_key=data_key,
+                final=final,
+                time_key=time_key,
+                start_lineage=start_lineage,
+                end_lineage=end_lineage,
+                threshold=threshold,
+                weight_threshold=weight_threshold,
+                weight_scale=weight_scale,
+                filter_data=filter_data,
+                n_test_points=n_test_points,
+                n_bins=n_bins,
+                dtype=self._dtype,
+            )
+        elif plan.lineage_name != lineage_name:
+            raise ValueError(
+                f"Plan was created for lineage `{plan.lineage_name!r}`, not `{lineage_name!r}`."
+            )
+
+        y = plan.gather(gene)
+        y_fit = y[plan.ixs]
+        if plan.counts is not None:
+            y_fit, self._bin_ss = plan.bin(y_fit)
+        else:
+            self._bin_ss = None
+        self._bin_counts = plan.counts
+
+        self._x_all, self._y_all, self._w_all = plan.x_all, y, plan.w_all
+        self._x, self._y, self._w = (
+            self._convert(plan.x),
+            self._convert(y_fit),
+            self._convert(plan.w).squeeze(-1),
+        )
+        self._x_test = self._convert(plan.x_test)
+        self._plan_cache = plan.cache
+
+        return self
+
+    def _convert(self, value: np.ndarray) -> np.ndarray:
+        was_1d = value.ndim == 1
+        value = np.atleast_2d(value).astype(self._dtype)
+        if was_1d:
+            return np.swapaxes(value, 0, 1)
+        return value
+
+    def _check(self, attr_name: Optional[str], value: np.ndarray, ndim: int = 2):
+        if attr_name is None:
+            return
+        if value is None:  # already called prepare
+            if not hasattr(self, attr_name):
+                raise AttributeError(f"No attribute `{attr_name!r}` found.")
+            if getattr(self, attr_name).ndim != ndim:
+                raise ValueError(
+                    f"Expected attribute `{attr_name!r}` to have `{ndim}` dimensions, found `{getattr(self, attr_name).ndim}` dimensions."
+                )
+        else:
+            setattr(self, attr_name, self._convert(value))
+            if attr_name.startswith("_"):
+                try:
+                    getattr(self, attr_name[1:])
+                except AttributeError:
+                    setattr(
+                        self,
+                        attr_name[1:],
+                        property(lambda self: getattr(self, attr_name)),
+                    )
+
+    @abstractmethod
+    def fit(
+        self,
+        x: Optional[np.ndarray] = None,
+        y: Optional[np.ndarray] = None,
+        w: Optional[np.ndarray] = None,
+        **kwargs,
+    ) -> "Model":
+        """
+        Fit the model.
+
+        Params
+        ------
+        x
+            Independent variables.
+        y
+            Dependent variables.
+        w
+            Weights of :paramref:`x`.
+        kwargs
+            Keyword arguments.
+
+        Returns
+        -------
+        None
+            Just fits the model.
+        """
+
+        if x is not None or y is not None or w is not None:
+            # the data is no longer the binned data from `prepare`
+            self._bin_counts = self._bin_ss = None
+
+        self._check("_x", x)
+        self._check("_y", y)
+        self._check("_w", w, ndim=1)
+
+        if self._x.shape != self._y.shape:
+            raise ValueError(
+                f"Inputs and targets differ in shape: `{self._x.shape}` vs. `{self._y.shape}`."
+            )
+        if self._y.shape[0] != self._w.shape[0]:
+            raise ValueError(
                 f"Inputs and weights differ in shape: `{self._y.shape[0]}` vs. `{self._w.shape[0]}`."
             )
 
         return self
 
-    @abstractmethod
+    def _predict_at(
+        self, x_test: Optional[np.ndarray], key_added: Optional[str]
+    ) -> np.ndarray:
+        # with `key_added=None`, the points are used without being saved
+        if key_added is not None or x_test is None:
+            return self.x_test
+        return self._convert(np.asarray(x_test))
+
+    @abstractmethod
+    def predict(
+        self,
+        x_test: Optional[np.ndarray] = None,
+        key_added: Optional[str] = "_x_test",
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Run the prediction.
+
+        Params
+        ------
+        x_test
+            Features used for prediction.
+        key_added
+            Attribute name where to save the :paramref:`x_test` for later use.
+            If `None`, predict at :paramref:`x_test` without saving it or the predicted values.
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The predicted values.
+        """
+
+        pass
+
+    def default_conf_int(
+        self,
+        x: Optional[np.ndarray] = None,
+        x_test: Optional[np.ndarray] = None,
+        w: Optional[np.ndarray] = None,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Calculate a confidence interval if underlying model has no method for it.
+
+        Params
+        ------
+        x
+            Points used to fit the model.
+        x_test
+            Points for which to calculate the interval
+        w
+            Weights of the points used to fit the model. Used for filtering those points.
+        kwargs
+            Keyword arguments.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The confidence interval.
+        """
+
+        self._check("_x", x)
+        self._check("_w", w, ndim=1)
+
+        use_ixs = np.where(self.w > 0)[0]
+        self._check("_x_hat", self.x[use_ixs])
+
+        self._y_hat = self.predict(self.x_hat, key_added=None, **kwargs)
+        self._y_test = self.predict(x_test, key_added="_x_test", **kwargs)
+
+        return _default_conf_int_many([self], set_y_hat=False)[0]
+
+    @abstractmethod
+    def confidence_interval(
+        self, x_test: Optional[np.ndarray] = None, **kwargs
+    ) -> np.ndarray:
+        """
+        Calculate a confidence interval.
+
+        Params
+        ------
+        x_test
+            Points for which to calculate the confidence interval.
+        kwargs
+            Keyword arguments.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The confidence interval.
+        """
+
+        pass
+
+    def plot(
+        self,
+        figsize: Tuple[float, float] = (15, 10),
+        same_plot: bool = False,
+        hide_cells: bool = False,
+        perc: Tuple[float, float] = None,
+        abs_prob_cmap: mcolors.ListedColormap = cm.viridis,
+        cell_color: str = "black",
+        color: str = "black",
+        alpha: float = 0.8,
+        lineage_alpha: float = 0.2,
+        title: Optional[str] = None,
+        size: int = 15,
+        lw: float = 2,
+        show_cbar: bool = True,
+        margins: float = 0.015,
+        xlabel: str = "Pseudotime",
+        ylabel: str = "Expression",
+        show_conf_int: bool = True,
+        dpi: int = None,
+        fig: mpl.figure.Figure = None,
+        ax: mpl.axes.Axes = None,
+        return_fig: bool = False,
+        save: Optional[str] = None,
+    ) -> Optional[mpl.figure.Figure]:
+        """
+        Plots the smoothed gene expression.
+
+        Params
+        ------
+        figsize
+            Size of the figure.
+        same_plot
+            Whether to plot all trends in the same plot.
+        hide_cells
+            Whether to hide the cells.
+        perc
+            Percentile by which to clip the absorption probabilities.
+        abs_prob_cmap
+            Colormap to use when coloring in the absorption probabilities.
+        cell_color
+            Color for the cells when not coloring absorption probabilities.
+        color
+            Color for the lineages.
+        alpha
+            Alpha channel for cells.
+        lineage_alpha
+            Alpha channel for lineage confidence intervals.
+        title
+            Title of the plot.
+        size
+            Size of the points.
+        lw
+            Line width for the smoothed values.
+        show_cbar
+            Whether to show colorbar.
+        margins
+            Margins around the plot.
+        xlabel
+            Label on the x-axis.
+        ylabel
+            Label on the y-axis.
+        show_conf_int
+            Whether to show the confidence interval.
+        dpi
+            Dots per inch.
+        fig
+            Figure to use, if `None`, create a new one.
+        ax: :class:`matplotlib.axes.Axes`
+            Ax to use, if `None`, create a new one.
+        return_fig
+            If `True`, return the figure object.
+        save
+            Filename where to save the plot.
+            If `None`, just shows the plots.
+
+        Returns
+        -------
+        None
+            Nothing, just plots the fitted model.
+        """
+
+        if fig is None or ax is None:
+            fig, ax = plt.subplots(figsize=figsize, constrained_layout=True)
+
+        if dpi is not None:
+            fig.set_dpi(dpi)
+
+        vmin, vmax = _minmax(self.w, perc)
+        if not hide_cells:
+            _ = ax.scatter(
+                self.x_all.squeeze(),
+                self.y_all.squeeze(),
+                c=cell_color
+                if same_plot or np.allclose(self.w_all, 1.0)
+                else self.w_all.squeeze(),
+                s=size,
+                cmap=abs_prob_cmap,
+                vmin=vmin,
+                vmax=vmax,
+                alpha=alpha,
+            )
+
+        ax.plot(self.x_test, self.y_test, color=color, lw=lw, label=title)
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.margins(margins)
+
+        if show_conf_int and self.conf_int is not None:
+            ax.fill_between(
+                self.x_test.squeeze(),
+                self.conf_int[:, 0],
+                self.conf_int[:, 1],
+                alpha=lineage_alpha,
+                color=color,
+                linestyle="--",
+            )
+
+        if show_cbar and not hide_cells and not same_plot:
+            norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
+            cax, _ = mpl.colorbar.make_axes(ax, aspect=200)
+            _ = mpl.colorbar.ColorbarBase(
+                cax, norm=norm, cmap=abs_prob_cmap, label="Absorption probability"
+            )
+
+        if save is not None:
+            save_fig(fig, save)
+
+        if return_fig:
+            return fig
+
+    def __str__(self) -> str:
+        return repr(self)
+
+    def __repr__(self) -> str:
+        return "{}[{}]".format(
+            self.__class__.__name__,
+            None
+            if self.model is None
+            else _dup_spaces.sub(" ", str(self.model).replace("\n", " ")).strip(),
+        )
+
+
+class SKLearnModel(Model):
+    """
+    Wrapper around `scikit-learn`-like models.
+
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
+        Annotated data object.
+    model
+        Underlying `scikit-learn` model.
+    weight_name
+        Name of the weight argument for :paramref:`model` `.fit`.
+    """
+
+    _fit_names = ("fit", "__init__")
+    _predict_names = ("predict", "__call__")
+    _weight_names = ("w", "weights", "sample_weight", "sample_weights")
+    _conf_int_names = ("conf_int", "confidence_intervals")
+
+    def __init__(
+        self,
+        adata: anndata.AnnData,
+        model: sklearn.base.BaseEstimator,
+        weight_name: Optional[str] = None,
+    ):
+        super().__init__(adata, model)
+        self._fit_name = self._find_func(self._fit_names)
+        self._predict_name = self._find_func(self._predict_names)
+        self._weight_name = (
+            self._find_weight_param(self._weight_names)
+            if weight_name is None
+            else weight_name
+        )
+        self._ci_name = self._find_func(
+            self._conf_int_names, use_default=True, default=None
+        )
+
+    @property
+    def model(self) -> sklearn.base.BaseEstimator:
+        return self._model
+
+    def _find_func(
+        self,
+        func_names: Iterable[str],
+        use_default: bool = False,
+        default: Optional[str] = None,
+    ) -> Optional[str]:
+        for name in func_names:
+            if hasattr(self.model, name) and callable(getattr(self.model, name)):
+                return name
+        if use_default:
+            return default
+        raise RuntimeError(
+            f"Unable to find function and no default specified, tried searching `{list(func_names)}`."
+        )
+
+    def _find_weight_param(self, param_names: Iterable[str]) -> Optional[str]:
+        for param in signature(getattr(self.model, self._fit_name)).parameters:
+            if param in param_names:
+                return param
+        return None
+
+    def fit(
+        self,
+        x: Optional[np.ndarray] = None,
+        y: Optional[np.ndarray] = None,
+        w: Optional[np.ndarray] = None,
+        **kwargs,
+    ) -> "SKLearnModel":
+        super().fit(x, y, w, **kwargs)
+
+        if self._weight_name is not None:
+            kwargs[self._weight_name] = self._w
+
+        fit_fn = getattr(self.model, self._fit_name)
+        self._model = fit_fn(self.x, self.y, **kwargs)
+
+        return self
+
+    def predict(
+        self, x_test: Optional[np.ndarray] = None, key_added: str = "_x_test", **kwargs
+    ) -> np.ndarray:
+        self._check(key_added, x_test)
+        x_test = self._predict_at(x_test, key_added)
+
+        pred_fn = getattr(self.model, self._predict_name)
+        y_test = np.squeeze(pred_fn(x_test, **kwargs))
+        if key_added is None:
+            return y_test
+
+        self._y_test = y_test
+
+        return self.y_test
+
+    def confidence_interval(
+        self, x_test: Optional[np.ndarray] = None, **kwargs
+    ) -> np.ndarray:
+        if self._ci_name is None:
+            return self.default_conf_int(x_test=x_test, **kwargs)
+
+        self._check("_x_test", x_test)
+        ci_fn = getattr(self.model, self._ci_name)
+
+        self._conf_int = ci_fn(self.x_test, **kwargs)
+
+        return self.conf_int
+
+    @property
+    def _uses_default_conf_int(self) -> bool:
+        return self._ci_name is None
+
+    def _hyperparams(self) -> Optional[Dict[str, Any]]:
+        if not hasattr(self.model, "get_params"):
+            return super()._hyperparams()
+        return {
+            "model": f"{type(self.model).__module__}.{type(self.model).__qualname__}",
+            "weight_name": self._weight_name,
+            **self.model.get_params(),
+        }
+
+    def __copy__(self) -> "SKLearnModel":
+        return type(self)(self.adata, copy(self._model))
+
+
+class GamMGCVModel(Model):
+    """
+    Wrapper around R's `mgcv` package for fitting Generalized Additive Models (GAMs).
+
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
+        Annotated data object.
+    n_splines
+        Number of splines for the GAM.
+    sp
+        Vector of smoothing parameters.
+    """
+
+    def __init__(self, adata: anndata.AnnData, n_splines: int = 5, sp: float = 2):
+        super().__init__(adata, None)
+        self._n_splines = n_splines
+        self._sp = sp
+        try:
+            import rpy2
+        except ImportError:
+            raise ImportError(
+                "Unable to import `rpy2`, install it first as `pip install rpy2`."
+            )
+
+    def fit(
+        self,
+        x: Optional[np.ndarray] = None,
+        y: Optional[np.ndarray] = None,
+        w: Optional[np.ndarray] = None,
+        **kwargs,
+    ) -> "GamMGCVModel":
+
+        from rpy2 import robjects
+        from rpy2.robjects import pandas2ri, Formula
+        from rpy2.robjects.packages import importr
+
+        super().fit(x, y, w, **kwargs)
+
+        use_ixs = np.where(self.w > 0)[0]
+        self._x = self.x[use_ixs]
+        self._y = self.y[use_ixs]
+        self._w = self.w[use_ixs]
+
+        n_splines = kwargs.pop("n_splines", self._n_splines)
+
+        mgcv = importr("mgcv")
+        pandas2ri.activate()
+
+        df = pandas2ri.py2rpy(
+            pd.DataFrame(np.c_[self.x, self.y][use_ixs, :], columns=["x", "y"])
+        )
+        self._model = mgcv.gam(
+            Formula(f'y ~ s(x, k={n_splines}, bs="cr")'),
+            data=df,
+            sp=self._sp,
+            family=robjects.r.gaussian,
+            weights=pd.Series(self.w[use_ixs]),
+        )
+
+        pandas2ri.deactivate()
+
+        return self
+
     def predict(
-        self,
-        x_test: Optional[np.ndarray] = None,
-        key_added: Optional[str] = "_x_test",
-        **kwargs,
+        self, x_test: Optional[np.ndarray] = None, key_added: str = "_x_test", **kwargs
+    ) -> np.ndarray:
+        from rpy2 import robjects
+        from rpy2.robjects import pandas2ri
+
+        if self.model is None:
+            raise RuntimeError(
+                f"Trying to call an uninitialized model. To initialize it, run `.fit()` first."
+            )
+        self._check(key_added, x_test)
+        x_test = self._predict_at(x_test, key_added)
+
+        pandas2ri.activate()
+        y_test = (
+            np.array(
+                robjects.r.predict(
+                    self.model,
+                    newdata=pandas2ri.py2rpy(pd.DataFrame(x_test, columns=["x"])),
+                )
+            )
+            .squeeze()
+            .astype(self._dtype)
+        )
+        pandas2ri.deactivate()
+        if key_added is None:
+            return y_test
+
+        self._y_test = y_test
+
+        return self.y_test
+
+    def confidence_interval(
+        self, x_test: Optional[np.ndarray] = None, **kwargs
     ) -> np.ndarray:
+        return self.default_conf_int(x_test=x_test, **kwargs)
+
+    @property
+    def _uses_default_conf_int(self) -> bool:
+        return True
+
+    def _hyperparams(self) -> Dict[str, Any]:
+        return {"n_splines": self._n_splines, "sp": self._sp}
+
+    def __copy__(self) -> "GamMGCVModel":
+        return type(self)(self.adata, self._n_splines, self._sp)
+
+
+class _SplineBasis:
+    """
+    Penalized B-spline regression for fixed points and weights, shared by all genes fitted on them.
+
+    Params
+    ------
+    x
+        Independent variables of shape `(n,)`.
+    w
+        Weights of shape `(n,)`.
+    x_test
+        Points used for prediction of shape `(t,)`.
+    n_splines
+        Number of basis functions.
+    degree
+        Degree of the splines.
+    lam
+        Strength of the difference penalty.
+    penalty_order
+        Order of the differences of neighboring coefficients which are penalized.
+    n_obs
+        Number of observations, if :paramref:`x` are bins. If `None`, use the number of positive weights.
+    """
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        w: np.ndarray,
+        x_test: np.ndarray,
+        n_splines: int,
+        degree: int,
+        lam: float,
+        penalty_order: int,
+        n_obs: Optional[int] = None,
+    ):
+        from scipy.linalg import cho_factor, cho_solve
+
+        self.x, self.w, self.x_test = x, w, x_test
+
+        lo, hi = np.min(x), np.max(x)
+        if hi <= lo:
+            hi = lo + 1
+        inner = np.linspace(lo, hi, n_splines - degree + 1)
+        self._knots = np.r_[[lo] * degree, inner, [hi] * degree]
+        self._n_splines = n_splines
+        self._degree = degree
+
+        x64, w64 = x.astype(np.float64), w.astype(np.float64)
+        self._design = self.design(x64)
+        self._weighted = self._design.T * w64  # `n_splines x n`
+
+        gram = self._weighted @ self._design
+        diff = np.diff(np.eye(n_splines), n=penalty_order, axis=0)
+        self._factor = cho_factor(gram + lam * (diff.T @ diff))
+        self._cho_solve = cho_solve
+
+        # covariance of the coefficients is `sigma^2 * A^-1 G A^-1`
+        a_inv = cho_solve(self._factor, np.eye(n_splines))
+        self._cov = a_inv @ gram @ a_inv
+        self._edf = np.trace(a_inv @ gram)
+        self._n = max(np.sum(w64 > 0) if n_obs is None else n_obs, 1)
+        self._n_obs = n_obs
+        self._w64 = w64
+
+        self._design_test = self.design(x_test)
+        self._var_test = self.variance(self._design_test)
+
+    def design(self, x: np.ndarray) -> np.ndarray:
+        """Evaluate the basis functions at :paramref:`x`, points outside of the data are clipped."""
+        from scipy.interpolate import BSpline
+
+        x = np.clip(
+            np.asarray(x, dtype=np.float64).reshape(-1), self._knots[0], self._knots[-1]
+        )
+        return BSpline(self._knots, np.eye(self._n_splines), self._degree)(x)
+
+    def variance(self, design: np.ndarray) -> np.ndarray:
+        """Variance of the predictions for :paramref:`design`, up to the scale `sigma^2`."""
+        return np.sum((design @ self._cov) * design, axis=1)
+
+    def solve(
+        self, y: np.ndarray, within: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Run the prediction.
+        Fit the coefficients for all columns of :paramref:`y` at once.
 
         Params
         ------
-        x_test
-            Features used for prediction.
+        y
+            Dependent variables of shape `(n, n_genes)`.
+        within
+            Weighted sums of squares within the bins of shape `(n_genes,)`, if :paramref:`y` are bin means.
+
         Returns
         -------
-        :class:`numpy.ndarray`
-            The predicted values.
+        :class:`numpy.ndarray`, :class:`numpy.ndarray`
+            The coefficients of shape `(n_splines, n_genes)` and the residual variances of shape `(n_genes,)`.
         """
 
-        pass
+        y = np.asarray(y, dtype=np.float64)
+        coef = self._cho_solve(self._factor, self._weighted @ y)
+        res = y - self._design @ coef
+        rss = self._w64 @ (res ** 2)
+        if within is not None:
+            rss = rss + within
+        sigma2 = rss / max(self._n - self._edf, 1)
+
+        return coef, sigma2
+
+    def matches(
+        self, x: np.ndarray, w: np.ndarray, n_obs: Optional[int] = None
+    ) -> bool:
+        """Return whether the basis was created for :paramref:`x`, :paramref:`w` and :paramref:`n_obs`."""
+        return (
+            n_obs == self._n_obs
+            and x.shape == self.x.shape
+            and w.shape == self.w.shape
+            and np.array_equal(x, self.x)
+            and np.array_equal(w, self.w)
+        )
 
-    def default_conf_int(
+
+class SplineModel(Model):
+    """
+    Weighted penalized regression spline implemented in :mod:`numpy`, a fast alternative to
+    :class:`cellrank.ul.models.GamMGCVModel` which doesn't require R.
+
+    The design matrix and the factorization of the penalized normal equations only depend on the pseudotime
+    and the lineage weights, so they are computed once per lineage and shared by all genes. Models of different
+    genes can be fitted at once using :meth:`fit_many`.
+
+    Params
+    ------
+    adata : :class:`anndata.AnnData`
+        Annotated data object.
+    n_splines
+        Number of B-spline basis functions.
+    degree
+        Degree of the splines.
+    lam
+        Smoothing strength, the weight of the penalty on the differences of neighboring coefficients.
+    penalty_order
+        Order of the penalized differences.
+    """
+
+    def __init__(
         self,
-        x: Optional[np.ndarray] = None,
-        x_test: Optional[np.ndarray] = None,
-        w: Optional[np.ndarray] = None,
-        **kwargs,
-    ) -> np.ndarray:
+        adata: anndata.AnnData,
+        n_splines: int = 10,
+        degree: int = 3,
+        lam: float = 1,
+        penalty_order: int = 2,
+    ):
+        if degree < 0:
+            raise ValueError(f"Expected `degree` to be `>= 0`, found `{degree}`.")
+        if n_splines <= degree:
+            raise ValueError(
+                f"Expected `n_splines` to be `> {degree}`, found `{n_splines}`."
+            )
+        if not (0 < penalty_order < n_splines):
+            raise ValueError(
+                f"Expected `penalty_order` to be in `(0, {n_splines})`, found `{penalty_order}`."
+            )
+        if lam <= 0:
+            raise ValueError(f"Expected `lam` to be `> 0`, found `{lam}`.")
+
+        super().__init__(adata, None)
+        self._n_splines = n_splines
+        self._degree = degree
+        self._lam = lam
+        self._penalty_order = penalty_order
+
+        self._basis = None
+        self._sigma2 = None
+        self._fitted_y = None
+
+    def _get_basis(self) -> _SplineBasis:
+        x, w = np.ravel(self.x), np.ravel(self.w)
+        n_obs = None if self._bin_counts is None else int(np.sum(self._bin_counts))
+        if self._basis is not None and self._basis.matches(x, w, n_obs):
+            return self._basis
+
+        key = (
+            type(self).__name__,
+            self._n_splines,
+            self._degree,
+            self._lam,
+            self._penalty_order,
+        )
+        cache = self._plan_cache if self._plan_cache is not None else {}
+        basis = cache.get(key, None)
+        if basis is None or not basis.matches(x, w, n_obs):
+            basis = _SplineBasis(
+                x,
+                w,
+                np.squeeze(self.x_test, axis=1),
+                self._n_splines,
+                self._degree,
+                self._lam,
+                self._penalty_order,
+                n_obs=n_obs,
+            )
+            cache[key] = basis
+        self._basis = basis
+
+        return basis
+
+    def _set_fit(self, coef: np.ndarray, sigma2: float) -> None:
+        self._model = coef
+        self._sigma2 = sigma2
+        self._fitted_y = self._y
+
+    @classmethod
+    def fit_many(cls, models: Iterable["SplineModel"]) -> None:
         """
-        Calculate a confidence interval if underlying model has no method for it.
+        Fit prepared models at once, solving for all models sharing the same basis as one multi-column system.
 
         Params
         ------
-        x
-            Points used to fit the model.
-        x_test
-            Points for which to calculate the interval
-        w
-            Weights of the points used to fit the model. Used for filtering those points.
-        kwargs
-            Keyword arguments.
+        models
+            Prepared models, such as the models of different genes for the same lineage.
 
         Returns
         -------
-        :class:`numpy.ndarray`
-            The confidence interval.
+        None
+            Nothing, just fits the models. Calling :meth:`fit` afterwards doesn't fit them again.
         """
 
-        self._check("_x", x)
-        self._check("_w", w, ndim=1)
+        groups = {}
+        for model in models:
+            Model.fit(model)
+            basis = model._get_basis()
+            groups.setdefault(id(basis), (basis, []))[1].append(model)
 
-        use_ixs = np.where(self.w > 0)[0]
-        self._check("_x_hat", self.x[use_ixs])
+        for basis, group in groups.values():
+            within = np.array([0 if m._bin_ss is None else m._bin_ss for m in group])
+            coef, sigma2 = basis.solve(np.hstack([m.y for m in group]), within)
+            for i, model in enumerate(group):
+                model._set_fit(coef[:, i], sigma2[i])
 
-        self._y_hat = self.predict(self.x_hat, key_added=None, **kwargs)
-        self._y_test = self.predict(x_test, key_added="_x_test", **kwargs)
+    def fit(
+        self,
+        x: Optional[np.ndarray] = None,
+        y: Optional[np.ndarray] = None,
+        w: Optional[np.ndarray] = None,
+        **kwargs,
+    ) -> "SplineModel":
+        # already fitted by `fit_many`
+        if (
+            x is None
+            and y is None
+            and w is None
+            and self._fitted_y is not None
+            and self._fitted_y is self._y
+        ):
+            return self
 
-        n = np.sum(use_ixs)
-        sigma = np.sqrt(((self.y_hat - self.y[use_ixs]) ** 2).sum() / (n - 2))
+        super().fit(x, y, w, **kwargs)
 
-        stds = (
-            np.sqrt(
-                1
-                + 1 / n
-                + ((self.x_test - np.mean(self.x)) ** 2)
-                / ((self.x - np.mean(self.x)) ** 2).sum()
-            )
-            * sigma
-            / 2
+        coef, sigma2 = self._get_basis().solve(
+            self.y, None if self._bin_ss is None else np.array([self._bin_ss])
         )
-        stds = np.squeeze(stds)
+        self._set_fit(coef[:, 0], sigma2[0])
 
-        self._conf_int = np.c_[self._y_test - stds, self._y_test + stds]
+        return self
 
-        return self.conf_int
+    def _test_design(
+        self, x_test: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        basis = self._get_basis()
+        x_test = np.squeeze(self.x_test, axis=1) if x_test is None else x_test
+        x_test = np.asarray(x_test).reshape(-1)
+        if x_test.shape == basis.x_test.shape and np.array_equal(x_test, basis.x_test):
+            return basis._design_test, basis._var_test
+
+        design = basis.design(x_test)
+        return design, basis.variance(design)
+
+    def predict(
+        self, x_test: Optional[np.ndarray] = None, key_added: str = "_x_test", **kwargs
+    ) -> np.ndarray:
+        if self.model is None:
+            raise RuntimeError(
+                f"Trying to call an uninitialized model. To initialize it, run `.fit()` first."
+            )
+        self._check(key_added, x_test)
+
+        design, _ = self._test_design(x_test if key_added is None else None)
+        y_test = (design @ self.model).astype(self._dtype)
+        if key_added is None:
+            return y_test
+
+        self._y_test = y_test
+
+        return self.y_test
 
-    @abstractmethod
     def confidence_interval(
-        self, x_test: Optional[np.ndarray] = None, **kwargs
+        self, x_test: Optional[np.ndarray] = None, alpha: float = 0.05, **kwargs
     ) -> np.ndarray:
         """
-        Calculate a confidence interval.
+        Calculate the pointwise confidence interval of the fitted trend.
 
         Params
         ------
         x_test
             Points for which to calculate the confidence interval.
+        alpha
+            Significance level, by default the `95%` interval is computed.
         kwargs
-            Keyword arguments.
+            Keyword arguments for :meth:`predict`.
 
         Returns
         -------
         :class:`numpy.ndarray`
-            The confidence interval.
+            The confidence interval of shape `(n_test_points, 2)`.
         """
 
-        pass
+        from scipy.stats import norm
 
-    def plot(
-        self,
-        figsize: Tuple[float, float] = (15, 10),
-        same_plot: bool = False,
-        hide_cells: bool = False,
-        perc: Tuple[float, float] = None,
-        abs_prob_cmap: mcolors.ListedColormap = cm.viridis,
-        cell_color: str = "black",
-        color: str = "black",
-        alpha: float = 0.8,
-        lineage_alpha: float = 0.2,
-        title: Optional[str] = None,
-        size: int = 15,
-        lw: float = 2,
-        show_cbar: bool = True,
-        margins: float = 0.015,
-        xlabel: str = "Pseudotime",
-        ylabel: str = "Expression",
-        show_conf_int: bool = True,
-        dpi: int = None,
-        fig: mpl.figure.Figure = None,
-        ax: mpl.axes.Axes = None,
-        return_fig: bool = False,
-        save: Optional[str] = None,
-    ) -> Optional[mpl.figure.Figure]:
-        """
-        Plots the smoothed gene expression.
+        self._y_test = self.predict(x_test, key_added="_x_test", **kwargs)
+        _, var = self._test_design(None)
+        stds = norm.ppf(1 - alpha / 2) * np.sqrt(self._sigma2 * var)
 
-        Params
-        ------
-        figsize
-            Size of the figure.
-        same_plot
-            Whether to plot all trends in the same plot.
-        hide_cells
-            Whether to hide the cells.
-        perc
-            Percentile by which to clip the absorption probabilities.
-        abs_prob_cmap
-            Colormap to use when coloring in the absorption probabilities.
-        cell_color
-            Color for the cells when not coloring absorption probabilities.
-        color
-            Color for the lineages.
-        alpha
-            Alpha channel for cells.
-        lineage_alpha
-            Alpha channel for lineage confidence intervals.
-        title
-            Title of the plot.
-        size
-            Size of the points.
-        lw
-            Line width for the smoothed values.
-        show_cbar
-            Whether to show colorbar.
-        margins
-            Margins around the plot.
-        xlabel
-            Label on the x-axis.
-        ylabel
-            Label on the y-axis.
-        show_conf_int
-            Whether to show the confidence interval.
-        dpi
-            Dots per inch.
-        fig
-            Figure to use, if `None`, create a new one.
-        ax: :class:`matplotlib.axes.Axes`
-            Ax to use, if `None`, create a new one.
-        return_fig
-            If `True`, return the figure object.
-        save
-            Filename where to save the plot.
-            If `None`, just shows the plots.
+        self._conf_int = np.c_[self._y_test - stds, self._y_test + stds]
 
-        Returns
-        -------
-        None
-            Nothing, just plots the fitted model.
-        """
+        return self.conf_int
+
+    def _hyperparams(self) -> Dict[str, Any]:
+        return {
+            "n_splines": self._n_splines,
+            "degree": self._degree,
+            "lam": self._lam,
+            "penalty_order": self._penalty_order,
+        }
+
+    def __copy__(self) -> "SplineModel":
+        return type(self)(
+            self.adata,
+            n_splines=self._n_splines,
+            degree=self._degree,
+            lam=self._lam,
+            penalty_order=self._penalty_order,
+        )
+
+
+class _KernelBasis:
+    """
+    Kernel weights of fixed points and weights at the test points, shared by all genes smoothed on them.
+
+    The `'box'` kernel is evaluated exactly using prefix sums over the sorted points. For the `'gaussian'` kernel,
+    the points are binned on a regular grid, so that the kernel only needs to be evaluated between the test points
+    and the grid.
+
+    Params
+    ------
+    x
+        Independent variables of shape `(n,)`.
+    w
+        Weights of shape `(n,)`.
+    x_test
+        Points used for prediction of shape `(t,)`.
+    bandwidth
+        Bandwidth of the kernel. If `None`, use `1/20` of the range of :paramref:`x`.
+    kernel
+        Either `'gaussian'` or `'box'`.
+    n_grid
+        Number of grid points for the `'gaussian'` kernel.
+    """
+
+    _block_size = 64
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        w: np.ndarray,
+        x_test: np.ndarray,
+        bandwidth: Optional[float],
+        kernel: str,
+        n_grid: int,
+    ):
+        from scipy.sparse import csr_matrix
+
+        self.x, self.w, self.x_test = x, w, x_test
+
+        x64, w64 = x.astype(np.float64), w.astype(np.float64)
+        self._order = None
+        if np.any(np.diff(x64) < 0):
+            self._order = np.argsort(x64, kind="stable")
+            x64, w64 = x64[self._order], w64[self._order]
+        self._x64, self._w64 = x64, w64
+
+        lo, hi = x64[0], x64[-1]
+        if bandwidth is None:
+            bandwidth = (hi - lo) / 20 if hi > lo else 1
+        self.bandwidth = bandwidth
+        self._kernel = kernel
+
+        t = np.asarray(x_test, dtype=np.float64).reshape(-1)
+        self._t = t
+        if kernel == "box":
+            self._lo = np.searchsorted(x64, t - bandwidth, side="left")
+            self._hi = np.searchsorted(x64, t + bandwidth, side="right")
+        else:
+            grid = np.linspace(lo, hi, n_grid)
+            ixs = (
+                np.rint((x64 - lo) / (hi - lo) * (n_grid - 1)).astype(np.int64)
+                if hi > lo
+                else np.zeros(len(x64), dtype=np.int64)
+            )
+            self._binning = csr_matrix(
+                (np.ones(len(x64)), (ixs, np.arange(len(x64)))),
+                shape=(n_grid, len(x64)),
+            )
+            dist = (t[:, None] - grid[None, :]) / bandwidth
+            self._weights = np.exp(-0.5 * dist ** 2)
+            self._weights_sq = self._weights ** 2
 
-        if fig is None or ax is None:
-            fig, ax = plt.subplots(figsize=figsize, constrained_layout=True)
+        self._s0, self._s1, self._s2 = self.apply(
+            np.c_[w64, w64 * x64, w64 * x64 ** 2]
+        ).T
+        # effective number of observations at each test point
+        self._s0_sq = self.apply(w64[:, None] ** 2, squared=True)[:, 0]
 
-        if dpi is not None:
-            fig.set_dpi(dpi)
+    def apply(self, v: np.ndarray, squared: bool = False) -> np.ndarray:
+        """
+        Sum the columns of :paramref:`v` weighted by the kernel centered at each test point.
 
-        vmin, vmax = _minmax(self.w, perc)
-        if not hide_cells:
-            _ = ax.scatter(
-                self.x_all.squeeze(),
-                self.y_all.squeeze(),
-                c=cell_color
-                if same_plot or np.allclose(self.w_all, 1.0)
-                else self.w_all.squeeze(),
-                s=size,
-                cmap=abs_prob_cmap,
-                vmin=vmin,
-                vmax=vmax,
-                alpha=alpha,
-            )
+        Params
+        ------
+        v
+            Values of the sorted points of shape `(n, k)`.
+        squared
+            Whether to use the square of the kernel.
 
-        ax.plot(self.x_test, self.y_test, color=color, lw=lw, label=title)
-        ax.set_title(title)
-        ax.set_xlabel(xlabel)
-        ax.set_ylabel(ylabel)
-        ax.margins(margins)
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The sums of shape `(t, k)`.
+        """
 
-        if show_conf_int and self.conf_int is not None:
-            ax.fill_between(
-                self.x_test.squeeze(),
-                self.conf_int[:, 0],
-                self.conf_int[:, 1],
-                alpha=lineage_alpha,
-                color=color,
-                linestyle="--",
-            )
+        if self._kernel == "box":
+            csum = np.zeros((v.shape[0] + 1, v.shape[1]))
+            np.cumsum(v, axis=0, out=csum[1:])
+            return csum[self._hi] - csum[self._lo]
 
-        if show_cbar and not hide_cells and not same_plot:
-            norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
-            cax, _ = mpl.colorbar.make_axes(ax, aspect=200)
-            _ = mpl.colorbar.ColorbarBase(
-                cax, norm=norm, cmap=abs_prob_cmap, label="Absorption probability"
-            )
+        weights = self._weights_sq if squared else self._weights
+        return weights @ (self._binning @ v)
 
-        if save is not None:
-            save_fig(fig, save)
+    def smooth(self, y: np.ndarray, degree: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Smooth all columns of :paramref:`y` at once.
 
-        if return_fig:
-            return fig
+        Params
+        ------
+        y
+            Dependent variables of shape `(n, n_genes)`.
+        degree
+            Degree of the local polynomial, `0` for Nadaraya-Watson, `1` for local linear smoothing.
 
-    def __str__(self) -> str:
-        return repr(self)
+        Returns
+        -------
+        :class:`numpy.ndarray`, :class:`numpy.ndarray`
+            The smoothed values at the test points and their variances, both of shape `(t, n_genes)`.
+        """
 
-    def __repr__(self) -> str:
-        return "{}[{}]".format(
-            self.__class__.__name__,
-            None
-            if self.model is None
-            else _dup_spaces.sub(" ", str(self.model).replace("\n", " ")).strip(),
+        y = np.asarray(y, dtype=np.float64)
+        if self._order is not None:
+            y = y[self._order]
+
+        s0, t = self._s0[:, None], self._t[:, None]
+        y_test, var = [], []
+        # smooth in blocks of genes to bound the memory of the prefix sums
+        for i in range(0, y.shape[1], self._block_size):
+            block = y[:, i : i + self._block_size]
+            wy = self._w64[:, None] * block
+            k = block.shape[1]
+            sums = self.apply(np.hstack([wy, wy * self._x64[:, None], wy * block]))
+            t0, t1, q = sums[:, :k], sums[:, k : 2 * k], sums[:, 2 * k :]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = t0 / s0
+                pred = mean
+                if degree == 1:
+                    d1 = self._s1[:, None] - t * s0
+                    d2 = self._s2[:, None] - 2 * t * self._s1[:, None] + t ** 2 * s0
+                    det = s0 * d2 - d1 ** 2
+                    local = (d2 * t0 - d1 * (t1 - t * t0)) / det
+                    # fall back to the local mean if all points in the window are (almost) the same
+                    pred = np.where(det > 1e-10 * s0 * d2, local, mean)
+
+                n_eff = s0 ** 2 / self._s0_sq[:, None]
+                y_test.append(pred)
+                var.append(np.clip(q / s0 - mean ** 2, 0, None) / n_eff)
+
+        return np.hstack(y_test), np.hstack(var)
+
+    def matches(self, x: np.ndarray, w: np.ndarray) -> bool:
+        """Return whether the basis was created for :paramref:`x` and :paramref:`w`."""
+        return (
+            x.shape == self.x.shape
+            and w.shape == self.w.shape
+            and np.array_equal(x, self.x)
+            and np.array_equal(w, self.w)
         )
 
 
-class SKLearnModel(Model):
+class KernelModel(Model):
     """
-    Wrapper around `scikit-learn`-like models.
+    Weighted kernel smoother, a fast model for screening large number of genes.
+
+    The expression at each test point is the local mean (Nadaraya-Watson) or local linear fit of the cells
+    weighted by the kernel and by the lineage weights. The kernel sums are computed once per lineage and
+    shared by all genes, smoothing a gene costs `O(n + t)` for `n` cells and `t` test points.
+    Models of different genes can be smoothed at once using :meth:`fit_many`.
 
     Params
     ------
     adata : :class:`anndata.AnnData`
         Annotated data object.
-    model
-        Underlying `scikit-learn` model.
-    weight_name
-        Name of the weight argument for :paramref:`model` `.fit`.
+    bandwidth
+        Bandwidth of the kernel, the standard deviation for the `'gaussian'` kernel or the half-width of the window
+        for the `'box'` kernel. If `None`, use `1/20` of the range of the pseudotime.
+    kernel
+        Either `'gaussian'` or `'box'`. Test points with no cells within the `'box'` window are `NaN`.
+    degree
+        Degree of the local polynomial, `0` for Nadaraya-Watson, `1` for local linear smoothing.
+        The latter has lower bias at the ends of the lineage.
+    n_grid
+        Number of grid points on which the cells are binned for the `'gaussian'` kernel.
     """
 
-    _fit_names = ("fit", "__init__")
-    _predict_names = ("predict", "__call__")
-    _weight_names = ("w", "weights", "sample_weight", "sample_weights")
-    _conf_int_names = ("conf_int", "confidence_intervals")
+    _kernels = ("gaussian", "box")
 
     def __init__(
         self,
         adata: anndata.AnnData,
-        model: sklearn.base.BaseEstimator,
-        weight_name: Optional[str] = None,
+        bandwidth: Optional[float] = None,
+        kernel: str = "gaussian",
+        degree: int = 1,
+        n_grid: int = 512,
     ):
-        super().__init__(adata, model)
-        self._fit_name = self._find_func(self._fit_names)
-        self._predict_name = self._find_func(self._predict_names)
-        self._weight_name = (
-            self._find_weight_param(self._weight_names)
-            if weight_name is None
-            else weight_name
-        )
-        self._ci_name = self._find_func(
-            self._conf_int_names, use_default=True, default=None
+        if bandwidth is not None and bandwidth <= 0:
+            raise ValueError(f"Expected `bandwidth` to be `> 0`, found `{bandwidth}`.")
+        if kernel not in self._kernels:
+            raise ValueError(
+                f"Invalid kernel `{kernel!r}`. Valid options are: `{list(self._kernels)}`."
+            )
+        if degree not in (0, 1):
+            raise ValueError(f"Expected `degree` to be `0` or `1`, found `{degree}`.")
+        if n_grid < 2:
+            raise ValueError(f"Expected `n_grid` to be `>= 2`, found `{n_grid}`.")
+
+        super().__init__(adata, None)
+        self._bandwidth = bandwidth
+        self._kernel = kernel
+        self._degree = degree
+        self._n_grid = n_grid
+
+        self._basis = None
+        self._var = None
+        self._fitted_y = None
+
+    def _new_basis(self, x_test: np.ndarray) -> _KernelBasis:
+        return _KernelBasis(
+            np.ravel(self.x),
+            np.ravel(self.w),
+            x_test,
+            self._bandwidth,
+            self._kernel,
+            self._n_grid,
         )
 
-    @property
-    def model(self) -> sklearn.base.BaseEstimator:
-        return self._model
+    def _get_basis(self) -> _KernelBasis:
+        x, w = np.ravel(self.x), np.ravel(self.w)
+        if self._basis is not None and self._basis.matches(x, w):
+            return self._basis
 
-    def _find_func(
-        self,
-        func_names: Iterable[str],
-        use_default: bool = False,
-        default: Optional[str] = None,
-    ) -> Optional[str]:
-        for name in func_names:
-            if hasattr(self.model, name) and callable(getattr(self.model, name)):
-                return name
-        if use_default:
-            return default
-        raise RuntimeError(
-            f"Unable to find function and no default specified, tried searching `{list(func_names)}`."
-        )
+        key = (type(self).__name__, self._bandwidth, self._kernel, self._n_grid)
+        cache = self._plan_cache if self._plan_cache is not None else {}
+        basis = cache.get(key, None)
+        if basis is None or not basis.matches(x, w):
+            basis = cache[key] = self._new_basis(np.squeeze(self.x_test, axis=1))
+        self._basis = basis
 
-    def _find_weight_param(self, param_names: Iterable[str]) -> Optional[str]:
-        for param in signature(getattr(self.model, self._fit_name)).parameters:
-            if param in param_names:
-                return param
-        return None
+        return basis
+
+    def _set_fit(self, y_test: np.ndarray, var: np.ndarray) -> None:
+        self._model = y_test
+        self._var = var
+        self._fitted_y = self._y
+
+    @classmethod
+    def fit_many(cls, models: Iterable["KernelModel"]) -> None:
+        """
+        Fit prepared models at once, smoothing all models sharing the same kernel weights together.
+
+        Params
+        ------
+        models
+            Prepared models, such as the models of different genes for the same lineage.
+
+        Returns
+        -------
+        None
+            Nothing, just fits the models. Calling :meth:`fit` afterwards doesn't fit them again.
+        """
+
+        groups = {}
+        for model in models:
+            Model.fit(model)
+            basis = model._get_basis()
+            key = (id(basis), model._degree)
+            groups.setdefault(key, (basis, []))[1].append(model)
+
+        for (_, degree), (basis, group) in groups.items():
+            y_test, var = basis.smooth(np.hstack([m.y for m in group]), degree)
+            for i, model in enumerate(group):
+                model._set_fit(y_test[:, i], var[:, i])
 
     def fit(
         self,
@@ -714,140 +2220,191 @@ class SKLearnModel(Model):
         y: Optional[np.ndarray] = None,
         w: Optional[np.ndarray] = None,
         **kwargs,
-    ) -> "SKLearnModel":
-        super().fit(x, y, w, **kwargs)
+    ) -> "KernelModel":
+        # already fitted by `fit_many`
+        if (
+            x is None
+            and y is None
+            and w is None
+            and self._fitted_y is not None
+            and self._fitted_y is self._y
+        ):
+            return self
 
-        if self._weight_name is not None:
-            kwargs[self._weight_name] = self._w
+        super().fit(x, y, w, **kwargs)
 
-        fit_fn = getattr(self.model, self._fit_name)
-        self._model = fit_fn(self.x, self.y, **kwargs)
+        y_test, var = self._get_basis().smooth(self.y, self._degree)
+        self._set_fit(y_test[:, 0], var[:, 0])
 
         return self
 
+    def _smooth(self, x_test: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        basis = self._get_basis()
+        x_test = np.squeeze(self.x_test, axis=1) if x_test is None else x_test
+        x_test = np.asarray(x_test).reshape(-1)
+        if x_test.shape == basis.x_test.shape and np.array_equal(x_test, basis.x_test):
+            return self.model, self._var
+
+        y_test, var = self._new_basis(x_test).smooth(self.y, self._degree)
+        return y_test[:, 0], var[:, 0]
+
     def predict(
         self, x_test: Optional[np.ndarray] = None, key_added: str = "_x_test", **kwargs
     ) -> np.ndarray:
+        if self.model is None:
+            raise RuntimeError(
+                f"Trying to call an uninitialized model. To initialize it, run `.fit()` first."
+            )
         self._check(key_added, x_test)
 
-        pred_fn = getattr(self.model, self._predict_name)
-        self._y_test = pred_fn(self.x_test, **kwargs)
-        self._y_test = np.squeeze(self._y_test)
+        y_test, _ = self._smooth(x_test if key_added is None else None)
+        y_test = y_test.astype(self._dtype)
+        if key_added is None:
+            return y_test
+
+        self._y_test = y_test
 
         return self.y_test
 
     def confidence_interval(
-        self, x_test: Optional[np.ndarray] = None, **kwargs
+        self, x_test: Optional[np.ndarray] = None, alpha: float = 0.05, **kwargs
     ) -> np.ndarray:
-        if self._ci_name is None:
-            return self.default_conf_int(x_test=x_test, **kwargs)
+        """
+        Calculate the pointwise confidence interval from the local weighted variance of the expression.
 
-        self._check("_x_test", x_test)
-        ci_fn = getattr(self.model, self._ci_name)
+        Params
+        ------
+        x_test
+            Points for which to calculate the confidence interval.
+        alpha
+            Significance level, by default the `95%` interval is computed.
+        kwargs
+            Keyword arguments for :meth:`predict`.
 
-        self._conf_int = ci_fn(self.x_test, **kwargs)
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The confidence interval of shape `(n_test_points, 2)`.
+        """
+
+        from scipy.stats import norm
+
+        self._y_test = self.predict(x_test, key_added="_x_test", **kwargs)
+        _, var = self._smooth(None)
+        stds = norm.ppf(1 - alpha / 2) * np.sqrt(var)
+
+        self._conf_int = np.c_[self._y_test - stds, self._y_test + stds]
 
         return self.conf_int
 
-    def __copy__(self) -> "SKLearnModel":
-        return type(self)(self.adata, copy(self._model))
+    def _hyperparams(self) -> Dict[str, Any]:
+        return {
+            "bandwidth": self._bandwidth,
+            "kernel": self._kernel,
+            "degree": self._degree,
+            "n_grid": self._n_grid,
+        }
+
+    def __copy__(self) -> "KernelModel":
+        return type(self)(
+            self.adata,
+            bandwidth=self._bandwidth,
+            kernel=self._kernel,
+            degree=self._degree,
+            n_grid=self._n_grid,
+        )
 
 
-class GamMGCVModel(Model):
+def _default_conf_int_many(
+    models: Iterable[Model], set_y_hat: bool = True
+) -> List[np.ndarray]:
     """
-    Wrapper around R's `mgcv` package for fitting Generalized Additive Models (GAMs).
+    Compute :meth:`cellrank.ul.models.Model.default_conf_int` for many models at once.
+
+    The number of points and the leverage terms only depend on the independent variables and weights,
+    so they are computed once for all models sharing them, such as models prepared using the same plan.
 
     Params
     ------
-    adata : :class:`anndata.AnnData`
-        Annotated data object.
-    n_splines
-        Number of splines for the GAM.
-    sp
-        Vector of smoothing parameters.
+    models
+        Fitted models which have already predicted the values for their :paramref:`x_test`.
+    set_y_hat
+        Whether to predict :paramref:`y_hat` at the points used for fitting or use the one already present.
+
+    Returns
+    -------
+    list
+        The confidence intervals of shape `(n_test_points, 2)`, one for each model.
     """
 
-    def __init__(self, adata: anndata.AnnData, n_splines: int = 5, sp: float = 2):
-        super().__init__(adata, None)
-        self._n_splines = n_splines
-        self._sp = sp
-        try:
-            import rpy2
-        except ImportError:
-            raise ImportError(
-                "Unable to import `rpy2`, install it first as `pip install rpy2`."
-            )
-
-    def fit(
-        self,
-        x: Optional[np.ndarray] = None,
-        y: Optional[np.ndarray] = None,
-        w: Optional[np.ndarray] = None,
-        **kwargs,
-    ) -> "GamMGCVModel":
-
-        from rpy2 import robjects
-        from rpy2.robjects import pandas2ri, Formula
-        from rpy2.robjects.packages import importr
-
-        super().fit(x, y, w, **kwargs)
-
-        use_ixs = np.where(self.w > 0)[0]
-        self._x = self.x[use_ixs]
-        self._y = self.y[use_ixs]
-        self._w = self.w[use_ixs]
-
-        n_splines = kwargs.pop("n_splines", self._n_splines)
-
-        mgcv = importr("mgcv")
-        pandas2ri.activate()
-
-        df = pandas2ri.py2rpy(
-            pd.DataFrame(np.c_[self.x, self.y][use_ixs, :], columns=["x", "y"])
-        )
-        self._model = mgcv.gam(
-            Formula(f'y ~ s(x, k={n_splines}, bs="cr")'),
-            data=df,
-            sp=self._sp,
-            family=robjects.r.gaussian,
-            weights=pd.Series(self.w[use_ixs]),
+    models, groups = list(models), []
+    for model in models:
+        for group in groups:
+            first = group[0]
+            if (
+                first.x.shape == model.x.shape
+                and first.x_test.shape == model.x_test.shape
+                and (first._bin_counts is None) == (model._bin_counts is None)
+                and np.array_equal(first.w, model.w)
+                and np.array_equal(first.x, model.x)
+                and np.array_equal(first.x_test, model.x_test)
+                and np.array_equal(first._bin_counts, model._bin_counts)
+            ):
+                group.append(model)
+                break
+        else:
+            groups.append([model])
+
+    for group in groups:
+        first = group[0]
+        use_ixs = np.where(first.w > 0)[0]
+        x = np.ravel(first.x[use_ixs]).astype(np.float64)
+        # for binned data, the points are the bin means and the residuals of the cells
+        # are split into those of the bin means and within the bins
+        if first._bin_counts is None:
+            counts = weights = np.ones_like(x)
+        else:
+            counts = first._bin_counts[use_ixs].astype(np.float64)
+            weights = first.w[use_ixs].astype(np.float64)
+        n = np.sum(counts)
+        x_mean = (counts @ x) / n
+        x_ss = counts @ ((x - x_mean) ** 2)
+        leverage = np.squeeze(
+            np.sqrt(1 + 1 / n + ((first.x_test - x_mean) ** 2) / x_ss)
         )
 
-        pandas2ri.deactivate()
+        for model in group:
+            if set_y_hat:
+                model._check("_x_hat", model.x[use_ixs])
+                model._y_hat = model.predict(model.x_hat, key_added=None)
+            res = np.ravel(model.y_hat) - np.ravel(model.y[use_ixs])
+            ss = 0 if model._bin_ss is None else model._bin_ss
+            rss = (weights @ (res ** 2) + ss) / np.sum(weights) * n
+            sigma = np.sqrt(rss / max(n - 2, 1))
+            stds = (leverage * sigma / 2).astype(model.x_test.dtype)
+            model._conf_int = np.c_[model.y_test - stds, model.y_test + stds]
 
-        return self
+    return [m.conf_int for m in models]
 
-    def predict(
-        self, x_test: Optional[np.ndarray] = None, key_added: str = "_x_test", **kwargs
-    ) -> np.ndarray:
-        from rpy2 import robjects
-        from rpy2.robjects import pandas2ri
 
-        if self.model is None:
-            raise RuntimeError(
-                f"Trying to call an uninitialized model. To initialize it, run `.fit()` first."
-            )
-        self._check(key_added, x_test)
+def _fit_many(models: Iterable[Model]) -> None:
+    """
+    Fit all :class:`cellrank.ul.models.SplineModel` and :class:`cellrank.ul.models.KernelModel`
+    in :paramref:`models` at once.
 
-        pandas2ri.activate()
-        self._y_test = (
-            np.array(
-                robjects.r.predict(
-                    self.model,
-                    newdata=pandas2ri.py2rpy(pd.DataFrame(self.x_test, columns=["x"])),
-                )
-            )
-            .squeeze()
-            .astype(self._dtype)
-        )
-        pandas2ri.deactivate()
+    The other models are left untouched and need to be fitted using :meth:`cellrank.ul.models.Model.fit`.
 
-        return self.y_test
+    Params
+    ------
+    models
+        Prepared models.
 
-    def confidence_interval(
-        self, x_test: Optional[np.ndarray] = None, **kwargs
-    ) -> np.ndarray:
-        return self.default_conf_int(x_test=x_test, **kwargs)
+    Returns
+    -------
+    None
+        Nothing, just fits the models.
+    """
 
-    def __copy__(self) -> "GamMGCVModel":
-        return type(self)(self.adata, self._n_splines, self._sp)
+    models = list(models)
+    for cls in (SplineModel, KernelModel):
+        cls.fit_many(m for m in models if isinstance(m, cls))
@@ -3,7 +3,9 @@ from cellrank.tools import Lineage
 from cellrank.tools._utils import _create_categorical_colors
 
 import pytest
+import pickle
 import numpy as np
+import pandas as pd
 import matplotlib.colors as colors
 
 
@@ -410,6 +412,55 @@ class TestLineageAccessor:
         np.testing.assert_array_equal(y.names, ["wex", "quux"])
         np.testing.assert_array_equal(y.colors, ["#bbbbbb", "#aaaaaa"])
 
+    def test_column_names_view(self):
+        x = np.random.random((10, 5))
+        l = Lineage(x, names=["foo", "bar", "baz", "quux", "wex"])
+
+        y = l[:, ["bar", "baz", "quux"]]
+        z = l[["wex", "baz"]]
+
+        assert np.shares_memory(y, l)
+        assert np.shares_memory(z, l)
+        np.testing.assert_array_equal(x[:, [1, 2, 3]], y)
+        np.testing.assert_array_equal(x[:, [4, 2]], z)
+        np.testing.assert_array_equal(z.names, ["wex", "baz"])
+
+    def test_row_mask_col_names_outer(self):
+        x = np.random.random((10, 5))
+        l = Lineage(x, names=["foo", "bar", "baz", "quux", "wex"])
+
+        mask = np.zeros((x.shape[0]), dtype=np.bool)
+        mask[[1, 4, 7]] = True
+        y = l[mask, ["wex", "foo", "baz"]]
+
+        assert y.shape == (3, 3)
+        np.testing.assert_array_equal(x[np.ix_(mask, [4, 0, 2])], y)
+        np.testing.assert_array_equal(y.names, ["wex", "foo", "baz"])
+        np.testing.assert_array_equal(y["foo"], x[mask, :][:, [0]])
+
+    def test_names_to_ixs_reused_for_rows(self):
+        l = Lineage(np.random.random((10, 3)), names=["foo", "bar", "baz"])
+
+        assert l[2:5]._names_to_ixs is l._names_to_ixs
+
+    @pytest.mark.parametrize("col", [7, -4, [1, 9], [0, 2, 4], np.array([3])])
+    def test_column_out_of_bounds(self, col):
+        l = Lineage(np.random.random((10, 3)), names=["a", "b", "c"])
+
+        with pytest.raises(IndexError):
+            _ = l[:, col]
+
+    @pytest.mark.parametrize("axis", [0, 1])
+    def test_reduction_indexing(self, axis: int):
+        x = np.random.random((10, 3))
+        l = Lineage(x, names=["a", "b", "c"])
+
+        res = l.sum(axis=axis)
+
+        assert isinstance(repr(res), str)
+        np.testing.assert_allclose(res[0], x.sum(axis=axis)[0])
+        np.testing.assert_allclose(res[1:], x.sum(axis=axis)[1:])
+
     def test_automatic_color_assignment(self):
         x = np.random.random((10, 3))
         l = Lineage(x, names=["foo", "bar", "baz"])
@@ -417,3 +468,101 @@ class TestLineageAccessor:
         gt_colors = [colors.to_hex(c) for c in _create_categorical_colors(3)]
 
         np.testing.assert_array_equal(l.colors, gt_colors)
+
+
+class TestLineageGroupBy:
+    def test_mean_std_counts(self):
+        x = np.random.random((20, 3))
+        x[0, 1] = np.nan
+        labels = np.array(["a", "b"] * 10)
+        l = Lineage(x, names=["foo", "bar", "baz"])
+
+        groups = l.groupby(labels)
+
+        np.testing.assert_array_equal(groups.groups, ["a", "b"])
+        np.testing.assert_array_equal(groups.counts(), [10, 10])
+        for i, name in enumerate(["a", "b"]):
+            np.testing.assert_allclose(
+                groups.mean().loc[name], np.nanmean(x[i::2], axis=0)
+            )
+            np.testing.assert_allclose(
+                groups.std().loc[name], np.nanstd(x[i::2], axis=0)
+            )
+        np.testing.assert_array_equal(groups.mean().columns, ["foo", "bar", "baz"])
+
+    def test_quantile(self):
+        x = np.random.random((20, 3))
+        labels = np.array(["a", "b"] * 10)
+        groups = Lineage(x, names=["foo", "bar", "baz"]).groupby(labels)
+
+        np.testing.assert_allclose(
+            groups.quantile(0.3).loc["b"], np.quantile(x[1::2], 0.3, axis=0)
+        )
+        assert groups.quantile([0.1, 0.9]).shape == (4, 3)
+
+    def test_weights(self):
+        x = np.random.random((20, 3))
+        w = np.random.random((20,))
+        labels = np.array(["a", "b"] * 10)
+        groups = Lineage(x, names=["foo", "bar", "baz"]).groupby(labels, weights=w)
+
+        np.testing.assert_allclose(
+            groups.mean().loc["a"], np.average(x[::2], weights=w[::2], axis=0)
+        )
+        np.testing.assert_allclose(groups.counts()["a"], np.sum(w[::2]))
+
+    def test_nan_labels_are_ignored(self):
+        x = np.random.random((4, 2))
+        labels = pd.Categorical(["a", np.nan, "a", "b"])
+        groups = Lineage(x, names=["foo", "bar"]).groupby(labels)
+
+        np.testing.assert_array_equal(groups.counts(), [2, 1])
+        subsets = dict(iter(groups))
+        np.testing.assert_array_equal(subsets["a"], x[[0, 2]])
+        np.testing.assert_array_equal(subsets["b"].names, ["foo", "bar"])
+
+    def test_invalid_labels_length(self):
+        with pytest.raises(ValueError):
+            Lineage(np.random.random((4, 2)), names=["foo", "bar"]).groupby(["a"])
+
+
+class TestLineageStorage:
+    def test_dtype(self):
+        l = Lineage(
+            np.random.random((10, 3)), names=["foo", "bar", "baz"], dtype="float32"
+        )
+
+        assert l.dtype == np.float32
+        assert l.groupby(np.zeros(10)).mean().values.dtype == np.float64
+
+    def test_float16_reductions(self):
+        l = Lineage(np.full((70000, 2), 0.5), names=["foo", "bar"], dtype="float16")
+
+        np.testing.assert_array_equal(l.sum(axis=0), [35000, 35000])
+        np.testing.assert_array_equal(np.sum(l, axis=0), [35000, 35000])
+        np.testing.assert_array_equal(l.mean(axis=0), [0.5, 0.5])
+        np.testing.assert_array_equal(l.var(axis=0), [0, 0])
+        assert l.sum(axis=0).dtype == np.float64
+        assert l.sum(axis=0, dtype=np.float32).dtype == np.float32
+
+    def test_invalid_dtype(self):
+        with pytest.raises(ValueError):
+            Lineage(np.random.random((10, 3)), names=["foo", "bar", "baz"], dtype=int)
+
+    def test_memmap_pickle(self, tmp_path):
+        x = np.random.random((1000, 3))
+        l = Lineage(x, names=["foo", "bar", "baz"]).to_memmap(tmp_path / "lin.npy")
+
+        assert l._memmap_reference() is not None
+        res = pickle.loads(pickle.dumps(l))
+
+        assert len(pickle.dumps(l)) < x.nbytes
+        np.testing.assert_array_equal(res, x)
+        np.testing.assert_array_equal(res.names, ["foo", "bar", "baz"])
+
+    def test_memmap_subset_pickle(self, tmp_path):
+        x = np.random.random((10, 3))
+        l = Lineage(x, names=["foo", "bar", "baz"]).to_memmap(tmp_path / "lin.npy")
+
+        assert l[:5]._memmap_reference() is None
+        np.testing.assert_array_equal(pickle.loads(pickle.dumps(l[:5])), x[:5])
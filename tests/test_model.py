@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 import pytest
+import pickle
 import numpy as np
 
+from scipy.sparse import csr_matrix
+
 from anndata import AnnData
 from _helpers import create_model
 
+from cellrank.utils._shared import shared_models, SharedAnnData, SharedArray
+from cellrank.utils.models import PreparePlan, SplineModel, KernelModel
+from cellrank.utils.models._models import _GeneBlockExtractor, _default_conf_int_many
+
 from sklearn.svm._classes import SVR
 
 
@@ -82,3 +89,247 @@ class TestModel:
         assert isinstance(model.conf_int, np.ndarray)
         assert len(model.y_test) == len(model.conf_int)
         assert ci is model.conf_int
+
+    def test_default_conf_int_many(self, adata_cr: AnnData):
+        plan = PreparePlan(adata_cr, "0")
+        models = [
+            create_model(adata_cr).prepare(g, "0", plan=plan).fit()
+            for g in adata_cr.var_names[:3]
+        ]
+        for model in models:
+            model.predict()
+
+        ci = _default_conf_int_many(models)
+
+        assert len(ci) == len(models)
+        for model, c in zip(models, ci):
+            use_ixs = np.where(model.w > 0)[0]
+            n = len(use_ixs)
+            y_hat = model.model.predict(model.x[use_ixs])
+            sigma = np.sqrt(((y_hat - model.y[use_ixs, 0]) ** 2).sum() / (n - 2))
+            x_mean = np.mean(model.x[use_ixs])
+            x_ss = ((model.x[use_ixs] - x_mean) ** 2).sum()
+            stds = np.squeeze(
+                np.sqrt(1 + 1 / n + ((model.x_test - x_mean) ** 2) / x_ss) * sigma / 2
+            )
+
+            assert c is model.conf_int
+            assert c.shape == (len(model.x_test), 2)
+            np.testing.assert_allclose(
+                model.conf_int,
+                np.c_[model.y_test - stds, model.y_test + stds],
+                rtol=1e-5,
+            )
+
+    def test_default_conf_int_binned(self, adata_cr: AnnData):
+        model = create_model(adata_cr).prepare(adata_cr.var_names[0], "0", n_bins=20)
+        model = model.fit()
+        x_test = model.x_test.copy()
+        model.predict()
+
+        ci = model.confidence_interval()
+
+        use_ixs = np.where(model.w > 0)[0]
+        x, w = model.x[use_ixs, 0], model.w[use_ixs]
+        counts = model._bin_counts[use_ixs]
+        n = counts.sum()
+        res = model.model.predict(model.x[use_ixs]) - model.y[use_ixs, 0]
+        rss = (w @ (res ** 2) + model._bin_ss) / w.sum() * n
+        sigma = np.sqrt(rss / (n - 2))
+        x_mean = counts @ x / n
+        x_ss = counts @ ((x - x_mean) ** 2)
+        stds = np.squeeze(
+            np.sqrt(1 + 1 / n + ((x_test - x_mean) ** 2) / x_ss) * sigma / 2
+        )
+
+        np.testing.assert_array_equal(model.x_test, x_test)
+        np.testing.assert_allclose(
+            ci, np.c_[model.y_test - stds, model.y_test + stds], rtol=1e-5
+        )
+
+    def test_default_conf_int_many_different_x_test(self, adata_cr: AnnData):
+        models = [
+            create_model(adata_cr).prepare(g, "0", n_test_points=n).fit()
+            for g, n in zip(adata_cr.var_names[:2], [100, 50])
+        ]
+        for model in models:
+            model.predict()
+
+        ci = _default_conf_int_many(models)
+
+        assert [c.shape for c in ci] == [(100, 2), (50, 2)]
+
+    def test_predict_without_key_added(self, adata_cr: AnnData):
+        model = create_model(adata_cr).prepare(adata_cr.var_names[0], "0").fit()
+        y_test = model.predict()
+        x_test = model.x_test.copy()
+
+        y_hat = model.predict(model.x[:10], key_added=None)
+
+        np.testing.assert_allclose(y_hat, model.model.predict(model.x[:10]))
+        np.testing.assert_array_equal(model.x_test, x_test)
+        np.testing.assert_array_equal(model.y_test, y_test)
+
+    def test_prepare_shared_adata(self, adata_cr: AnnData):
+        gene = adata_cr.var_names[0]
+        model = create_model(adata_cr)
+        models = {gene: {"0": create_model(adata_cr)}}
+
+        with shared_models(adata_cr, models, [gene], backend="loky"):
+            shared = models[gene]["0"]
+            assert isinstance(shared.adata, SharedAnnData)
+            assert len(pickle.dumps(shared)) < len(pickle.dumps(model))
+
+            shared = pickle.loads(pickle.dumps(shared)).prepare(gene, "0")
+
+        model = model.prepare(gene, "0")
+
+        assert models[gene]["0"].adata is adata_cr
+        np.testing.assert_array_equal(model.x, shared.x)
+        np.testing.assert_array_equal(model.y, shared.y)
+        np.testing.assert_array_equal(model.w, shared.w)
+        np.testing.assert_array_equal(model.x_test, shared.x_test)
+
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_shared_array_create_columns(self, tmpdir, sparse: bool):
+        x = np.random.RandomState(42).normal(size=(20, 10))
+        x[x < 0] = 0
+        ixs = np.array([7, 0, 3, 9, 1])
+
+        shared = SharedArray.create_columns(
+            csr_matrix(x) if sparse else x,
+            str(tmpdir.join("x.npy")),
+            columns=ixs,
+            block_size=2,
+        )
+
+        np.testing.assert_array_equal(shared.get(), x[:, ixs])
+
+    def test_prepare_plan(self, adata_cr: AnnData):
+        plan = PreparePlan(adata_cr, "0", n_test_points=300)
+
+        for gene in adata_cr.var_names[:3]:
+            model = create_model(adata_cr).prepare(gene, "0", n_test_points=300)
+            planned = create_model(adata_cr).prepare(gene, "0", plan=plan)
+
+            np.testing.assert_array_equal(model.x, planned.x)
+            np.testing.assert_array_equal(model.y, planned.y)
+            np.testing.assert_array_equal(model.w, planned.w)
+            np.testing.assert_array_equal(model.x_test, planned.x_test)
+
+    def test_prepare_plan_wrong_lineage(self, adata_cr: AnnData):
+        plan = PreparePlan(adata_cr, "0")
+        with pytest.raises(ValueError):
+            create_model(adata_cr).prepare(adata_cr.var_names[0], None, plan=plan)
+
+    def test_prepare_invalid_n_bins(self, adata_cr: AnnData):
+        with pytest.raises(ValueError):
+            create_model(adata_cr).prepare(adata_cr.var_names[0], "0", n_bins=0)
+
+    def test_prepare_n_bins(self, adata_cr: AnnData):
+        gene = adata_cr.var_names[0]
+        model = create_model(adata_cr).prepare(gene, "0")
+        binned = create_model(adata_cr).prepare(gene, "0", n_bins=10)
+
+        assert binned.x.shape[0] <= 10
+        assert binned.x.shape == binned.y.shape
+        np.testing.assert_allclose(np.sum(binned.w), np.sum(model.w), rtol=1e-5)
+        np.testing.assert_allclose(
+            np.sum(binned.w[:, None] * binned.y),
+            np.sum(model.w[:, None] * model.y),
+            rtol=1e-4,
+        )
+
+        binned.fit()
+        assert binned.confidence_interval().shape == (binned.x_test.shape[0], 2)
+
+    def test_gene_block_extractor(self, adata_cr: AnnData):
+        genes = list(adata_cr.var_names[:5])
+        adata_cr.layers["sparse"] = csr_matrix(adata_cr.X)
+        extractor = _GeneBlockExtractor(adata_cr, genes, data_key="sparse")
+
+        assert "foo" not in extractor
+        for gene in genes:
+            assert gene in extractor
+            np.testing.assert_allclose(
+                extractor[gene], np.ravel(adata_cr[:, gene].X), rtol=1e-6
+            )
+
+
+class TestSplineModel:
+    def test_invalid_n_splines(self, adata_cr: AnnData):
+        with pytest.raises(ValueError):
+            SplineModel(adata_cr, n_splines=3, degree=3)
+
+    def test_fit_predict_conf_int(self, adata_cr: AnnData):
+        model = SplineModel(adata_cr).prepare(adata_cr.var_names[0], "0").fit()
+        y_test = model.predict()
+        ci = model.confidence_interval()
+
+        assert y_test.shape == (model.x_test.shape[0],)
+        assert ci.shape == (model.x_test.shape[0], 2)
+        assert np.all(ci[:, 0] <= y_test)
+        assert np.all(ci[:, 1] >= y_test)
+
+    def test_fit_n_bins(self, adata_cr: AnnData):
+        gene = adata_cr.var_names[0]
+        model = SplineModel(adata_cr).prepare(gene, "0").fit()
+        binned = SplineModel(adata_cr).prepare(gene, "0", n_bins=1000).fit()
+
+        np.testing.assert_allclose(
+            binned.predict(), model.predict(), rtol=1e-2, atol=1e-2
+        )
+
+    def test_fit_many(self, adata_cr: AnnData):
+        plan = PreparePlan(adata_cr, "0")
+        genes = adata_cr.var_names[:5]
+        models = [SplineModel(adata_cr).prepare(g, "0", plan=plan) for g in genes]
+        SplineModel.fit_many(models)
+
+        for gene, model in zip(genes, models):
+            expected = SplineModel(adata_cr).prepare(gene, "0").fit()
+            np.testing.assert_allclose(model.predict(), expected.predict(), rtol=1e-5)
+
+
+class TestKernelModel:
+    def test_invalid_kernel(self, adata_cr: AnnData):
+        with pytest.raises(ValueError):
+            KernelModel(adata_cr, kernel="foo")
+
+    def test_invalid_bandwidth(self, adata_cr: AnnData):
+        with pytest.raises(ValueError):
+            KernelModel(adata_cr, bandwidth=0)
+
+    @pytest.mark.parametrize("kernel", ["gaussian", "box"])
+    def test_fit_predict_conf_int(self, adata_cr: AnnData, kernel: str):
+        model = KernelModel(adata_cr, kernel=kernel)
+        model = model.prepare(adata_cr.var_names[0], "0").fit()
+        y_test = model.predict()
+        ci = model.confidence_interval()
+
+        assert y_test.shape == (model.x_test.shape[0],)
+        assert ci.shape == (model.x_test.shape[0], 2)
+        ok = ~np.isnan(y_test)
+        assert np.all(ci[ok, 0] <= y_test[ok])
+        assert np.all(ci[ok, 1] >= y_test[ok])
+
+    def test_local_mean(self, adata_cr: AnnData):
+        model = KernelModel(adata_cr, kernel="box", degree=0, bandwidth=0.1)
+        model = model.prepare(adata_cr.var_names[0], "0").fit()
+        x, y, w = np.ravel(model.x), np.ravel(model.y), model.w
+
+        t = float(model.x_test[100])
+        mask = np.abs(x - t) <= 0.1
+        expected = np.sum(w[mask] * y[mask]) / np.sum(w[mask])
+
+        np.testing.assert_allclose(model.predict()[100], expected, rtol=1e-5)
+
+    def test_fit_many(self, adata_cr: AnnData):
+        plan = PreparePlan(adata_cr, "0")
+        genes = adata_cr.var_names[:5]
+        models = [KernelModel(adata_cr).prepare(g, "0", plan=plan) for g in genes]
+        KernelModel.fit_many(models)
+
+        for gene, model in zip(genes, models):
+            expected = KernelModel(adata_cr).prepare(gene, "0").fit()
+            np.testing.assert_allclose(model.predict(), expected.predict(), rtol=1e-5)
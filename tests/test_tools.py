@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import cellrank as cr
+import numpy as np
 import pandas as pd
 import pytest
 
-from anndata import AnnData
+from anndata import AnnData, read_h5ad
 from cellrank.tools.kernels import Kernel
+from cellrank.tools._gene_importance import _gi_sequential_pvals, _gi_oob_null
+from cellrank.tools._exact_mc_test import _get_counts, _cramers_v, _cramers_v_matrix
+from cellrank.tools._utils import _vec_mat_corr, _subsample_embedding
+from scipy.sparse import csr_matrix
+from sklearn.ensemble import RandomForestRegressor
 from _helpers import create_model
 
 
@@ -45,6 +51,376 @@ class TestGeneImportance:
         assert "pval" in res.columns
         assert "qval" in res.columns
 
+    def test_perms_sequential(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        res1 = cr.tl.gene_importance(
+            adata_cr,
+            model,
+            adata_cr.var_names[:10],
+            "0",
+            n_perms=100,
+            sequential=True,
+            seed=42,
+        )
+        res2 = cr.tl.gene_importance(
+            adata_cr,
+            model,
+            adata_cr.var_names[:10],
+            "0",
+            n_perms=100,
+            sequential=True,
+            seed=42,
+        )
+
+        assert "n_perms" in res1.columns
+        assert np.all(res1["n_perms"] <= 100)
+        pd.testing.assert_frame_equal(res1, res2)
+
+    def test_sequential_pvals(self):
+        rng = np.random.RandomState(42)
+        perms = rng.uniform(size=(200, 20))
+        importances = np.r_[[2, 2], rng.uniform(0, 0.9, size=18)]
+        expected = np.mean(importances[:, None] < np.ravel(perms), axis=1)
+
+        pvals, n_used = _gi_sequential_pvals(
+            importances, lambda offset, size: perms[offset : offset + size], 200, 0.05
+        )
+
+        np.testing.assert_array_equal(pvals <= 0.05, expected <= 0.05)
+        assert np.max(n_used) < 200
+        np.testing.assert_allclose(pvals[2:], expected[2:], atol=0.1)
+
+    def test_invalid_null_method(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        with pytest.raises(ValueError):
+            _ = cr.tl.gene_importance(
+                adata_cr, model, adata_cr.var_names[:10], "0", null_method="foo"
+            )
+
+    def test_perms_oob(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        res = cr.tl.gene_importance(
+            adata_cr,
+            model,
+            adata_cr.var_names[:10],
+            "0",
+            n_perms=100,
+            null_method="oob",
+            seed=42,
+        )
+
+        assert "oob_importance" in res.columns
+        assert np.all((res["pval"] > 0) & (res["pval"] <= 1))
+
+    def test_oob_null(self):
+        rng = np.random.RandomState(42)
+        y = np.sort(rng.uniform(size=200))
+        x = np.c_[y + rng.uniform(0, 0.1, size=200), rng.uniform(size=(200, 5))]
+        rf = RandomForestRegressor(n_estimators=10, random_state=42).fit(x, y)
+
+        imps, null = _gi_oob_null(rf, x, y, 20, seed=42)
+        pvals = (1 + np.sum(null >= imps, axis=0)) / 21
+
+        assert null.shape == (20, 6)
+        assert np.argmax(imps) == 0
+        assert pvals[0] == 1 / 21
+
+    def test_pool(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        # the cached trends wouldn't be dispatched to the pool
+        with cr.ul.trend_cache(maxsize=0), cr.ul.pool(n_jobs=2, backend="loky") as pool:
+            res1 = cr.tl.gene_importance(
+                adata_cr, model, adata_cr.var_names[:10], "0", n_jobs=2, seed=42
+            )
+            res2 = cr.tl.gene_importance(
+                adata_cr, model, adata_cr.var_names[:10], "0", n_jobs=2, seed=42
+            )
+
+            assert pool.is_warm
+
+        assert not pool.is_warm
+        pd.testing.assert_frame_equal(res1, res2)
+
+    def test_executor(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        res1 = cr.tl.gene_importance(
+            adata_cr, model, adata_cr.var_names[:10], "0", n_jobs=2, seed=42
+        )
+        # the cached trends wouldn't be dispatched to the executor
+        with cr.ul.trend_cache(maxsize=0), cr.ul.ProcessExecutor(n_jobs=2) as executor:
+            res2 = cr.tl.gene_importance(
+                adata_cr,
+                model,
+                adata_cr.var_names[:10],
+                "0",
+                n_jobs=2,
+                seed=42,
+                backend=executor,
+            )
+
+        pd.testing.assert_frame_equal(res1, res2)
+
+
+class TestThreadBudget:
+    def test_invalid_n_cores(self):
+        with pytest.raises(ValueError):
+            with cr.ul.thread_budget(0):
+                pass
+
+    def test_split(self):
+        with cr.ul.thread_budget(8) as budget:
+            assert budget.n_threads == 8
+
+            budget = cr.ul.get_thread_budget(3)
+            assert budget.n_cores == 8
+            assert budget.n_jobs == 3
+            assert budget.n_threads == 2
+
+            assert cr.ul.get_thread_budget(16).n_threads == 1
+
+
+class TestTelemetry:
+    def test_parallelize(self):
+        from cellrank.utils._parallelize import parallelize
+
+        def double(xs, queue):
+            res = []
+            for x in xs:
+                res.append(2 * x)
+                queue.put(1)
+            queue.put(None)
+            return res
+
+        res = parallelize(
+            double,
+            list(range(100)),
+            n_jobs=2,
+            backend="threading",
+            as_array=False,
+            extractor=lambda r: sum(r, []),
+            show_progress_bar=False,
+        )()
+        telemetry = cr.ul.get_telemetry()
+
+        assert res == [2 * x for x in range(100)]
+        assert isinstance(telemetry, cr.ul.Telemetry)
+        assert list(telemetry.items.index) == list(range(100))
+        assert telemetry.chunks["n_items"].sum() == 100
+        assert len(telemetry.slowest(5)) == 5
+
+
+class TestWorkerPool:
+    def test_default_pool_keeps_max_size(self):
+        from cellrank.utils._parallelize import _get_pool, _shutdown_default_pool
+
+        try:
+            pool = _get_pool(4, "threading")
+
+            assert _get_pool(2, "threading") is pool
+            assert pool.n_jobs == 4
+            assert _get_pool(6, "threading").n_jobs == 6
+        finally:
+            _shutdown_default_pool()
+
+    def test_strict_backend(self):
+        from cellrank.utils._parallelize import _get_pool, _shutdown_default_pool
+
+        try:
+            with cr.ul.pool(n_jobs=2, backend="loky") as pool:
+                assert _get_pool(2, "multiprocessing") is pool
+                assert _get_pool(2, "multiprocessing", strict=True) is not pool
+                assert _get_pool(2, "loky", strict=True) is pool
+        finally:
+            _shutdown_default_pool()
+
+    def test_run_n_jobs(self):
+        import time
+        import joblib as jl
+        from threading import Lock
+        from cellrank.utils._parallelize import _WorkerPool
+
+        lock, running, max_running = Lock(), [0], [0]
+
+        def task():
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        pool = _WorkerPool(4, "threading")
+        try:
+            pool.run((jl.delayed(task)() for _ in range(20)), n_jobs=2)
+        finally:
+            pool.shutdown()
+
+        assert max_running[0] <= 2
+
+
+class TestIterTrends:
+    def test_invalid_gene(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        with pytest.raises(KeyError):
+            _ = list(cr.tl.iter_trends(adata_cr, model, "foo"))
+
+    def test_normal_run(self, adata_cr: AnnData):
+        model = create_model(adata_cr)
+        genes = list(adata_cr.var_names[:5])
+        res = list(
+            cr.tl.iter_trends(
+                adata_cr, model, genes, lineages="0", conf_int=True, n_jobs=2
+            )
+        )
+
+        assert len(res) == len(genes)
+        assert {r.gene for r in res} == set(genes)
+        for r in res:
+            assert r.lineage == "0"
+            assert r.x_test.shape == r.y_test.shape == (200,)
+            assert r.conf_int.shape == (200, 2)
+
+
+class TestTrendCache:
+    def test_lru(self):
+        cache = cr.ul.TrendCache(maxsize=2)
+        x = np.arange(3)
+        for key in ["a", "b", "c"]:
+            cache.put(key, x, x)
+
+        assert len(cache) == 2
+        assert cache.get("a") is None
+        np.testing.assert_array_equal(cache.get("c")[1], x)
+        # no confidence interval stored
+        assert cache.get("c", conf_int=True) is None
+
+    def test_disk(self, tmpdir):
+        x = np.arange(3)
+        cache = cr.ul.TrendCache(maxsize=0, dirname=str(tmpdir))
+        cache.put("a", x, x, np.c_[x, x])
+
+        assert len(cache) == 0
+        _, _, ci = cr.ul.TrendCache(dirname=str(tmpdir)).get("a", conf_int=True)
+        np.testing.assert_array_equal(ci, np.c_[x, x])
+
+    def test_iter_trends(self, adata_cr: AnnData):
+        genes = list(adata_cr.var_names[:3])
+        with cr.ul.trend_cache() as cache:
+            first = list(
+                cr.tl.iter_trends(adata_cr, create_model(adata_cr), genes, lineages="0")
+            )
+            assert cache.misses == len(genes)
+            second = list(
+                cr.tl.iter_trends(adata_cr, create_model(adata_cr), genes, lineages="0")
+            )
+            assert cache.hits == len(genes)
+
+        for a, b in zip(first, second):
+            np.testing.assert_array_equal(a.y_test, b.y_test)
+
+    @pytest.mark.parametrize("backend", ["loky", "multiprocessing"])
+    def test_process_backend(self, adata_cr: AnnData, backend: str):
+        genes = list(adata_cr.var_names[:3])
+        kwargs = dict(lineages="0", n_jobs=2, backend=backend, show_progress_bar=False)
+        with cr.ul.trend_cache() as cache:
+            first = list(
+                cr.tl.iter_trends(adata_cr, create_model(adata_cr), genes, **kwargs)
+            )
+            assert cache.misses == len(genes)
+            assert len(cache) == len(genes)
+            second = list(
+                cr.tl.iter_trends(adata_cr, create_model(adata_cr), genes, **kwargs)
+            )
+            assert cache.hits == len(genes)
+
+        first = sorted(first, key=lambda t: t.gene)
+        second = sorted(second, key=lambda t: t.gene)
+        for a, b in zip(first, second):
+            assert a.gene == b.gene
+            np.testing.assert_array_equal(a.x_test, b.x_test)
+            np.testing.assert_array_equal(a.y_test, b.y_test)
+
+    def test_gene_importance_process_backend(self, adata_cr: AnnData):
+        model, genes = create_model(adata_cr), adata_cr.var_names[:10]
+        with cr.ul.trend_cache() as cache:
+            res1 = cr.tl.gene_importance(
+                adata_cr, model, genes, "0", n_jobs=2, backend="loky", seed=42
+            )
+            assert len(cache) == len(genes)
+            res2 = cr.tl.gene_importance(
+                adata_cr, model, genes, "0", n_jobs=2, backend="loky", seed=42
+            )
+            assert cache.hits == len(genes)
+
+        pd.testing.assert_frame_equal(res1, res2)
+
+    def test_subclass_not_cached(self, adata_cr: AnnData):
+        class ShiftedModel(cr.ul.models.SKLearnModel):
+            def __init__(self, adata, model, shift: float = 0):
+                super().__init__(adata, model)
+                self.shift = shift
+
+            def predict(self, *args, **kwargs):
+                super().predict(*args, **kwargs)
+                self._y_test = self._y_test + self.shift
+                return self.y_test
+
+            def __copy__(self):
+                return type(self)(self.adata, self.model, self.shift)
+
+        genes, model = list(adata_cr.var_names[:3]), create_model(adata_cr).model
+        with cr.ul.trend_cache() as cache:
+            first = list(
+                cr.tl.iter_trends(
+                    adata_cr, ShiftedModel(adata_cr, model, 1), genes, lineages="0"
+                )
+            )
+            second = list(
+                cr.tl.iter_trends(
+                    adata_cr, ShiftedModel(adata_cr, model, 2), genes, lineages="0"
+                )
+            )
+
+            assert cache.hits == 0
+            assert len(cache) == 0
+
+        for a, b in zip(first, second):
+            np.testing.assert_allclose(a.y_test + 1, b.y_test, rtol=1e-5)
+
+
+class TestFittedTrends:
+    def test_fit(self, adata_cr: AnnData):
+        from cellrank.plotting._utils import _create_models, _fit
+        from cellrank.utils._progress import ProgressChannel
+        from cellrank.utils.models._models import _Preparer
+
+        genes, model = list(adata_cr.var_names[:3]), create_model(adata_cr)
+        models = _create_models(model, genes, ["0"])
+        res = _fit(genes, ["0"], [None], [None], ProgressChannel(0), models=models)
+
+        assert model.x is None
+        assert res[genes[0]]["0"].x_test is res[genes[1]]["0"].x_test
+        for gene in genes:
+            trend = res[gene]["0"]
+            restored = trend.to_model(_Preparer(genes), model)
+            fitted = create_model(adata_cr).prepare(gene, "0").fit()
+
+            np.testing.assert_allclose(trend.y_test, fitted.predict(), rtol=1e-5)
+            np.testing.assert_array_equal(restored.y_test, trend.y_test)
+            np.testing.assert_array_equal(np.ravel(restored.x_test), trend.x_test)
+
+    def test_fit_progress_per_block(self, adata_cr: AnnData):
+        from cellrank.plotting._utils import _create_models, _fit
+        from cellrank.utils._progress import ProgressChannel
+
+        genes, model = list(adata_cr.var_names[:3]), create_model(adata_cr)
+        models = _create_models(model, genes, ["0"])
+        queue = ProgressChannel(0)
+        _ = _fit(genes, ["0"], [None], [None], queue, models=models, block_size=2)
+
+        assert len(queue.times) == len(genes)
+        assert queue.times[0] == queue.times[1]
+
 
 class TestLineages:
     def test_no_root_cells(self, adata: AnnData):
@@ -61,7 +437,7 @@ class TestLineages:
         assert adata_cr is not adata_cr2
 
 
-class TextExcatMCTest:
+class TestExactMCTest:
     def test_invalid_cluster_obs(self, adata_cr: AnnData):
         with pytest.raises(KeyError):
             cr.tl.exact_mc_perm_test(adata_cr, "foo", "bar", "baz")
@@ -104,6 +480,84 @@ class TextExcatMCTest:
         assert isinstance(obs, float)
         assert isinstance(pval, float)
 
+    def test_n_jobs(self, adata_cr: AnnData):
+        clusters = adata_cr.obs["clusters"].cat.categories
+        res1 = cr.tl.exact_mc_perm_test(
+            adata_cr, "clusters", clusters[0], clusters[1], n_perms=300, seed=42
+        )
+        res2 = cr.tl.exact_mc_perm_test(
+            adata_cr,
+            "clusters",
+            clusters[0],
+            clusters[1],
+            n_perms=300,
+            seed=42,
+            n_jobs=2,
+        )
+
+        assert len(res1[0]) == 300
+        assert res1 == res2
+        assert res1[2] == (1 + np.sum(np.array(res1[0]) >= res1[1])) / 301
+
+
+class TestCounts:
+    def test_get_counts_global_state(self):
+        pd = np.array([0.2, 0.5, 0.3])
+        np.random.seed(42)
+        expected = np.random.choice(np.arange(3), 100, p=pd)
+        np.random.seed(42)
+        counts = _get_counts(pd, 100)
+
+        np.testing.assert_array_equal(counts, np.bincount(expected, minlength=3))
+
+    def test_get_counts_rows(self):
+        pd = np.array([[1, 0, 0], [0.5, 0.5, 0]])
+        counts = _get_counts(pd, 100, np.random.default_rng(42))
+
+        assert counts.shape == (2, 3)
+        np.testing.assert_array_equal(counts[0], [100, 1e-5, 1e-5])
+        np.testing.assert_array_equal(counts.sum(1) // 1, [100, 100])
+
+    def test_counts_seed(self, adata_cr: AnnData):
+        res1 = cr.tl._exact_mc_test._counts(adata_cr, "clusters", seed=42)
+        res2 = cr.tl._exact_mc_test._counts(
+            adata_cr, "clusters", seed=np.random.default_rng(42)
+        )
+
+        assert list(res1) == list(adata_cr.obs["clusters"].cat.categories)
+        for name in res1:
+            np.testing.assert_array_equal(res1[name], res2[name])
+
+    @pytest.mark.parametrize("k", [2, 4])
+    def test_cramers_v_matrix(self, k: int):
+        counts = np.random.RandomState(42).randint(1, 100, size=(5, k))
+        expected = [[_cramers_v(x, y) for y in counts] for x in counts]
+
+        np.testing.assert_allclose(_cramers_v_matrix(counts), expected)
+
+
+class TestSubsampleEmbedding:
+    def test_invalid_n_per_voxel(self):
+        with pytest.raises(ValueError):
+            _subsample_embedding(np.zeros((10, 2)), n_per_voxel=0)
+
+    def test_one_per_voxel(self):
+        X = np.random.RandomState(42).uniform(size=(1000, 3))
+        ixs, dist = _subsample_embedding(X, n_dim=2, n_grid_points_dim=5)
+
+        step = (X[:, :2].max(0) - X[:, :2].min(0)) * 1.05 / 4
+        assert np.all(np.diff(ixs) > 0)
+        assert len(ixs) == 25
+        np.testing.assert_allclose(dist, np.linalg.norm(step), rtol=1e-3)
+
+    def test_n_per_voxel(self):
+        X = np.random.RandomState(42).normal(size=(1000, 2))
+        ixs1, _ = _subsample_embedding(X, n_grid_points_dim=10)
+        ixs3, _ = _subsample_embedding(X, n_grid_points_dim=10, n_per_voxel=3)
+
+        assert np.all(np.isin(ixs1, ixs3))
+        assert len(ixs1) < len(ixs3) <= 3 * len(ixs1)
+
 
 class TestRootFinal:
     def test_find_root(self, adata: AnnData):
@@ -124,6 +578,38 @@ class TestRootFinal:
         with pytest.raises(ValueError):
             cr.tl.find_root(adata, percentile=110)
 
+    def test_root_final(self, adata: AnnData):
+        cr.tl.root_final(adata)
+
+        assert "root_cells" in adata.obs
+        assert "final_cells" in adata.obs
+        assert "T_fwd" in adata.uns
+        assert "T_bwd" in adata.uns
+
+    def test_root_final_copy(self, adata: AnnData):
+        adata2 = cr.tl.root_final(adata, copy=True)
+
+        assert isinstance(adata2, AnnData)
+        assert adata is not adata2
+        assert "root_cells" not in adata.obs
+        assert "final_cells" in adata2.obs
+
+    def test_root_final_show_plots(self, adata: AnnData, monkeypatch):
+        from cellrank.tools import _root_final
+
+        mcs = []
+        monkeypatch.setattr(
+            _root_final, "_plot_root_final", lambda mc, **_: mcs.append(mc)
+        )
+        cr.tl.root_final(adata, weight_connectivities=0.2, show_plots=True)
+
+        assert len(mcs) == 2
+        for mc, key in zip(mcs, ["T_bwd", "T_fwd"]):
+            assert "Conn" in repr(mc.kernel)
+            np.testing.assert_array_equal(
+                mc.kernel.transition_matrix.toarray(), adata.uns[key]["T"].toarray()
+            )
+
 
 class TestTransitionMatrix:
     def test_invalid_velocity_key(self, adata: AnnData):
@@ -158,3 +644,42 @@ class TestCytoTrace:
         assert "gcs" in adata.obs.keys()
         assert "gene_corr" in adata.var.keys()
         assert "correlates" in adata.var.keys()
+
+    def test_block_size(self, adata: AnnData):
+        res1 = cr.tl.cyto_trace(adata, copy=True)
+        res2 = cr.tl.cyto_trace(adata, copy=True, block_size=7)
+
+        np.testing.assert_array_equal(
+            res1.obs["num_exp_genes"], res2.obs["num_exp_genes"]
+        )
+        np.testing.assert_allclose(res1.var["gene_corr"], res2.var["gene_corr"])
+        np.testing.assert_allclose(res1.obs["gcs"], res2.obs["gcs"])
+
+    def test_backed(self, adata: AnnData, tmp_path):
+        expected = cr.tl.cyto_trace(adata, copy=True)
+        adata.write(tmp_path / "adata.h5ad")
+        backed = read_h5ad(tmp_path / "adata.h5ad", backed="r")
+
+        cr.tl.cyto_trace(backed, block_size=7)
+
+        assert backed.isbacked
+        np.testing.assert_array_equal(
+            backed.obs["num_exp_genes"], expected.obs["num_exp_genes"]
+        )
+        np.testing.assert_allclose(backed.var["gene_corr"], expected.var["gene_corr"])
+        np.testing.assert_allclose(backed.obs["gcs"], expected.obs["gcs"])
+
+    def test_backed_copy(self, adata: AnnData, tmp_path):
+        adata.write(tmp_path / "adata.h5ad")
+        backed = read_h5ad(tmp_path / "adata.h5ad", backed="r")
+
+        with pytest.raises(ValueError):
+            cr.tl.cyto_trace(backed, copy=True)
+
+    def test_vec_mat_corr_sparse(self):
+        X = csr_matrix(np.random.RandomState(42).poisson(0.5, size=(50, 10)))
+        y = np.random.RandomState(43).normal(size=50)
+        expected = [np.corrcoef(x, y)[0, 1] * 50 / 49 for x in X.T.toarray()]
+
+        np.testing.assert_allclose(_vec_mat_corr(X, y), expected)
+        np.testing.assert_allclose(_vec_mat_corr(X.toarray(), y), expected)